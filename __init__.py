@@ -29,10 +29,6 @@ __copyright__ = "(C) 2025 by Abdullah Azzam"
 import os
 import sys
 import inspect
-import processing
-
-from qgis.core import QgsApplication
-from .provider import ManningsRoughnessProvider
 
 class ManningsRoughnessCalculator:
     def __init__(self, parameters, context, feedback, esa_raster, lookup_table, output_raster):
@@ -62,6 +58,10 @@ def saveToCache(message, cache_path):
 
 def classFactory(iface):
     """Load the Manning's Roughness Generator plugin"""
+    # qgis is only imported here, so the gdal/numpy core modules can be used headless
+    from qgis.core import QgsApplication
+    from .provider import ManningsRoughnessProvider
+
     provider = ManningsRoughnessProvider()
     QgsApplication.processingRegistry().addProvider(provider)
     return provider
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import math
+
+import numpy as np
+from osgeo import gdal, osr
+
+from .reclassify import (
+    LC_NODATA,
+    NODATA_N,
+    BlockMask,
+    checkpoint_path,
+    create_landcover_output,
+    create_roughness_outputs,
+    finalize_outputs,
+    iter_windows,
+    open_existing_outputs,
+    prepare_overviews,
+    source_key,
+)
+from .raster_stats import STATISTICS_BYTES_PER_PIXEL
+from .scheduler import ChunkScheduler, run_key
+
+AGGREGATION_METHODS = ["mean", "mode", "geometric"]
+
+# edge of the supersampled class block warped per output block, whatever the memory budget
+MAX_FINE_BLOCK = 8192
+
+# cap on sub-samples per output cell edge, bounds memory for very coarse grids
+MAX_FACTOR = 64
+
+# cells of at least this many source pixels are sampled from the overviews of the source
+COARSE_CELL_PIXELS = 8
+
+# sub-samples per cell edge read from the overviews on coarse grids
+COARSE_SUBSAMPLES = 4
+
+
+def source_pixel_size(src, target_wkt):
+    """Approximate source pixel size in target crs units at the centre of the source"""
+    source_srs = osr.SpatialReference(wkt=src.GetProjection())
+    target_srs = osr.SpatialReference(wkt=target_wkt)
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+    gt = src.GetGeoTransform()
+    x = gt[0] + gt[1] * src.RasterXSize / 2.0
+    y = gt[3] + gt[5] * src.RasterYSize / 2.0
+    x0, y0, _ = transform.TransformPoint(x, y)
+    x1, y1, _ = transform.TransformPoint(x + gt[1], y + gt[5])
+    return min(abs(x1 - x0), abs(y1 - y0))
+
+
+def subsample_factor(cell_size, pixel_size, full_resolution=False):
+    """Sub-samples per output cell edge, and whether they are read from the source overviews
+
+    At full resolution a sub-sample is no larger than a source pixel, so
+    every source pixel of a cell is read. Cells of ``COARSE_CELL_PIXELS`` or
+    more pixels are otherwise sampled ``COARSE_SUBSAMPLES`` times per edge,
+    which lets gdal read the nearest overview level of the cloud optimized
+    tiles instead of every 10 m pixel.
+    """
+    factor = int(min(MAX_FACTOR, max(1, math.ceil(cell_size / pixel_size - 1e-6))))
+    if full_resolution or cell_size < COARSE_CELL_PIXELS * pixel_size:
+        return factor, False
+    return min(factor, COARSE_SUBSAMPLES), True
+
+
+def _cells(classes, factor):
+    """View a supersampled block as (rows, cols, factor * factor) sub-samples per cell"""
+    rows, cols = classes.shape[0] // factor, classes.shape[1] // factor
+    return classes.reshape(rows, factor, cols, factor).transpose(0, 2, 1, 3).reshape(rows, cols, factor * factor)
+
+
+def mode_classes(classes, factor, class_nodata=LC_NODATA):
+    """Most frequent valid class per output cell of a supersampled class block"""
+    cells = _cells(classes, factor)
+    present = np.unique(cells)
+    present = present[present != class_nodata]
+    if present.size == 0:
+        return np.full(cells.shape[:2], class_nodata, dtype=np.uint8)
+    counts = np.stack([(cells == value).sum(axis=-1) for value in present])
+    mode = present[counts.argmax(axis=0)].astype(np.uint8)
+    mode[counts.max(axis=0) == 0] = class_nodata
+    return mode
+
+
+def aggregate_block(classes, luts, factor, method, class_nodata=LC_NODATA):
+    """Aggregate a supersampled class block to (scenarios, rows, cols) n values
+
+    ``classes`` holds ``factor`` x ``factor`` equal-area sub-samples per output
+    cell. ``mean`` and ``geometric`` average n over the valid sub-samples, so
+    the mean is weighted by the area each class covers in the cell. ``mode``
+    takes the most frequent class of the cell and looks up its n.
+    """
+    if method == "mode":
+        return luts[:, mode_classes(classes, factor, class_nodata)]
+
+    values = luts[:, _cells(classes, factor)]
+    valid = values != NODATA_N
+    count = valid.sum(axis=-1)
+    if method == "geometric":
+        total = np.where(valid, np.log(np.where(valid, values, 1.0)), 0.0).sum(axis=-1)
+        result = np.exp(total / np.maximum(count, 1))
+    else:
+        total = np.where(valid, values, 0.0).sum(axis=-1)
+        result = total / np.maximum(count, 1)
+    return np.where(count > 0, result, NODATA_N).astype(np.float32)
+
+
+def aggregate_raster(src_path, dst_path, lut, grid, method="mean", esa_path=None,
+                     driver_name="GTiff", esa_driver_name="GTiff", band_names=None,
+                     mask_wkb=None, output_format=None, scheduler=None, statistics=None,
+                     full_resolution=False, feedback=None):
+    """Aggregate land cover to Manning's n on a target grid in one streaming pass
+
+    ``grid`` is a dict with the target ``crs`` (wkt), ``geotransform``,
+    ``xsize`` and ``ysize``. Each output chunk is warped from the source at
+    a resolution that is an integer fraction of the target cell, with nearest
+    neighbour, and reduced in memory, so no full size intermediate is
+    written. ``mask_wkb`` is a polygon in the target crs and the land cover
+    output, when requested, holds the mode class of each cell.
+    ``output_format``, ``scheduler`` and ``statistics`` are applied as in
+    ``reclassify_raster``; the class histogram then counts sub-samples, so
+    class areas are exact but the land cover output gets no histogram.
+
+    Coarse cells are sampled from the overviews of the source, see
+    ``subsample_factor``: bytes read fall by about the square of the
+    overview factor, while the class fractions of a cell become estimates
+    from ``COARSE_SUBSAMPLES`` squared nearest neighbour samples. The mean n
+    of larger areas is unbiased, that of a single mixed cell may be off by
+    the sampling error and its mode class may flip. ``full_resolution``
+    reads every source pixel.
+    """
+    if method not in AGGREGATION_METHODS:
+        raise ValueError(f"unknown aggregation method: {method}")
+
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {src_path}")
+    src_band = src.GetRasterBand(1)
+    if src_band.DataType != gdal.GDT_Byte:
+        raise RuntimeError(f"land cover raster must be uint8: {src_path}")
+
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float32))
+    src_nodata = src_band.GetNoDataValue()
+    class_nodata = LC_NODATA if src_nodata is None else int(src_nodata)
+    luts = luts.copy()
+    luts[:, class_nodata] = NODATA_N
+
+    gt = tuple(grid["geotransform"])
+    xsize, ysize = grid["xsize"], grid["ysize"]
+    cell_size = min(abs(gt[1]), abs(gt[5]))
+
+    # sub-samples per cell edge, no larger than a source pixel unless the overviews are read
+    factor, coarse = subsample_factor(cell_size, source_pixel_size(src, grid["crs"]), full_resolution)
+    # power of two chunks keep streamed overviews aligned; per cell the sub-samples and their n are held
+    scheduler = scheduler or ChunkScheduler()
+    per_cell = factor * factor * (1 + 12 * len(luts)) + 8 * len(luts)
+    if statistics is not None:
+        per_cell += STATISTICS_BYTES_PER_PIXEL
+    block = scheduler.chunk_size(per_cell, minimum=1,
+                                 maximum=max(1, MAX_FINE_BLOCK // factor))
+    if feedback is not None:
+        feedback.pushInfo(f"aggregating {factor} x {factor} sub-samples per output cell ({method}).")
+        if coarse:
+            feedback.pushInfo("coarse grid, the sub-samples are read from the land cover overviews; use full resolution for exact class fractions.")
+
+    sparse = mask_wkb is not None
+    chunks = list(iter_windows(xsize, ysize, block, block))
+    key = run_key(source_key(src), grid, method, factor, luts.tobytes(), dst_path, esa_path, driver_name, mask_wkb,
+                  block, vars(output_format) if output_format is not None else None)
+    resuming = bool(scheduler.open_checkpoint(checkpoint_path(dst_path, driver_name, output_format), key))
+    if statistics is not None:
+        statistics.start(luts, gt, grid["crs"], ysize, class_nodata, NODATA_N)
+        if resuming and feedback is not None:
+            feedback.pushWarning("statistics are not computed when resuming, the completed chunks are not read again.")
+    measured = statistics if statistics is not None and not resuming else None
+
+    outputs, dst_bands, esa = None, None, None
+    if resuming:
+        outputs, dst_bands = open_existing_outputs(dst_path, driver_name, len(luts), output_format)
+        if esa_path:
+            esa = (open_existing_outputs(esa_path, esa_driver_name, 1, output_format)[0] or [None])[0]
+        resuming = outputs is not None and (esa is not None or not esa_path)
+        if not resuming:
+            scheduler.checkpoint.done.clear()
+    if not resuming:
+        outputs, dst_bands = create_roughness_outputs(
+            dst_path, driver_name, xsize, ysize, gt, grid["crs"],
+            len(luts), band_names=band_names, sparse=sparse, output_format=output_format,
+        )
+        if esa_path:
+            esa = create_landcover_output(esa_path, esa_driver_name, xsize, ysize, gt, grid["crs"],
+                                          class_nodata, src_band.GetColorTable(), sparse=sparse, output_format=output_format)
+    factors = prepare_overviews(outputs, output_format, driver_name, xsize, ysize, block, resuming)
+    esa_band = esa.GetRasterBand(1) if esa is not None else None
+    esa_factors = prepare_overviews([esa], output_format, esa_driver_name, xsize, ysize, block, resuming) if esa is not None else []
+    src_band = None
+    src = None
+
+    def process(chunk):
+        xoff, yoff, block_xsize, block_ysize = chunk
+        mask = scheduler.local("mask", lambda: BlockMask(mask_wkb, gt)) if mask_wkb is not None else None
+        inside = mask.block(xoff, yoff, block_xsize, block_ysize) if mask is not None else True
+        if inside is None:
+            return None
+        x0 = gt[0] + xoff * gt[1]
+        y1 = gt[3] + yoff * gt[5]
+        x1 = x0 + block_xsize * gt[1]
+        y0 = y1 + block_ysize * gt[5]
+        # warp opens its own handle of the source, so chunks can run on several threads
+        fine = gdal.Warp(
+            "", src_path, format="MEM",
+            outputBounds=(x0, y0, x1, y1),
+            width=block_xsize * factor, height=block_ysize * factor,
+            dstSRS=grid["crs"], resampleAlg="near",
+            srcNodata=class_nodata, dstNodata=class_nodata,
+            outputType=gdal.GDT_Byte,
+            # the overview closest to the sub-sample size, or the full resolution
+            options=["-ovr", "AUTO" if coarse else "NONE"],
+        )
+        if fine is None:
+            raise RuntimeError(f"unable to warp land cover for block at {xoff}, {yoff}")
+        classes = fine.GetRasterBand(1).ReadAsArray()
+        fine = None
+
+        values = aggregate_block(classes, luts, factor, method, class_nodata)
+        if inside is not True:
+            values[:, ~inside] = NODATA_N
+        if output_format is not None:
+            values = output_format.quantize(values, NODATA_N)
+        modes = None
+        if esa_band is not None:
+            modes = mode_classes(classes, factor, class_nodata)
+            if inside is not True:
+                modes[~inside] = class_nodata
+        overviews = [output_format.overview_blocks(band_values, factors, NODATA_N) for band_values in values] if factors else None
+        esa_overviews = output_format.overview_blocks(modes, esa_factors, class_nodata, "nearest") if esa_factors else None
+        summary = None
+        if measured is not None:
+            if inside is not True:
+                classes[np.repeat(np.repeat(~inside, factor, axis=0), factor, axis=1)] = class_nodata
+            summary = measured.measure(classes, values, yoff, factor)
+        return values, modes, overviews, esa_overviews, summary
+
+    def write(chunk, result):
+        if result is None:
+            return
+        xoff, yoff = chunk[:2]
+        values, modes, overviews, esa_overviews, summary = result
+        if summary is not None:
+            measured.add(summary)
+        for scenario, dst_band in enumerate(dst_bands):
+            dst_band.WriteArray(values[scenario], xoff, yoff)
+            if overviews:
+                output_format.write_overview_blocks(dst_band, overviews[scenario], xoff, yoff, factors)
+        if esa_band is not None:
+            esa_band.WriteArray(modes, xoff, yoff)
+            if esa_overviews:
+                output_format.write_overview_blocks(esa_band, esa_overviews, xoff, yoff, esa_factors)
+
+    def flush():
+        for dst in outputs + ([esa] if esa is not None else []):
+            dst.FlushCache()
+
+    complete = scheduler.run(chunks, process, write, flush=flush, feedback=feedback)
+
+    flush()
+    dst_bands = None
+    outputs = None
+    esa_band = None
+    esa = None
+
+    if complete:
+        finalize_outputs(dst_path if isinstance(dst_path, (list, tuple)) else [dst_path], output_format, driver_name)
+        if esa_path:
+            finalize_outputs([esa_path], output_format, esa_driver_name)
+        if measured is not None:
+            measured.complete = True
+            measured.write_sidecars(dst_path)
+    return dst_path
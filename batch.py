@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import sys
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .reclassify import reclassify_raster
+
+
+def roughness_job(job):
+    """Reclassify one aoi in a worker process"""
+    reclassify_raster(
+        job["src_path"], job["dst_path"], job["lut"],
+        band_names=job.get("band_names"),
+        driver_name=job.get("driver_name", "GTiff"),
+        output_format=job.get("output_format"),
+    )
+    return job["dst_path"]
+
+
+def _python_executable():
+    """Interpreter for spawned workers, embedding hosts such as qgis are not python itself"""
+    executable = sys.executable
+    if os.path.basename(executable).lower().startswith("python"):
+        return executable
+    for candidate in (
+        os.path.join(sys.exec_prefix, "pythonw.exe"),
+        os.path.join(sys.exec_prefix, "python.exe"),
+        os.path.join(sys.exec_prefix, "bin", "python3"),
+    ):
+        if os.path.exists(candidate):
+            return candidate
+    return executable
+
+
+def run_jobs(jobs, workers=1, feedback=None, on_done=None, function=roughness_job):
+    """Run roughness jobs across worker processes
+
+    ``on_done(job, error)`` is called in the calling thread as each job
+    finishes, with ``error`` None on success. Pending jobs are dropped once
+    ``feedback.isCanceled()`` turns true; running ones are left to finish.
+    ``function``, a module level function taking the job, does the work;
+    its result is stored in ``job["result"]``.
+    """
+    if workers <= 1:
+        for job in jobs:
+            if feedback is not None and feedback.isCanceled():
+                break
+            try:
+                job["result"] = function(job)
+                error = None
+            except Exception as e:
+                # as from the process pool, any failure is the job's error
+                error = e
+            if on_done is not None:
+                on_done(job, error)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(_python_executable())
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = {executor.submit(function, job): job for job in jobs}
+        while pending:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    job["result"] = future.result()
+                    error = None
+                except Exception as e:
+                    error = e
+                if on_done is not None:
+                    on_done(job, error)
+            if feedback is not None and feedback.isCanceled():
+                for future in pending:
+                    future.cancel()
+                break
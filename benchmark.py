@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import functools
+import http.server
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from osgeo import gdal, osr
+
+from .instrumentation import io_counters, peak_rss_mb
+from .lookup_registry import WORLDCOVER_CLASSES, bundled_lookups, load_lookup
+from .prefetch import DEFAULT_WORKERS, RangePrefetcher
+from .reclassify import iter_windows, reclassify_raster
+
+# raster edges from 1k to 50k pixels
+DEFAULT_SIZES = (1000, 2000, 5000, 10000, 20000, 50000)
+
+# rough global share of each worldcover class, in WORLDCOVER_CLASSES order
+CLASS_SHARES = (0.30, 0.05, 0.20, 0.10, 0.01, 0.10, 0.03, 0.15, 0.02, 0.001, 0.039)
+
+# land cover patches are this many pixels wide, with single pixel speckle on top
+PATCH_SIZE = 64
+SPECKLE = 0.05
+
+WORLDCOVER_PIXEL_SIZE = 1.0 / 12000
+SOURCE_OPTIONS = ["TILED=YES", "BLOCKXSIZE=1024", "BLOCKYSIZE=1024", "COMPRESS=DEFLATE"]
+
+
+def synthetic_landcover(path, size, seed=0, origin=(0.0, 0.0)):
+    """Write a size x size uint8 worldcover-like raster in tiled, compressed worldcover layout
+
+    Classes are drawn in patches with the global class shares and a little
+    speckle, so compression and lookup behave like real land cover. The
+    raster is generated block by block, so 50k x 50k needs little memory.
+    """
+    classes = np.asarray(WORLDCOVER_CLASSES, dtype=np.uint8)
+    shares = np.asarray(CLASS_SHARES) / np.sum(CLASS_SHARES)
+    patches = -(-size // PATCH_SIZE)
+    coarse = np.random.default_rng(seed).choice(classes, size=(patches, patches), p=shares)
+
+    dst = gdal.GetDriverByName("GTiff").Create(path, size, size, 1, gdal.GDT_Byte, options=SOURCE_OPTIONS)
+    if dst is None:
+        raise RuntimeError(f"unable to create raster: {path}")
+    dst.SetGeoTransform((origin[0], WORLDCOVER_PIXEL_SIZE, 0.0, origin[1], 0.0, -WORLDCOVER_PIXEL_SIZE))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    dst.SetProjection(srs.ExportToWkt())
+    band = dst.GetRasterBand(1)
+    band.SetNoDataValue(0)
+    for xoff, yoff, xsize, ysize in iter_windows(size, size):
+        rows = np.arange(yoff, yoff + ysize) // PATCH_SIZE
+        cols = np.arange(xoff, xoff + xsize) // PATCH_SIZE
+        block = coarse[rows[:, None], cols[None, :]]
+        rng = np.random.default_rng((seed, xoff, yoff))
+        speckle = rng.random(block.shape) < SPECKLE
+        block[speckle] = rng.choice(classes, size=int(speckle.sum()), p=shares)
+        band.WriteArray(block, xoff, yoff)
+    band = None
+    dst = None
+    return path
+
+
+def synthetic_mosaic(folder, tile_size, tiles=2, seed=0):
+    """Write a tiles x tiles mosaic of synthetic tiles and a vrt over them"""
+    paths = []
+    for row in range(tiles):
+        for col in range(tiles):
+            origin = (col * tile_size * WORLDCOVER_PIXEL_SIZE, -row * tile_size * WORLDCOVER_PIXEL_SIZE)
+            path = os.path.join(folder, f"mosaic_{tile_size}_{row}_{col}.tif")
+            if not os.path.exists(path):
+                synthetic_landcover(path, tile_size, seed=seed + row * tiles + col, origin=origin)
+            paths.append(path)
+    vrt_path = os.path.join(folder, f"mosaic_{tile_size}.vrt")
+    vrt = gdal.BuildVRT(vrt_path, paths)
+    if vrt is None:
+        raise RuntimeError(f"unable to build mosaic vrt: {vrt_path}")
+    vrt = None
+    return vrt_path
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with single byte range requests over keep-alive connections, after a fixed delay"""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, latency=0.0, **kwargs):
+        self.latency = latency
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+    def do_GET(self):
+        self._send(body=True)
+
+    def _send(self, body):
+        # one round trip of an object store
+        time.sleep(self.latency)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(end, int(match.group(2))) if match.group(2) else end
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if body:
+            with open(path, "rb") as file:
+                file.seek(start)
+                self.wfile.write(file.read(end - start + 1))
+
+
+def serve_directory(root, latency=0.0, host="127.0.0.1", port=0):
+    """Serve ``root`` over http with range requests and ``latency`` seconds per request
+
+    Stands in for the remote worldcover bucket; the server runs in a daemon
+    thread until ``shutdown()``. Files are at ``http://host:server_port/name``.
+    """
+    handler = functools.partial(RangeRequestHandler, directory=root, latency=latency)
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _clip_window(size, margin=0.05):
+    """Central window standing in for an aoi that clips the source"""
+    offset = int(size * margin)
+    return offset, offset, size - 2 * offset, size - 2 * offset
+
+
+def _run_stages(src_path, dst_path, window, lut):
+    """Time read, reclassify and write separately over the same blocks"""
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    src_band = src.GetRasterBand(1)
+    win_xoff, win_yoff, win_xsize, win_ysize = window
+    dst = gdal.GetDriverByName("GTiff").Create(dst_path, win_xsize, win_ysize, len(lut), gdal.GDT_Float32)
+    dst_bands = [dst.GetRasterBand(band + 1) for band in range(len(lut))]
+    timings = {"read": 0.0, "reclassify": 0.0, "write": 0.0}
+    for xoff, yoff, xsize, ysize in iter_windows(win_xsize, win_ysize):
+        start = time.perf_counter()
+        classes = src_band.ReadAsArray(win_xoff + xoff, win_yoff + yoff, xsize, ysize)
+        read = time.perf_counter()
+        values = lut[:, classes]
+        reclassified = time.perf_counter()
+        for scenario, dst_band in enumerate(dst_bands):
+            dst_band.WriteArray(values[scenario], xoff, yoff)
+        timings["read"] += read - start
+        timings["reclassify"] += reclassified - read
+        timings["write"] += time.perf_counter() - reclassified
+    start = time.perf_counter()
+    dst_bands = None
+    dst = None
+    timings["write"] += time.perf_counter() - start
+    src = None
+    return timings
+
+
+def _run_remote(case, dst_path, window, lut):
+    """Clip and reclassify the mosaic served over http, through /vsicurl/ or the prefetcher"""
+    server = serve_directory(os.path.dirname(case["src_path"]), latency=case["latency"])
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    folder = tempfile.mkdtemp(prefix="prefetch_", dir=os.path.dirname(dst_path))
+    timings = {}
+    try:
+        win_xoff, win_yoff, win_xsize, win_ysize = window
+        tile_size = case["tile_size"]
+        sources = []
+        for name, row, col in case["tiles"]:
+            x0, y0 = max(win_xoff, col * tile_size), max(win_yoff, row * tile_size)
+            x1 = min(win_xoff + win_xsize, (col + 1) * tile_size)
+            y1 = min(win_yoff + win_ysize, (row + 1) * tile_size)
+            sources.append((f"/vsicurl/{base_url}{name}", (x0 - col * tile_size, y0 - row * tile_size, x1 - x0, y1 - y0)))
+        paths = [filename for filename, _ in sources]
+        if case["kind"] == "prefetch":
+            start = time.perf_counter()
+            prefetcher = RangePrefetcher(workers=case["workers"])
+            local = prefetcher.prefetch(sources, folder)
+            paths = [local[filename] for filename in paths]
+            timings["prefetch"] = time.perf_counter() - start
+        vrt = gdal.BuildVRT(os.path.join(folder, "remote.vrt"), paths)
+        if vrt is None:
+            raise RuntimeError("unable to build the remote mosaic vrt")
+        vrt = None
+        start = time.perf_counter()
+        reclassify_raster(os.path.join(folder, "remote.vrt"), dst_path, lut, window=window)
+        timings["read"] = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(folder, ignore_errors=True)
+    return timings
+
+
+def run_case(case):
+    """Run one benchmark case, meant to run in its own process for a clean peak rss"""
+    lut = np.stack([load_lookup(path).lut for path in case["lookups"]])
+    window = tuple(case["window"])
+    pixels = window[2] * window[3]
+    dst_path = case["dst_path"]
+    read_before, written_before = io_counters()
+    start = time.perf_counter()
+    if case["kind"] == "stages":
+        timings = _run_stages(case["src_path"], dst_path, window, lut)
+    elif case["kind"] in ("vsicurl", "prefetch"):
+        timings = _run_remote(case, dst_path, window, lut)
+    else:
+        reclassify_raster(case["src_path"], dst_path, lut, window=window)
+        timings = {}
+    seconds = time.perf_counter() - start
+    read_after, written_after = io_counters()
+
+    results = []
+    for stage, stage_seconds in [("total", seconds)] + list(timings.items()):
+        results.append({
+            "case": case["name"],
+            "stage": stage,
+            "size": case["size"],
+            "pixels": pixels,
+            "scenarios": len(lut),
+            "seconds": round(stage_seconds, 6),
+            "mpixels_per_s": round(pixels / 1e6 / stage_seconds, 3) if stage_seconds > 0 else None,
+        })
+    for result in results:
+        result.update({
+            "peak_rss_mb": peak_rss_mb(),
+            "bytes_read": read_after - read_before,
+            "bytes_written": written_after - written_before,
+            "output_bytes": os.path.getsize(dst_path) if os.path.exists(dst_path) else None,
+        })
+    if os.path.exists(dst_path):
+        gdal.GetDriverByName("GTiff").Delete(dst_path)
+    return results
+
+
+def _execute(case, isolate):
+    if not isolate:
+        return run_case(case)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, case).result()
+
+
+def build_cases(workdir, sizes, lookups, log=print, latency=None, workers=DEFAULT_WORKERS):
+    """Generate the synthetic inputs once and list the cases to run
+
+    With ``latency`` in seconds the mosaic is also served from a local http
+    server and read through /vsicurl/ and through the block prefetcher.
+    """
+    cases = []
+    for size in sizes:
+        src_path = os.path.join(workdir, f"landcover_{size}.tif")
+        if not os.path.exists(src_path):
+            log(f"generating {size} x {size} synthetic land cover...")
+            synthetic_landcover(src_path, size, seed=size)
+        for kind in ("stages", "pipeline"):
+            cases.append({
+                "name": kind,
+                "kind": kind,
+                "size": size,
+                "src_path": src_path,
+                "dst_path": os.path.join(workdir, f"out_{kind}_{size}.tif"),
+                "window": _clip_window(size),
+                "lookups": lookups,
+            })
+
+        # the same window read across the seams of a 2 x 2 tile mosaic
+        tile_size = -(-size // 2)
+        log(f"preparing {tile_size} x {tile_size} tile mosaic...")
+        vrt_path = synthetic_mosaic(workdir, tile_size, seed=size)
+        cases.append({
+            "name": "mosaic",
+            "kind": "pipeline",
+            "size": size,
+            "src_path": vrt_path,
+            "dst_path": os.path.join(workdir, f"out_mosaic_{size}.tif"),
+            "window": _clip_window(2 * tile_size),
+            "lookups": lookups,
+        })
+        if latency is not None:
+            tiles = [(f"mosaic_{tile_size}_{row}_{col}.tif", row, col) for row in range(2) for col in range(2)]
+            for kind in ("vsicurl", "prefetch"):
+                cases.append({
+                    "name": f"remote_{kind}",
+                    "kind": kind,
+                    "size": size,
+                    "src_path": vrt_path,
+                    "dst_path": os.path.join(workdir, f"out_remote_{kind}_{size}.tif"),
+                    "window": _clip_window(2 * tile_size),
+                    "lookups": lookups,
+                    "tiles": tiles,
+                    "tile_size": tile_size,
+                    "latency": latency,
+                    "workers": workers,
+                })
+    return cases
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Relative throughput change per case against a baseline run, and the regressions"""
+    reference = {(row["case"], row["stage"], row["size"]): row for row in baseline.get("results", [])}
+    changes, regressions = [], []
+    for row in results:
+        base = reference.get((row["case"], row["stage"], row["size"]))
+        if base is None or not base.get("mpixels_per_s") or not row.get("mpixels_per_s"):
+            continue
+        change = row["mpixels_per_s"] / base["mpixels_per_s"] - 1.0
+        changes.append((row["case"], row["stage"], row["size"], change))
+        if change < -tolerance:
+            regressions.append((row["case"], row["stage"], row["size"], change))
+    return changes, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Manning's roughness pipeline on synthetic WorldCover rasters.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="raster edges in pixels")
+    parser.add_argument("--workdir", help="folder for the synthetic rasters, reused between runs (default: temporary)")
+    parser.add_argument("--lookups", nargs="+", default=["med_n"], help="bundled table names or csv paths")
+    parser.add_argument("--output", default="benchmark_results.json", help="json file receiving the results")
+    parser.add_argument("--baseline", help="earlier results json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="throughput loss reported as a regression")
+    parser.add_argument("--latency", type=float, help="also read the mosaic from a local http server with this delay per request, in ms")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="prefetch workers of the remote cases")
+    parser.add_argument("--in-process", action="store_true", help="run cases in this process, peak rss is then cumulative")
+    args = parser.parse_args(argv)
+
+    gdal.UseExceptions()
+    bundled = bundled_lookups()
+    lookups = [bundled.get(name, name) for name in args.lookups]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mannings_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    latency = args.latency / 1000.0 if args.latency is not None else None
+    for case in build_cases(workdir, sorted(args.sizes), lookups, latency=latency, workers=args.workers):
+        print(f"running {case['name']} at {case['size']} x {case['size']}...", flush=True)
+        for row in _execute(case, not args.in_process):
+            results.append(row)
+            print(f"  {row['stage']:<10} {row['seconds']:>10.3f} s {row['mpixels_per_s'] or 0:>10.1f} Mpx/s "
+                  f"peak rss {row['peak_rss_mb'] or 0:.0f} mb")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "gdal": gdal.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "workdir": workdir,
+        "lookups": [os.path.basename(path) for path in lookups],
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=1)
+    print(f"results written to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            changes, regressions = compare(results, json.load(file), args.tolerance)
+        for name, stage, size, change in changes:
+            print(f"{name:<10} {stage:<10} {size:>7} {change:+.1%}")
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
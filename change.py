@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import numpy as np
+from osgeo import gdal
+
+from .reclassify import (
+    LC_NODATA,
+    NODATA_N,
+    BlockMask,
+    checkpoint_path,
+    create_roughness_outputs,
+    finalize_outputs,
+    iter_windows,
+    open_existing_outputs,
+    prepare_overviews,
+    source_key,
+)
+from .scheduler import ChunkScheduler, run_key
+
+
+def _open_landcover(path):
+    src = gdal.Open(path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {path}")
+    if src.GetRasterBand(1).DataType != gdal.GDT_Byte:
+        raise RuntimeError(f"land cover raster must be uint8: {path}")
+    return src
+
+
+def reclassify_change(src_paths, dst_paths, delta_path, lut, window=None, driver_name="GTiff",
+                      band_names=None, mask_wkb=None, output_format=None, scheduler=None, feedback=None):
+    """Reclassify two land cover vintages and their change in n in one pass
+
+    ``src_paths`` are the (earlier, later) land cover rasters on the same
+    grid, ``dst_paths`` the n rasters written for each and ``delta_path``
+    receives later minus earlier n, nodata where either is nodata. Every
+    chunk of both vintages is read once, at the same window, and ``lut``,
+    ``window``, ``mask_wkb``, ``output_format`` and ``scheduler`` are applied
+    as in ``reclassify_raster``, with one band per scenario in every output.
+
+    Returns the number of valid pixels and of pixels whose class changed,
+    over the whole window also when an interrupted run is resumed.
+    """
+    if len(src_paths) != 2 or len(dst_paths) != 2:
+        raise ValueError("change mode needs exactly two land cover vintages")
+    sources = [_open_landcover(path) for path in src_paths]
+    first = sources[0]
+    if any((src.RasterXSize, src.RasterYSize, src.GetGeoTransform()) != (first.RasterXSize, first.RasterYSize, first.GetGeoTransform())
+           for src in sources[1:]):
+        raise RuntimeError("land cover vintages are not on the same grid")
+
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float32))
+    class_nodata = []
+    for src in sources:
+        src_nodata = src.GetRasterBand(1).GetNoDataValue()
+        class_nodata.append(LC_NODATA if src_nodata is None else int(src_nodata))
+    luts = luts.copy()
+    luts[:, sorted(set(class_nodata))] = NODATA_N
+
+    if window is None:
+        window = (0, 0, first.RasterXSize, first.RasterYSize)
+    win_xoff, win_yoff, win_xsize, win_ysize = window
+    src_gt = first.GetGeoTransform()
+    geotransform = (
+        src_gt[0] + win_xoff * src_gt[1], src_gt[1], src_gt[2],
+        src_gt[3] + win_yoff * src_gt[5], src_gt[4], src_gt[5],
+    )
+    projection = first.GetProjection()
+    sparse = mask_wkb is not None
+
+    # working memory per pixel: classes of both vintages, their n and quantized copies, and the delta
+    scheduler = scheduler or ChunkScheduler()
+    block_size = scheduler.chunk_size(2 + 20 * len(luts))
+    chunks = list(iter_windows(win_xsize, win_ysize, block_size, block_size))
+    targets = list(dst_paths) + [delta_path]
+    key = run_key([source_key(src) for src in sources], window, luts.tobytes(), targets, driver_name, mask_wkb,
+                  block_size, vars(output_format) if output_format is not None else None)
+    resuming = bool(scheduler.open_checkpoint(checkpoint_path(delta_path, driver_name, output_format), key))
+    sources = first = None
+
+    outputs, bands = [], []
+    if resuming:
+        for path in targets:
+            existing, existing_bands = open_existing_outputs(path, driver_name, len(luts), output_format)
+            if existing is None:
+                outputs, bands, resuming = [], [], False
+                scheduler.checkpoint.done.clear()
+                break
+            outputs += existing
+            bands.append(existing_bands)
+    if not resuming:
+        for path in targets:
+            created, created_bands = create_roughness_outputs(
+                path, driver_name, win_xsize, win_ysize, geotransform, projection,
+                len(luts), band_names=band_names, sparse=sparse, output_format=output_format,
+            )
+            outputs += created
+            bands.append(created_bands)
+    factors = prepare_overviews(outputs, output_format, driver_name, win_xsize, win_ysize, block_size, resuming)
+    counts = {"pixels": 0, "changed": 0}
+    counted = True
+    if scheduler.checkpoint is not None:
+        # the counts of the written chunks are journaled with them, a resumed run continues them
+        state = scheduler.checkpoint.state
+        if resuming:
+            counted = "counts" in state
+            counts = state.setdefault("counts", counts)
+        else:
+            state["counts"] = counts
+
+    def thread_bands():
+        # gdal datasets are not shared between threads
+        return [
+            scheduler.local(f"src{index}", lambda path=path: gdal.Open(path, gdal.GA_ReadOnly)).GetRasterBand(1)
+            for index, path in enumerate(src_paths)
+        ]
+
+    def process(chunk):
+        xoff, yoff, block_xsize, block_ysize = chunk
+        mask = scheduler.local("mask", lambda: BlockMask(mask_wkb, geotransform)) if mask_wkb is not None else None
+        inside = mask.block(xoff, yoff, block_xsize, block_ysize) if mask is not None else True
+        if inside is None:
+            return None
+        classes = [band.ReadAsArray(win_xoff + xoff, win_yoff + yoff, block_xsize, block_ysize) for band in thread_bands()]
+        values = []
+        for vintage_classes, nodata in zip(classes, class_nodata):
+            if inside is not True:
+                vintage_classes[~inside] = nodata
+            vintage_values = luts[:, vintage_classes]
+            if output_format is not None:
+                vintage_values = output_format.quantize(vintage_values, NODATA_N)
+            values.append(vintage_values)
+        # the delta of the written values, so it matches the two n rasters exactly
+        valid = (values[0] != NODATA_N) & (values[1] != NODATA_N)
+        delta = np.where(valid, values[1] - values[0], NODATA_N).astype(np.float32)
+        values.append(delta)
+        landcover_valid = (classes[0] != class_nodata[0]) & (classes[1] != class_nodata[1])
+        changed = int(np.count_nonzero(landcover_valid & (classes[0] != classes[1])))
+        overviews = [
+            [output_format.overview_blocks(band_values, factors, NODATA_N) for band_values in output_values]
+            for output_values in values
+        ] if factors else None
+        return values, overviews, int(np.count_nonzero(landcover_valid)), changed
+
+    def write(chunk, result):
+        if result is None:
+            return
+        xoff, yoff = chunk[:2]
+        values, overviews, pixels, changed = result
+        counts["pixels"] += pixels
+        counts["changed"] += changed
+        for output, (output_values, output_bands) in enumerate(zip(values, bands)):
+            for scenario, dst_band in enumerate(output_bands):
+                dst_band.WriteArray(output_values[scenario], xoff, yoff)
+                if overviews:
+                    output_format.write_overview_blocks(dst_band, overviews[output][scenario], xoff, yoff, factors)
+
+    def flush():
+        for dst in outputs:
+            dst.FlushCache()
+
+    complete = scheduler.run(chunks, process, write, flush=flush, feedback=feedback)
+
+    flush()
+    bands = None
+    outputs = None
+
+    if complete:
+        finalize_outputs(targets, output_format, driver_name)
+        if feedback is not None and counts["pixels"]:
+            feedback.pushInfo(
+                f"land cover class changed on {counts['changed']} of {counts['pixels']} pixel(s) "
+                f"({100.0 * counts['changed'] / counts['pixels']:.2f} %)"
+                + ("." if counted else " of the chunks written since resuming, the journal held no earlier counts.")
+            )
+    return counts
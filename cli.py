@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import sys
+import time
+import argparse
+
+from osgeo import gdal, ogr, osr
+
+from .aggregate import AGGREGATION_METHODS
+from .core import RoughnessEngine, read_aoi, read_aoi_bounds, resolve_lookup, snap_grid, transform_bounds, unwrap_extent
+from .dataset_registry import CHANGE_VINTAGES, DEFAULT_VINTAGE, vintage_names, vintage_vrt
+from .ensemble import DEFAULT_ENSEMBLE_SEED, ENSEMBLE_DISTRIBUTIONS, CorrelatedEnsemble, class_ensemble, realization_lookups
+from .instrumentation import RunReport
+from .output_format import COMPRESSION_METHODS, OutputFormat
+from .prefetch import DEFAULT_WORKERS, RangePrefetcher
+from .scheduler import DEFAULT_MEMORY_MB, ChunkScheduler
+from .result_cache import DEFAULT_RESULT_CACHE_SIZE_MB
+from .tile_cache import DEFAULT_CACHE_SIZE_MB, TileCache
+from .web_tiles import DEFAULT_MIN_ZOOM
+
+LAYOUTS = ["plain", "tiled", "cog"]
+
+
+class ConsoleFeedback:
+    """Minimal stand-in for qgis processing feedback printing to the console"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self._progress = -1
+
+    def pushInfo(self, message):
+        if not self.quiet:
+            print(message, flush=True)
+
+    def pushWarning(self, message):
+        print(f"warning: {message}", file=sys.stderr, flush=True)
+
+    def setProgress(self, progress):
+        # one line per ten percent is enough for logs
+        step = int(progress // 10)
+        if step != self._progress:
+            self._progress = step
+            if not self.quiet:
+                print(f"{step * 10}%", flush=True)
+
+    def isCanceled(self):
+        return False
+
+
+def _srs_wkt(definition):
+    srs = osr.SpatialReference()
+    if srs.SetFromUserInput(definition) != 0:
+        raise ValueError(f"unknown crs: {definition}")
+    return srs.ExportToWkt()
+
+
+def _target_grid(args, bounds_4326):
+    """Target grid from the crs, resolution and snap raster options, None for the native grid"""
+    if not (args.target_crs or args.resolution or args.snap):
+        return None
+    origin, res_x, res_y, crs_wkt = (0.0, 0.0), args.resolution, args.resolution, None
+    if args.snap:
+        snap = gdal.Open(args.snap, gdal.GA_ReadOnly)
+        if snap is None:
+            raise RuntimeError(f"unable to open snap raster: {args.snap}")
+        gt = snap.GetGeoTransform()
+        origin, crs_wkt = (gt[0], gt[3]), snap.GetProjection()
+        if not args.resolution:
+            res_x, res_y = abs(gt[1]), abs(gt[5])
+        snap = None
+    if args.target_crs:
+        target_wkt = _srs_wkt(args.target_crs)
+        if crs_wkt and not osr.SpatialReference(wkt=crs_wkt).IsSame(osr.SpatialReference(wkt=target_wkt)):
+            raise ValueError("snap raster must be in the target crs")
+        crs_wkt = target_wkt
+    crs_wkt = crs_wkt or _srs_wkt("EPSG:4326")
+    if not res_x:
+        raise ValueError("a target resolution or snap raster is required with a target crs")
+    bounds = transform_bounds(bounds_4326, _srs_wkt("EPSG:4326"), crs_wkt)
+    return snap_grid(crs_wkt, bounds, res_x, res_y, origin)
+
+
+def _union(geometries):
+    union = ogr.Geometry(ogr.wkbMultiPolygon)
+    for geometry in geometries:
+        union = union.Union(geometry)
+    return union
+
+
+def _aoi_masks(args, crs_wkt=None, antimeridian=False):
+    """Wkb of the aoi polygons by name in ``crs_wkt``, default epsg:4326, for masking
+
+    With ``antimeridian`` the geographic polygons continue past 180, like
+    the window and grid of an aoi across it.
+    """
+    if args.bbox:
+        xmin, ymin, xmax, ymax = unwrap_extent(args.bbox)
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ((xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)):
+            ring.AddPoint_2D(x, y)
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+        if crs_wkt is not None:
+            source_srs = osr.SpatialReference()
+            source_srs.ImportFromEPSG(4326)
+            target_srs = osr.SpatialReference(wkt=crs_wkt)
+            source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            polygon.Transform(osr.CoordinateTransformation(source_srs, target_srs))
+        return {"aoi": bytes(polygon.ExportToWkb())}
+    # straight into the output crs, only read when masking
+    features = read_aoi(args.aoi, args.layer, args.name_field, target_wkt=crs_wkt, fids=args.fid, antimeridian=antimeridian)
+    if not args.per_feature:
+        features = [("aoi", _union([geometry for _, geometry in features]))]
+    return {name: bytes(geometry.ExportToWkb()) for name, geometry in features}
+
+
+def _driver_for_path(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {".tif": "GTiff", ".tiff": "GTiff", ".img": "HFA", ".vrt": "VRT", ".nc": "netCDF"}.get(extension, "GTiff")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="mannings_roughness_generator",
+        description="Generate Manning's roughness rasters from ESA WorldCover without QGIS.",
+    )
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument("--bbox", type=float, nargs=4, metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+                      help="aoi extent in epsg:4326, XMIN > XMAX crosses the antimeridian")
+    area.add_argument("--aoi", help="aoi polygon file readable by ogr")
+    parser.add_argument("--layer", help="layer of the aoi file, the first one by default")
+    parser.add_argument("--fid", type=int, action="append", help="only this aoi feature id, repeat for several")
+    parser.add_argument("--per-feature", action="store_true", help="one raster per aoi feature, --output is then a folder")
+    parser.add_argument("--name-field", help="attribute naming the per feature rasters")
+    parser.add_argument("-o", "--output", required=True, help="roughness raster, or folder with --per-feature")
+    parser.add_argument("--vintage", choices=vintage_names(), default=DEFAULT_VINTAGE, help="esa worldcover map year")
+    parser.add_argument("--change", action="store_true",
+                        help=f"change mode: also write the n of the other vintage (<output>_<year>) and the "
+                             f"{CHANGE_VINTAGES[1]} - {CHANGE_VINTAGES[0]} change in n (<output>_delta_n) from one read")
+    parser.add_argument("--lookup", action="append", help="bundled table name (low_n, med_n, high_n) or csv path, repeatable (default: med_n)")
+    parser.add_argument("--separate", action="store_true", help="one raster per lookup table instead of one band each")
+    parser.add_argument("--ensemble", type=int, default=0, metavar="N",
+                        help="write N monte carlo realizations of n between low_n and high_n instead of the lookup tables")
+    parser.add_argument("--distribution", choices=ENSEMBLE_DISTRIBUTIONS, default="uniform",
+                        help="ensemble distribution, triangular peaks at med_n")
+    parser.add_argument("--seed", type=int, default=DEFAULT_ENSEMBLE_SEED, help="ensemble random seed")
+    parser.add_argument("--correlation-length", type=float, default=0.0, metavar="METRES",
+                        help="vary n within classes as smooth random fields over this distance (default: one n per class)")
+    parser.add_argument("--compact", action="store_true",
+                        help="write uint8 land cover classes with the n of every lookup in an attribute table")
+    parser.add_argument("--esa-output", help="also write the clipped worldcover classes to this raster")
+    parser.add_argument("--mask", action="store_true", help="write nodata outside the aoi polygons")
+    parser.add_argument("--target-crs", help="output crs, e.g. EPSG:32633")
+    parser.add_argument("--resolution", type=float, help="output cell size in target crs units")
+    parser.add_argument("--snap", help="raster whose grid origin, crs and cell size the output follows")
+    parser.add_argument("--aggregation", choices=AGGREGATION_METHODS, default="mean", help="reduction to the target grid")
+    parser.add_argument("--full-resolution", action="store_true",
+                        help="read every 10 m pixel on coarse target grids instead of the overviews")
+    parser.add_argument("--layout", choices=LAYOUTS, default="plain", help="geotiff layout")
+    parser.add_argument("--compress", choices=COMPRESSION_METHODS, default="DEFLATE")
+    parser.add_argument("--precision", type=int, help="round n to this many decimals")
+    parser.add_argument("--cache-dir", help="local worldcover tile cache folder")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB, help="tile cache size limit in mb")
+    parser.add_argument("--offline", action="store_true", help="serve tiles only from the cache or mirror folder")
+    parser.add_argument("--mirror-dir", help="local folder holding the original worldcover tiles")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_MB, help="memory budget of the processing chunks in mb")
+    parser.add_argument("--threads", type=int, default=1, help="threads reading and computing chunks")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run from its last completed chunk")
+    parser.add_argument("--prefetch-workers", type=int, default=DEFAULT_WORKERS,
+                        help="concurrent block downloads when reading remote tiles without a cache, 0 to disable")
+    parser.add_argument("--result-cache", help="folder reusing computed n tiles between runs")
+    parser.add_argument("--result-cache-size", type=int, default=DEFAULT_RESULT_CACHE_SIZE_MB, help="result cache size limit in mb")
+    parser.add_argument("--web-tiles", help="also write styled web tiles to this .mbtiles or .gpkg file")
+    parser.add_argument("--web-tiles-landcover", action="store_true", help="add a land cover tileset to the web tiles")
+    parser.add_argument("--min-zoom", type=int, default=DEFAULT_MIN_ZOOM, help="coarsest web tile zoom")
+    parser.add_argument("--max-zoom", type=int, help="deepest web tile zoom (default: matching the land cover resolution)")
+    parser.add_argument("--zones", help="also write the land cover zones with their n to this geopackage")
+    parser.add_argument("--min-zone-area", type=float, default=0.0, help="merge zones smaller than this many square metres")
+    parser.add_argument("--simplify", type=float, default=0.0, help="zone simplification tolerance in pixels")
+    parser.add_argument("--statistics", action="store_true",
+                        help="class areas and n statistics from the same pass, logged and stored in .aux.xml sidecars")
+    parser.add_argument("--report", help="write per stage timings, bytes read and peak memory to this json file")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    return parser
+
+
+def _print_statistics(name, statistics, feedback):
+    units = "km2" if statistics["area_units"] == "m2" else "area"
+    scale = 1e-6 if statistics["area_units"] == "m2" else 1.0
+    for row in statistics["classes"]:
+        feedback.pushInfo(f"{name}: class {row['class']:>3} {row['label']:<32} {row['area'] * scale:12.3f} {units} {row['fraction'] * 100:6.2f} %")
+    for stats in statistics["n"]:
+        if stats["count"]:
+            feedback.pushInfo(
+                f"{name}: n {stats['name']} min {stats['min']:.4f} p5 {stats['p5']:.4f} median {stats['p50']:.4f} "
+                f"p95 {stats['p95']:.4f} max {stats['max']:.4f} mean {stats['mean']:.4f} std {stats['std']:.4f}"
+            )
+
+
+def _check_args(parser, args):
+    """Reject option values and combinations that cannot run, through ``parser.error``"""
+    if args.ensemble and args.change:
+        parser.error("--ensemble cannot be combined with --change")
+    if args.change and (args.compact or args.zones):
+        parser.error("--compact and --zones cannot be combined with --change")
+    if args.bbox and (args.fid or args.name_field):
+        parser.error("--fid and --name-field need --aoi")
+    if args.bbox and not -90.0 <= args.bbox[1] < args.bbox[3] <= 90.0:
+        parser.error("--bbox needs -90 <= YMIN < YMAX <= 90")
+    for option, value, minimum in (("--threads", args.threads, 1), ("--memory", args.memory, 1),
+                                   ("--cache-size", args.cache_size, 0), ("--result-cache-size", args.result_cache_size, 0),
+                                   ("--prefetch-workers", args.prefetch_workers, 0), ("--ensemble", args.ensemble, 0),
+                                   ("--min-zoom", args.min_zoom, 0)):
+        if value < minimum:
+            parser.error(f"{option} must be at least {minimum}")
+    for option, value in (("--correlation-length", args.correlation_length), ("--min-zone-area", args.min_zone_area),
+                          ("--simplify", args.simplify)):
+        if value < 0:
+            parser.error(f"{option} cannot be negative")
+    if args.resolution is not None and args.resolution <= 0:
+        parser.error("--resolution must be positive")
+    if args.precision is not None and args.precision < 0:
+        parser.error("--precision cannot be negative")
+    if args.max_zoom is not None and args.max_zoom < args.min_zoom:
+        parser.error("--max-zoom must not be below --min-zoom")
+    if args.target_crs:
+        try:
+            _srs_wkt(args.target_crs)
+        except (ValueError, RuntimeError) as e:
+            parser.error(f"--target-crs: {e}")
+
+
+def main(argv=None):
+    """Run the command line, returning the exit status
+
+    Invalid arguments exit through argparse with status 2; failures of the
+    run itself, e.g. an aoi outside the land cover or an unreadable snap
+    raster, print their message and return 1.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    _check_args(parser, args)
+    feedback = ConsoleFeedback(args.quiet)
+    try:
+        return _run(args, feedback, argv)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr, flush=True)
+        return 1
+
+
+def _run(args, feedback, argv=None):
+    started = time.perf_counter()
+    lookups = [resolve_lookup(name) for name in (args.lookup or ["med_n"])]
+    for lookup in lookups:
+        if lookup.missing:
+            feedback.pushWarning(f"lookup table {lookup.name} has no n for classes {', '.join(map(str, lookup.missing))}.")
+    band_names = [lookup.name for lookup in lookups]
+
+    tile_cache = None
+    if args.cache_dir or args.offline or args.mirror_dir:
+        cache_dir = args.cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "mannings_roughness")
+        tile_cache = TileCache(cache_dir, max_size_mb=args.cache_size, offline=args.offline, mirror_dir=args.mirror_dir)
+    output_format = None
+    if args.layout != "plain":
+        output_format = OutputFormat(compress=args.compress, cog=args.layout == "cog", precision=args.precision)
+
+    # every aoi is served by the same engine, the tile index is loaded once
+    scheduler = ChunkScheduler(memory_mb=args.memory, threads=args.threads, resume=args.resume)
+    prefetcher = RangePrefetcher(workers=args.prefetch_workers) if args.prefetch_workers > 0 else None
+    engine = RoughnessEngine(
+        vrt_path=vintage_vrt(args.vintage),
+        tile_cache=tile_cache,
+        result_cache_dir=args.result_cache,
+        result_cache_size_mb=args.result_cache_size,
+        prefetcher=prefetcher,
+    )
+    other_engine = None
+    if args.change:
+        if args.target_crs or args.resolution or args.snap:
+            feedback.pushWarning("change mode writes on the worldcover grid, the target grid is ignored.")
+        if args.esa_output or args.web_tiles or args.statistics or args.separate:
+            feedback.pushWarning("change mode writes n bands only, land cover, web tile, statistics and separate outputs are skipped.")
+        other = CHANGE_VINTAGES[1] if args.vintage == CHANGE_VINTAGES[0] else CHANGE_VINTAGES[0]
+        other_engine = RoughnessEngine(vrt_path=vintage_vrt(other), tile_cache=tile_cache, prefetcher=prefetcher)
+
+    # realizations are gathered from the same class blocks, like several lookup tables
+    field = None
+    if args.ensemble > 0:
+        if args.lookup:
+            feedback.pushWarning("ensembles are drawn between low_n and high_n, --lookup is ignored.")
+        low, high = resolve_lookup("low_n"), resolve_lookup("high_n")
+        mode = resolve_lookup("med_n") if args.distribution == "triangular" else None
+        if args.correlation_length > 0:
+            # metres to land cover pixels, along the meridian
+            pixels = args.correlation_length / (abs(engine.tile_index.geotransform[5]) * 111320.0)
+            field = CorrelatedEnsemble(low, high, args.ensemble, pixels, seed=args.seed, mode=mode)
+            lookups = realization_lookups(field.luts)
+        else:
+            lookups = realization_lookups(class_ensemble(low, high, args.ensemble, seed=args.seed, mode=mode))
+        band_names = [lookup.name for lookup in lookups]
+    report = RunReport("cli", remote_counters=[engine.downloaded_bytes], metadata={"argv": list(sys.argv[1:] if argv is None else argv)})
+    if args.bbox:
+        aois = [("aoi", unwrap_extent(args.bbox))]
+    else:
+        # extents from the densified bounding boxes, the polygons are only read to mask
+        aois = read_aoi_bounds(args.aoi, args.layer, args.name_field, fids=args.fid, per_feature=args.per_feature)
+
+    if args.per_feature:
+        os.makedirs(args.output, exist_ok=True)
+    masks = {}
+    for name, bounds in aois:
+        grid = _target_grid(args, bounds)
+        mask_wkb = None
+        if args.mask:
+            # the same crs for every aoi, the change path stays in epsg:4326
+            crs_wkt, antimeridian = None, bounds[2] > 180.0
+            if grid is not None and other_engine is None:
+                gt = grid["geotransform"]
+                crs_wkt = grid["crs"]
+                antimeridian = osr.SpatialReference(wkt=crs_wkt).IsGeographic() and gt[0] + grid["xsize"] * gt[1] > 180.0
+            if antimeridian not in masks:
+                masks[antimeridian] = _aoi_masks(args, crs_wkt, antimeridian)
+            mask_wkb = masks[antimeridian][name]
+        output = os.path.join(args.output, f"{name}.tif") if args.per_feature else args.output
+        if args.separate and len(lookups) > 1 and not args.compact:
+            base, extension = os.path.splitext(output)
+            dst_path = [f"{base}_{lookup.name}{extension}" for lookup in lookups]
+        else:
+            dst_path = output
+        esa_path = args.esa_output
+        if esa_path and args.per_feature:
+            esa_path = os.path.join(args.output, f"{name}_esa_worldcover.tif")
+
+        web_tiles = None
+        if args.web_tiles:
+            web_tiles = {
+                "path": os.path.join(args.output, f"{name}{os.path.splitext(args.web_tiles)[1]}") if args.per_feature else args.web_tiles,
+                "landcover": args.web_tiles_landcover,
+                "min_zoom": args.min_zoom,
+                "max_zoom": args.max_zoom,
+            }
+
+        zones = None
+        if args.zones:
+            zones = {
+                "path": os.path.join(args.output, f"{name}_zones.gpkg") if args.per_feature else args.zones,
+                "min_area": args.min_zone_area,
+                "simplify": args.simplify,
+                "workers": args.threads,
+            }
+
+        feedback.pushInfo(f"{name}: writing {output}")
+        report.aoi = name
+        if other_engine is not None:
+            base, extension = os.path.splitext(output)
+            targets = {args.vintage: output, other: f"{base}_{other}{extension}"}
+            earlier, later = (engine, other_engine) if args.vintage == CHANGE_VINTAGES[0] else (other_engine, engine)
+            engine_result = later.run_change(
+                earlier, bounds, [targets[vintage] for vintage in CHANGE_VINTAGES], f"{base}_delta_n{extension}", lookups,
+                band_names=band_names,
+                mask_wkb=mask_wkb,
+                output_format=output_format,
+                driver_name=_driver_for_path(output),
+                scheduler=scheduler,
+                report=report,
+                feedback=feedback,
+            )
+            feedback.pushInfo(f"{name}: change in n written to {engine_result['delta']}")
+            continue
+        result = engine.run(
+            bounds, dst_path, lookups,
+            esa_path=esa_path,
+            band_names=band_names,
+            mask_wkb=mask_wkb,
+            target_grid=grid,
+            aggregation=args.aggregation,
+            output_format=output_format,
+            driver_name=_driver_for_path(output),
+            esa_driver_name=_driver_for_path(esa_path) if esa_path else "GTiff",
+            web_tiles=web_tiles,
+            scheduler=scheduler,
+            report=report,
+            statistics=args.statistics,
+            field=field,
+            compact=args.compact,
+            full_resolution=args.full_resolution,
+            zones=zones,
+            feedback=feedback,
+        )
+        if result["statistics"] is not None:
+            _print_statistics(name, result["statistics"], feedback)
+            report.metadata.setdefault("statistics", {})[name] = result["statistics"]
+    report.aoi = None
+    for line in report.summary():
+        feedback.pushInfo(line)
+    if args.report:
+        report.write(args.report)
+        feedback.pushInfo(f"run report written to: {args.report}")
+    feedback.pushInfo(f"{len(aois)} aoi(s) done in {time.perf_counter() - started:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
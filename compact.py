@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import json
+
+import numpy as np
+from osgeo import gdal
+
+from .lookup_registry import WORLDCOVER_CLASSES
+from .raster_stats import class_labels
+from .reclassify import DEFAULT_BLOCK_SIZE, NODATA_N, iter_windows
+from .web_tiles import colorize_ramp, read_color_ramp
+
+COMPACT_DOMAIN = "MANNINGS_N"
+
+
+def compact_color_table(lut, ramp=None, nodata=NODATA_N):
+    """Palette colouring every class with the n ramp of ``mannings_n.qml``, classes without n are transparent"""
+    rgba = colorize_ramp(np.asarray(lut, dtype=np.float32), ramp or read_color_ramp(), nodata)
+    table = gdal.ColorTable()
+    for value in range(256):
+        table.SetColorEntry(value, tuple(int(channel) for channel in rgba[value]))
+    return table
+
+
+def _column_names(names):
+    return ["n"] if len(names) == 1 else [f"n_{name}" for name in names]
+
+
+def write_lookup_table(path, luts, names, nodata=NODATA_N):
+    """Attach the n of every class and scenario to a compact class raster
+
+    The lookups are stored as json in the ``MANNINGS_N`` metadata domain and
+    as a raster attribute table with the class, its label and one n column
+    per scenario. Both go to the .aux.xml sidecar, so a scenario switch
+    rewrites the sidecar only, never the pixels.
+    """
+    luts = np.atleast_2d(np.asarray(luts, dtype=np.float32))
+    if len(names) != len(luts):
+        raise ValueError("one name per lookup is needed")
+    labels = class_labels()
+    classes = sorted(set(WORLDCOVER_CLASSES) | set(int(value) for value in np.flatnonzero((luts != nodata).any(axis=0))))
+
+    dst = gdal.Open(path, gdal.GA_ReadOnly)
+    if dst is None:
+        raise RuntimeError(f"unable to open compact raster: {path}")
+    band = dst.GetRasterBand(1)
+    table = gdal.RasterAttributeTable()
+    table.CreateColumn("Value", gdal.GFT_Integer, gdal.GFU_MinMax)
+    table.CreateColumn("Class", gdal.GFT_String, gdal.GFU_Name)
+    for column in _column_names(names):
+        table.CreateColumn(column, gdal.GFT_Real, gdal.GFU_Generic)
+    table.SetRowCount(len(classes))
+    for row, value in enumerate(classes):
+        table.SetValueAsInt(row, 0, value)
+        table.SetValueAsString(row, 1, labels.get(value, ""))
+        for scenario, lut in enumerate(luts):
+            table.SetValueAsDouble(row, 2 + scenario, float(lut[value]))
+    band.SetDefaultRAT(table)
+    band.SetMetadataItem("LOOKUPS", json.dumps({
+        "nodata": nodata,
+        "scenarios": [
+            {"name": name, "n": {str(value): float(lut[value]) for value in classes if lut[value] != nodata}}
+            for name, lut in zip(names, luts)
+        ],
+    }), COMPACT_DOMAIN)
+    band.SetDescription(names[0] if len(names) == 1 else "land cover class")
+    dst = band = None
+
+
+def read_lookup_table(band, nodata=NODATA_N):
+    """Scenario names and (scenarios, 256) lookups of a compact class band, from its metadata or its attribute table"""
+    text = band.GetMetadataItem("LOOKUPS", COMPACT_DOMAIN)
+    if text:
+        data = json.loads(text)
+        names = [scenario["name"] for scenario in data["scenarios"]]
+        luts = np.full((len(names), 256), data.get("nodata", nodata), dtype=np.float32)
+        for lut, scenario in zip(luts, data["scenarios"]):
+            for value, n_value in scenario["n"].items():
+                lut[int(value)] = n_value
+        return names, luts
+
+    table = band.GetDefaultRAT()
+    if table is None:
+        raise ValueError("raster holds no n lookups, it is not a compact roughness raster")
+    columns = [table.GetNameOfCol(column) for column in range(table.GetColumnCount())]
+    n_columns = [column for column, name in enumerate(columns) if name == "n" or name.startswith("n_")]
+    if "Value" not in columns or not n_columns:
+        raise ValueError("attribute table has no class and n columns")
+    value_column = columns.index("Value")
+    names = [columns[column][2:] or "n" for column in n_columns]
+    luts = np.full((len(names), 256), nodata, dtype=np.float32)
+    for row in range(table.GetRowCount()):
+        value = table.GetValueAsInt(row, value_column)
+        for scenario, column in enumerate(n_columns):
+            luts[scenario, value] = table.GetValueAsDouble(row, column)
+    return names, luts
+
+
+class CompactRoughness:
+    """Reader of a compact class raster that expands blocks to float32 n on demand
+
+    ``names`` and ``luts`` hold the scenarios of the raster; ``read`` gathers
+    the n of one scenario, or of all as a (scenarios, rows, cols) array, for
+    a window, and ``blocks`` does so block by block over the whole raster.
+    """
+
+    def __init__(self, path, nodata=NODATA_N):
+        self.path = path
+        self.nodata = nodata
+        self.dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        if self.dataset is None:
+            raise RuntimeError(f"unable to open compact raster: {path}")
+        self.band = self.dataset.GetRasterBand(1)
+        if self.band.DataType != gdal.GDT_Byte:
+            raise ValueError(f"compact raster must be uint8: {path}")
+        self.names, self.luts = read_lookup_table(self.band, nodata)
+        class_nodata = self.band.GetNoDataValue()
+        if class_nodata is not None and 0 <= class_nodata <= 255:
+            self.luts[:, int(class_nodata)] = nodata
+        self.xsize = self.dataset.RasterXSize
+        self.ysize = self.dataset.RasterYSize
+        self.geotransform = self.dataset.GetGeoTransform()
+        self.projection = self.dataset.GetProjection()
+
+    def _scenario(self, scenario):
+        if isinstance(scenario, str):
+            if scenario not in self.names:
+                raise ValueError(f"unknown scenario: {scenario}")
+            return self.names.index(scenario)
+        return scenario
+
+    def read(self, scenario=0, xoff=0, yoff=0, xsize=None, ysize=None):
+        """Float32 n of a window, ``scenario`` is an index, a name or None for all"""
+        xsize = self.xsize - xoff if xsize is None else xsize
+        ysize = self.ysize - yoff if ysize is None else ysize
+        classes = self.band.ReadAsArray(xoff, yoff, xsize, ysize)
+        if scenario is None:
+            return self.luts[:, classes]
+        return self.luts[self._scenario(scenario)][classes]
+
+    def blocks(self, scenario=0, block_size=DEFAULT_BLOCK_SIZE):
+        """Yield (xoff, yoff, n) for blocks covering the raster"""
+        for xoff, yoff, xsize, ysize in iter_windows(self.xsize, self.ysize, block_size, block_size):
+            yield xoff, yoff, self.read(scenario, xoff, yoff, xsize, ysize)
+
+    def close(self):
+        self.band = None
+        self.dataset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
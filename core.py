@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import re
+import shutil
+import tempfile
+import functools
+
+import numpy as np
+from osgeo import ogr, osr
+
+from .aggregate import AGGREGATION_METHODS, aggregate_raster, subsample_factor
+from .change import reclassify_change
+from .compact import compact_color_table, write_lookup_table
+from .dataset_registry import DEFAULT_VINTAGE, vintage_vrt
+from .instrumentation import stage
+from .lookup_registry import bundled_lookups, load_lookup
+from .polygonize import polygonize_classes
+from .prefetch import is_remote
+from .raster_stats import RasterStatistics
+from .reclassify import reclassify_raster, window_from_extent
+from .result_cache import DEFAULT_RESULT_CACHE_SIZE_MB, ResultCache, WindowResultCache, snap_window
+from .tile_index import TileIndex, index_path_for
+from .web_tiles import WebTileBuilder, export_web_tiles
+
+DEFAULT_VRT = vintage_vrt(DEFAULT_VINTAGE)
+
+# buffer around the aoi in land cover pixels
+PIXEL_BUFFER = 2
+
+
+def resolve_lookup(name_or_path):
+    """Compiled lookup table from a bundled table name, e.g. med_n, or a csv path"""
+    bundled = bundled_lookups()
+    return load_lookup(bundled.get(name_or_path, name_or_path))
+
+
+def snap_grid(crs_wkt, bounds, res_x, res_y, origin=(0.0, 0.0)):
+    """Target grid covering ``bounds`` (xmin, ymin, xmax, ymax) with cells aligned to ``origin``"""
+    if res_x <= 0 or res_y <= 0:
+        raise ValueError("target resolution must be positive")
+    xmin = origin[0] + np.floor((bounds[0] - origin[0]) / res_x) * res_x
+    xmax = origin[0] + np.ceil((bounds[2] - origin[0]) / res_x) * res_x
+    ymin = origin[1] + np.floor((bounds[1] - origin[1]) / res_y) * res_y
+    ymax = origin[1] + np.ceil((bounds[3] - origin[1]) / res_y) * res_y
+    return {
+        "crs": crs_wkt,
+        "geotransform": (float(xmin), res_x, 0.0, float(ymax), 0.0, -res_y),
+        "xsize": max(1, int(round((xmax - xmin) / res_x))),
+        "ysize": max(1, int(round((ymax - ymin) / res_y))),
+    }
+
+
+def unwrap_extent(extent):
+    """Extent with xmin > xmax, i.e. across the antimeridian, as a continuous one with xmax past 180"""
+    xmin, ymin, xmax, ymax = extent
+    if xmin > xmax:
+        xmax += 360.0
+    return xmin, ymin, xmax, ymax
+
+
+def geographic_extent(boxes):
+    """Extent of (xmin, ymin, xmax, ymax) longitude boxes, with xmin > xmax when it crosses the antimeridian
+
+    The widest empty gap in longitude is left out. When it lies between the
+    boxes and is wider than the one across 180, e.g. for parts split at the
+    antimeridian, the extent runs from its east end over 180 to its west end.
+    """
+    boxes = sorted(boxes)
+    ymin, ymax = min(box[1] for box in boxes), max(box[3] for box in boxes)
+    reach, gap, west, east = boxes[0][2], 0.0, None, None
+    for box in boxes[1:]:
+        if box[0] - reach > gap:
+            gap, west, east = box[0] - reach, reach, box[0]
+        reach = max(reach, box[2])
+    xmin, xmax = boxes[0][0], reach
+    if gap > (180.0 - xmax) + (xmin + 180.0):
+        return east, ymin, west, ymax
+    return xmin, ymin, xmax, ymax
+
+
+def transform_bounds(bounds, source_wkt, target_wkt, densify=21):
+    """Bounds of a rectangle after reprojection, sampled along its edges
+
+    Geographic bounds across the antimeridian are returned continuous, with
+    xmax past 180, instead of spanning every longitude; geographic source
+    bounds with xmin > xmax are taken as crossing it.
+    """
+    source_srs = osr.SpatialReference(wkt=source_wkt)
+    target_srs = osr.SpatialReference(wkt=target_wkt)
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if source_srs.IsGeographic():
+        bounds = unwrap_extent(bounds)
+    if source_srs.IsSame(target_srs):
+        return tuple(bounds)
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+    xmin, ymin, xmax, ymax = bounds
+    steps = np.linspace(0.0, 1.0, densify)
+    xs = np.concatenate([xmin + steps * (xmax - xmin), np.full(densify, xmax), xmax - steps * (xmax - xmin), np.full(densify, xmin)])
+    ys = np.concatenate([np.full(densify, ymin), ymin + steps * (ymax - ymin), np.full(densify, ymax), ymax - steps * (ymax - ymin)])
+    points = np.array(transform.TransformPoints(list(zip(xs.tolist(), ys.tolist()))))
+    xs = points[:, 0]
+    if target_srs.IsGeographic() and xs.max() - xs.min() > 180.0:
+        shifted = np.where(xs < 0.0, xs + 360.0, xs)
+        if shifted.max() - shifted.min() < xs.max() - xs.min():
+            xs = shifted
+    return float(xs.min()), float(points[:, 1].min()), float(xs.max()), float(points[:, 1].max())
+
+
+def _aoi_features(path, layer_name=None, fids=None):
+    """Layer and features of an aoi, with ``fids`` only those, read by id without scanning the layer"""
+    source = ogr.Open(path)
+    if source is None:
+        raise RuntimeError(f"unable to open aoi: {path}")
+    layer = source.GetLayerByName(layer_name) if layer_name else source.GetLayer(0)
+    if layer is None:
+        raise RuntimeError(f"aoi layer not found: {layer_name or 0}")
+    selected = []
+    for fid in fids or []:
+        feature = layer.GetFeature(fid)
+        if feature is None:
+            raise RuntimeError(f"aoi feature {fid} not found")
+        selected.append(feature)
+    # the source is returned too, the layer is only valid while it is open
+    return source, layer, selected if fids else layer
+
+
+def _aoi_names(features, name_field):
+    """(name, geometry) of the features with a geometry, names made file-system safe and unique"""
+    used_names = set()
+    for feature in features:
+        geometry = feature.GetGeometryRef()
+        if geometry is None or geometry.IsEmpty():
+            continue
+        value = feature.GetField(name_field) if name_field else None
+        name = re.sub(r"[^\w\-.]+", "_", str(value)).strip("_") if value not in (None, "") else ""
+        name = name or f"feature_{feature.GetFID()}"
+        unique, suffix = name, 1
+        while unique.lower() in used_names:
+            suffix += 1
+            unique = f"{name}_{suffix}"
+        used_names.add(unique.lower())
+        yield unique, feature, geometry
+
+
+def _shift_x(geometry, offset):
+    """Move a geometry and its parts by ``offset`` along x, in place"""
+    for index in range(geometry.GetGeometryCount()):
+        _shift_x(geometry.GetGeometryRef(index), offset)
+    for index in range(geometry.GetPointCount()):
+        geometry.SetPoint_2D(index, geometry.GetX(index) + offset, geometry.GetY(index))
+
+
+def _part_envelopes(geometry):
+    """(xmin, ymin, xmax, ymax) of each part of a geometry"""
+    if ogr.GT_Flatten(geometry.GetGeometryType()) in (ogr.wkbMultiPolygon, ogr.wkbGeometryCollection):
+        parts = [geometry.GetGeometryRef(index) for index in range(geometry.GetGeometryCount())]
+    else:
+        parts = [geometry]
+    return [(xmin, ymin, xmax, ymax) for xmin, xmax, ymin, ymax in (part.GetEnvelope() for part in parts)]
+
+
+def read_aoi(path, layer_name=None, name_field=None, target_wkt=None, fids=None, antimeridian=False):
+    """Read aoi polygons with ogr as (name, geometry) pairs in ``target_wkt``, default epsg:4326
+
+    Names come from ``name_field`` when given, else from the feature id, and
+    are made file-system safe and unique. With ``fids`` only those features
+    are read, by id, without scanning the layer. With ``antimeridian`` the
+    polygons are taken to longitudes about 180 degrees, so they stay whole
+    with x continuing past 180.
+    """
+    source, layer, selected = _aoi_features(path, layer_name, fids)
+    target_srs = osr.SpatialReference()
+    if antimeridian:
+        target_srs.ImportFromProj4("+proj=longlat +ellps=WGS84 +towgs84=0,0,0 +pm=180 +no_defs")
+    elif target_wkt:
+        target_srs.ImportFromWkt(target_wkt)
+    else:
+        target_srs.ImportFromEPSG(4326)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = None
+    source_srs = layer.GetSpatialRef()
+    if source_srs is None and antimeridian:
+        source_srs = osr.SpatialReference()
+        source_srs.ImportFromEPSG(4326)
+    if source_srs is not None and not source_srs.IsSame(target_srs):
+        source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(source_srs, target_srs)
+
+    features = []
+    for name, feature, geometry in _aoi_names(selected, name_field):
+        geometry = geometry.Clone()
+        if transform is not None and geometry.Transform(transform) != 0:
+            raise RuntimeError(f"unable to reproject aoi feature {feature.GetFID()}")
+        if antimeridian:
+            _shift_x(geometry, 180.0)
+        features.append((name, geometry))
+    if not features:
+        raise RuntimeError(f"aoi has no polygon geometry: {path}")
+    return features
+
+
+def read_aoi_bounds(path, layer_name=None, name_field=None, fids=None, per_feature=False):
+    """Extents of an aoi in epsg:4326 as (name, (xmin, ymin, xmax, ymax)) pairs, no polygon is reprojected
+
+    The bounding box of the layer, of the ``fids`` features or, with
+    ``per_feature``, of each feature under the names of :func:`read_aoi`, is
+    transformed along its densified edges. An extent across the antimeridian
+    is continuous, with xmax past 180. In a geographic layer crs the boxes of
+    the polygon parts are gathered, as parts split at the antimeridian only
+    show as a gap between them.
+    """
+    source, layer, selected = _aoi_features(path, layer_name, fids)
+    source_srs = layer.GetSpatialRef()
+    target_srs = osr.SpatialReference()
+    target_srs.ImportFromEPSG(4326)
+    target_wkt = target_srs.ExportToWkt()
+    source_wkt = source_srs.ExportToWkt() if source_srs is not None else target_wkt
+    geographic = source_srs is None or source_srs.IsGeographic()
+
+    if per_feature or fids or geographic:
+        boxes = [(name, _part_envelopes(geometry)) for name, _, geometry in _aoi_names(selected, name_field)]
+    elif layer.GetFeatureCount() > 0:
+        xmin, xmax, ymin, ymax = layer.GetExtent()
+        boxes = [("aoi", [(xmin, ymin, xmax, ymax)])]
+    else:
+        boxes = []
+    if not boxes:
+        raise RuntimeError(f"aoi has no polygon geometry: {path}")
+    if not per_feature:
+        boxes = [("aoi", [box for _, parts in boxes for box in parts])]
+    extents = []
+    for name, parts in boxes:
+        if geographic:
+            extent = geographic_extent(parts)
+        else:
+            extent = (min(box[0] for box in parts), min(box[1] for box in parts),
+                      max(box[2] for box in parts), max(box[3] for box in parts))
+        extents.append((name, transform_bounds(extent, source_wkt, target_wkt)))
+    return extents
+
+
+class RoughnessEngine:
+    """Manning's n generator over the WorldCover mosaic, free of qgis
+
+    An engine loads the tile index once and can serve any number of aois,
+    which keeps per aoi overhead to the actual raster work in long-lived
+    processes. ``feedback`` arguments only need ``pushInfo``,
+    ``pushWarning``, ``setProgress`` and ``isCanceled``.
+
+    With ``result_cache_dir`` computed n tiles are kept between runs and a
+    run only reads and computes the tiles that are new or whose classes got
+    a different n. Without a tile cache, a ``prefetcher`` fetches the blocks
+    of the remote tiles under the window concurrently before they are read.
+    """
+
+    def __init__(self, vrt_path=DEFAULT_VRT, tile_cache=None, workdir=None,
+                 result_cache_dir=None, result_cache_size_mb=DEFAULT_RESULT_CACHE_SIZE_MB, prefetcher=None):
+        self.vrt_path = vrt_path
+        self.tile_index = TileIndex.load(index_path_for(vrt_path))
+        self.tile_cache = tile_cache
+        self.prefetcher = prefetcher
+        self._block_dirs = []
+        self.workdir = workdir or tempfile.gettempdir()
+        self.pixel_size = abs(self.tile_index.geotransform[1])
+        self.result_cache = None
+        if result_cache_dir:
+            # the source template carries the product version, e.g. v200/2021
+            self.result_cache = ResultCache(
+                result_cache_dir,
+                f"{self.tile_index.source_template}|{self.tile_index.nodata}",
+                max_size_mb=result_cache_size_mb,
+                class_nodata=self.tile_index.nodata,
+            )
+
+    def window(self, extent):
+        """Land cover pixel window of an (xmin, ymin, xmax, ymax) extent in the mosaic crs, buffered
+
+        An extent across the antimeridian, with xmin > xmax or xmax past 180,
+        gives a window continuing past the east edge of the mosaic, see
+        ``crosses_antimeridian``.
+        """
+        extent = unwrap_extent(extent)
+        buffer = PIXEL_BUFFER * self.pixel_size
+        buffered = (extent[0] - buffer, extent[1] - buffer, extent[2] + buffer, extent[3] + buffer)
+        return window_from_extent(
+            self.tile_index.geotransform, buffered, self.tile_index.raster_xsize, self.tile_index.raster_ysize,
+            wrap=self.tile_index.wraps,
+        )
+
+    def crosses_antimeridian(self, window):
+        """True when a window continues past the east edge of the mosaic"""
+        return window[0] + window[2] > self.tile_index.raster_xsize
+
+    def source_vrt(self, window, vrt_path=None, needed=None, feedback=None):
+        """Write the minimal vrt of a window, with tiles served by the cache when there is one
+
+        With ``needed``, a set of source file names, other tiles are left
+        remote and never fetched, as nothing reads them. Prefetched blocks
+        are kept until ``release_blocks``.
+        """
+        if vrt_path is None:
+            fd, vrt_path = tempfile.mkstemp(suffix=".vrt", prefix="esa_worldcover_aoi_", dir=self.workdir)
+            os.close(fd)
+        resolve = None
+        if self.tile_cache is not None:
+            resolve = functools.partial(self._resolve, needed=needed, feedback=feedback)
+        elif self.prefetcher is not None:
+            resolve = self._prefetch(window, needed, feedback).get
+        return self.tile_index.write_window_vrt(window, vrt_path, resolve=resolve)
+
+    def _prefetch(self, window, needed=None, feedback=None):
+        """Map of the sources under ``window`` to their local copy, or to themselves when not fetched"""
+        paths = {filename: filename for filename, _, _ in self.tile_index.sources(window)}
+        sources = [
+            (filename, src_rect)
+            for filename, src_rect, _ in self.tile_index.sources(window)
+            if is_remote(filename) and (needed is None or filename in needed)
+        ]
+        if not sources:
+            return paths
+        folder = tempfile.mkdtemp(prefix="esa_worldcover_blocks_", dir=self.workdir)
+        self._block_dirs.append(folder)
+        try:
+            paths.update(self.prefetcher.prefetch(sources, folder, feedback=feedback))
+        except (OSError, RuntimeError) as e:
+            if feedback is not None:
+                feedback.pushWarning(f"block prefetch failed, reading the tiles remotely: {e}")
+            return paths
+        if feedback is not None:
+            stats = self.prefetcher.stats
+            feedback.pushInfo(
+                f"prefetched {stats['bytes'] / 1e6:.1f} mb in {stats['requests']} request(s) over "
+                f"{stats['connections']} connection(s) in {stats['seconds']} s."
+            )
+        return paths
+
+    def release_blocks(self):
+        """Delete the prefetched blocks of earlier runs"""
+        while self._block_dirs:
+            shutil.rmtree(self._block_dirs.pop(), ignore_errors=True)
+
+    def downloaded_bytes(self):
+        """Bytes downloaded so far by the tile cache and the block prefetcher"""
+        total = self.tile_cache.downloaded_bytes if self.tile_cache is not None else 0
+        return total + (self.prefetcher.downloaded_bytes if self.prefetcher is not None else 0)
+
+    def _resolve(self, filename, needed=None, feedback=None):
+        if needed is not None and filename not in needed:
+            return filename
+        return self.tile_cache.fetch(filename, feedback=feedback)
+
+    def run(self, extent, dst_path, lookups, esa_path=None, band_names=None, mask_wkb=None,
+            target_grid=None, aggregation="mean", output_format=None, driver_name="GTiff",
+            esa_driver_name="GTiff", vrt_path=None, web_tiles=None, scheduler=None, report=None,
+            statistics=False, field=None, compact=False, full_resolution=False, zones=None, feedback=None):
+        """Write Manning's n for an aoi
+
+        ``extent`` is the aoi in the mosaic crs (epsg:4326), with xmin > xmax
+        across the antimeridian, and is ignored when a ``target_grid`` is
+        given, the grid then sets the area. ``lookups``
+        are compiled tables or 256-entry arrays; several are written as bands of
+        ``dst_path``, or one raster each when ``dst_path`` is a list. ``mask_wkb``
+        is in the output crs. ``web_tiles`` is a dict with the ``path`` of an
+        mbtiles or geopackage file and optional ``landcover``, ``min_zoom``
+        and ``max_zoom``; its deepest zoom is sampled from the land cover
+        chunks as they are reclassified, or in a second pass over the source
+        vrt when aggregating to a target grid. ``scheduler`` sets the chunk memory
+        budget, threads and resuming. With a ``report``, an
+        ``instrumentation.RunReport``, the source, raster and web tile stages
+        are measured. ``statistics`` accumulates the land cover histogram and
+        n statistics in the same pass and stores them in .aux.xml sidecars.
+        A ``field``, e.g. an ``ensemble.CorrelatedEnsemble``, gives n that
+        vary within a class and replaces ``lookups``; it is only written on
+        the native grid, without the result cache or web tiles. ``compact``
+        writes ``dst_path`` as uint8 land cover classes with the n of every
+        scenario in its attribute table and metadata, see ``compact``.
+        Coarse target grids are sampled from the overviews of the land cover
+        unless ``full_resolution`` is set, see ``aggregate.subsample_factor``.
+        ``zones`` is a dict with the ``path`` of a geopackage receiving the
+        land cover zones with their n on the worldcover grid, and optional
+        ``min_area``, ``simplify`` and ``workers``, see
+        ``polygonize.polygonize_classes``.
+        Returns a dict describing the run.
+        """
+        if compact:
+            if target_grid is not None or field is not None:
+                raise ValueError("compact outputs hold the worldcover classes, one n per class on the native grid")
+            if isinstance(dst_path, (list, tuple)):
+                raise ValueError("a compact output is a single raster holding every scenario")
+            if esa_path and feedback is not None:
+                feedback.pushWarning("the compact raster holds the land cover classes, the land cover output is not written.")
+            esa_path = None
+        if field is not None:
+            if target_grid is not None:
+                raise ValueError("spatially varying n cannot be aggregated to a target grid")
+            luts = field.luts
+            if web_tiles is not None and feedback is not None:
+                feedback.pushWarning("web tiles are not exported for spatially varying n.")
+            web_tiles = None
+            if zones is not None and feedback is not None:
+                feedback.pushWarning("zones are not written for spatially varying n.")
+            zones = None
+        else:
+            luts = np.stack([getattr(lookup, "lut", lookup) for lookup in lookups])
+        if target_grid is not None:
+            if aggregation not in AGGREGATION_METHODS:
+                raise ValueError(f"unknown aggregation method: {aggregation}")
+            extent = transform_bounds(self._grid_bounds(target_grid), target_grid["crs"], self.tile_index.srs)
+        extent = unwrap_extent(extent)
+
+        window = self.window(extent)
+        if self.crosses_antimeridian(window):
+            # the window continues past 180, the east part is read from the west edge of the mosaic
+            if feedback is not None:
+                feedback.pushInfo("aoi crosses the antimeridian, the output continues past 180 degrees east.")
+                if web_tiles is not None:
+                    feedback.pushWarning("web tiles are not exported across the antimeridian.")
+            web_tiles = None
+        result_cache = None
+        if self.result_cache is not None:
+            if self.crosses_antimeridian(window):
+                if feedback is not None:
+                    feedback.pushWarning("the result cache is not used across the antimeridian.")
+            elif field is not None or compact:
+                if feedback is not None:
+                    feedback.pushWarning("the result cache is not used for spatially varying n or compact outputs.")
+            elif target_grid is None:
+                # whole cache tiles, so every tile computed can be reused by later runs
+                window = snap_window(window, self.result_cache.tile_size, self.tile_index.raster_xsize, self.tile_index.raster_ysize)
+                result_cache = WindowResultCache(self.result_cache, window)
+            elif feedback is not None:
+                feedback.pushWarning("the result cache is not used when aggregating to a target grid.")
+        if feedback is not None:
+            feedback.pushInfo(f"esa pixel window (xoff, yoff, xsize, ysize): {window}")
+            if self.tile_index.is_empty(window):
+                feedback.pushWarning("aoi falls entirely over ocean or nodata, no worldcover tiles are read.")
+
+        # only the source tiles under tiles missing from the result cache are fetched
+        needed = None
+        if result_cache is not None:
+            self.result_cache.stats = dict.fromkeys(self.result_cache.stats, 0)
+        if result_cache is not None and esa_path is None and web_tiles is None and not statistics:
+            needed = {
+                filename
+                for tile_window in self.result_cache.pending(luts, window)
+                for filename, _, _ in self.tile_index.sources(tile_window)
+            }
+        if target_grid is not None and self.tile_cache is None and web_tiles is None:
+            # prefetched blocks only hold the full resolution, overviews are read remotely
+            cell_size = min((extent[2] - extent[0]) / target_grid["xsize"], (extent[3] - extent[1]) / target_grid["ysize"])
+            if subsample_factor(cell_size, abs(self.tile_index.geotransform[1]), full_resolution)[1]:
+                needed = set()
+
+        keep_vrt = vrt_path is not None
+        with stage(report, "source"):
+            source, tiles = self.source_vrt(window, vrt_path, needed, feedback)
+        if feedback is not None:
+            feedback.pushInfo(f"{len(tiles)} worldcover tile(s) intersect the aoi.")
+        options = {
+            "esa_path": esa_path,
+            "band_names": band_names,
+            "mask_wkb": mask_wkb,
+            "output_format": output_format,
+            "driver_name": driver_name,
+            "esa_driver_name": esa_driver_name,
+            "scheduler": scheduler,
+            "statistics": RasterStatistics(band_names or [getattr(lookup, "name", None) for lookup in (lookups if field is None else luts)]) if statistics else None,
+            "feedback": feedback,
+        }
+        tile_files = []
+        zone_result = None
+        tile_builder = None
+        if web_tiles is not None and target_grid is None:
+            # the deepest zoom is sampled from the chunks as they are reclassified
+            tile_builder = WebTileBuilder(
+                web_tiles["path"], luts,
+                names=band_names,
+                landcover=web_tiles.get("landcover", False),
+                bounds=extent,
+                min_zoom=web_tiles.get("min_zoom"),
+                max_zoom=web_tiles.get("max_zoom"),
+                mask_wkb=mask_wkb,
+                feedback=feedback,
+            )
+            options["web_tiles"] = tile_builder
+        try:
+            if target_grid is not None:
+                with stage(report, "aggregate", target_grid["xsize"] * target_grid["ysize"]):
+                    aggregate_raster(source, dst_path, luts, target_grid, method=aggregation, full_resolution=full_resolution, **options)
+            elif compact:
+                # the classes are written once, every scenario is only a lookup in the sidecar
+                options.update(esa_path=dst_path, esa_driver_name=driver_name)
+                with stage(report, "reclassify", window[2] * window[3]):
+                    reclassify_raster(source, None, luts, class_color_table=compact_color_table(luts[0]), **options)
+                    write_lookup_table(dst_path, luts, band_names or [getattr(lookup, "name", f"n_{index + 1}") for index, lookup in enumerate(lookups)])
+            else:
+                with stage(report, "reclassify", window[2] * window[3]):
+                    reclassify_raster(source, dst_path, luts, result_cache=result_cache, field=field, **options)
+            if tile_builder is not None:
+                tile_files = tile_builder.files
+            elif web_tiles is not None and (feedback is None or not feedback.isCanceled()):
+                # aggregated n does not stream the native classes, the tiles take a pass of their own
+                with stage(report, "web_tiles"):
+                    tile_files = export_web_tiles(
+                        source, web_tiles["path"], luts,
+                        names=band_names,
+                        landcover=web_tiles.get("landcover", False),
+                        bounds=extent,
+                        min_zoom=web_tiles.get("min_zoom"),
+                        max_zoom=web_tiles.get("max_zoom"),
+                        feedback=feedback,
+                    )
+            if zones is not None and (feedback is None or not feedback.isCanceled()):
+                with stage(report, "zones", window[2] * window[3]):
+                    zone_result = polygonize_classes(
+                        source, zones["path"], luts,
+                        names=band_names or [getattr(lookup, "name", None) for lookup in lookups],
+                        mask_wkb=mask_wkb if target_grid is None else None,
+                        min_area=zones.get("min_area", 0.0),
+                        simplify=zones.get("simplify", 0.0),
+                        workers=zones.get("workers", 1),
+                        feedback=feedback,
+                    )
+        finally:
+            if not keep_vrt and os.path.exists(source):
+                os.remove(source)
+            self.release_blocks()
+
+        if result_cache is not None:
+            stats = dict(self.result_cache.stats)
+            self.result_cache.flush()
+            if feedback is not None:
+                feedback.pushInfo(
+                    f"result cache: {stats['hits']} tile(s) reused, {stats['computed']} computed, "
+                    f"{stats['blocks_skipped']} block(s) assembled without reading land cover."
+                )
+
+        evicted = self.tile_cache.evict(keep=tiles) if self.tile_cache is not None else []
+        return {
+            "roughness": list(dst_path) if isinstance(dst_path, (list, tuple)) else [dst_path],
+            "esa": esa_path,
+            "window": window,
+            "tiles": tiles,
+            "evicted": evicted,
+            "web_tiles": tile_files,
+            "zones": zone_result,
+            "statistics": options["statistics"].to_dict() if statistics and options["statistics"].complete else None,
+        }
+
+    def run_change(self, previous, extent, dst_paths, delta_path, lookups, band_names=None, mask_wkb=None,
+                   output_format=None, driver_name="GTiff", scheduler=None, report=None, feedback=None):
+        """Write Manning's n of two vintages and its change for an aoi in one pass
+
+        ``previous`` is the engine of the earlier vintage, on the same grid.
+        ``dst_paths`` are the (earlier, later) n rasters and ``delta_path``
+        receives later minus earlier n. Both vintages are read at the same
+        windows; the result cache, target grids and the land cover output do
+        not apply. Returns a dict describing the run.
+        """
+        if (previous.tile_index.geotransform, previous.tile_index.raster_xsize, previous.tile_index.raster_ysize) != (
+                self.tile_index.geotransform, self.tile_index.raster_xsize, self.tile_index.raster_ysize):
+            raise ValueError("land cover vintages are not on the same grid")
+        luts = np.stack([getattr(lookup, "lut", lookup) for lookup in lookups])
+        window = self.window(extent)
+        if feedback is not None:
+            feedback.pushInfo(f"esa pixel window (xoff, yoff, xsize, ysize): {window}")
+
+        sources, tiles = [], []
+        try:
+            with stage(report, "source"):
+                for engine in (previous, self):
+                    source, engine_tiles = engine.source_vrt(window, feedback=feedback)
+                    sources.append(source)
+                    tiles.append(engine_tiles)
+            if feedback is not None:
+                feedback.pushInfo(f"{len(tiles[0])} and {len(tiles[1])} worldcover tile(s) of the two vintages intersect the aoi.")
+            with stage(report, "change", window[2] * window[3]):
+                counts = reclassify_change(
+                    sources, dst_paths, delta_path, luts,
+                    band_names=band_names,
+                    mask_wkb=mask_wkb,
+                    output_format=output_format,
+                    driver_name=driver_name,
+                    scheduler=scheduler,
+                    feedback=feedback,
+                )
+        finally:
+            for source in sources:
+                if os.path.exists(source):
+                    os.remove(source)
+            for engine in (previous, self):
+                engine.release_blocks()
+
+        # a cache shared by both engines keeps the tiles of both vintages
+        evicted = []
+        caches = {id(engine.tile_cache): engine.tile_cache for engine in (previous, self) if engine.tile_cache is not None}
+        for tile_cache in caches.values():
+            evicted += tile_cache.evict(keep=tiles[0] + tiles[1])
+        return {
+            "roughness": list(dst_paths),
+            "delta": delta_path,
+            "window": window,
+            "tiles": tiles[0] + tiles[1],
+            "evicted": evicted,
+            "changed_pixels": counts["changed"],
+            "valid_pixels": counts["pixels"],
+        }
+
+    @staticmethod
+    def _grid_bounds(grid):
+        gt = grid["geotransform"]
+        x0, y0 = gt[0], gt[3]
+        x1, y1 = x0 + grid["xsize"] * gt[1], y0 + grid["ysize"] * gt[5]
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
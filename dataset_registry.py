@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+
+DATA_DIR = os.path.normpath(os.path.dirname(__file__))
+
+# bundled esa worldcover mosaics by map year, each vrt ships with its tile index
+WORLDCOVER_VINTAGES = {
+    "2020": {"version": "v100", "vrt": "esa_worldcover_2020.vrt"},
+    "2021": {"version": "v200", "vrt": "esa_worldcover_2021.vrt"},
+}
+
+DEFAULT_VINTAGE = "2021"
+
+# vintages compared by change mode, earlier year first
+CHANGE_VINTAGES = ("2020", "2021")
+
+
+def vintage_names():
+    """Bundled vintages, newest first"""
+    return sorted(WORLDCOVER_VINTAGES, reverse=True)
+
+
+def vintage_label(vintage):
+    """Display name of a vintage, e.g. 2021 (v200)"""
+    return f"{vintage} ({WORLDCOVER_VINTAGES[vintage]['version']})"
+
+
+def vintage_vrt(vintage=DEFAULT_VINTAGE):
+    """Path of the mosaic vrt of a vintage"""
+    try:
+        entry = WORLDCOVER_VINTAGES[str(vintage)]
+    except KeyError:
+        raise ValueError(f"unknown worldcover vintage: {vintage}, expected one of {', '.join(vintage_names())}")
+    return os.path.join(DATA_DIR, entry["vrt"])
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import hashlib
+import math
+
+import numpy as np
+
+from .lookup_registry import WORLDCOVER_CLASSES, CompiledLookup
+from .reclassify import NODATA_N
+
+ENSEMBLE_DISTRIBUTIONS = ["uniform", "triangular"]
+
+DEFAULT_ENSEMBLE_SEED = 0
+
+# abramowitz and stegun 7.1.26, erf to 1.5e-7
+_ERF_P = 0.3275911
+_ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
+_MASK64 = (1 << 64) - 1
+
+
+def realization_names(size):
+    return [f"realization_{index + 1:03d}" for index in range(size)]
+
+
+def normal_cdf(z):
+    """Standard normal cdf of an array"""
+    x = np.abs(z) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + _ERF_P * x)
+    polynomial = t * (_ERF_A[0] + t * (_ERF_A[1] + t * (_ERF_A[2] + t * (_ERF_A[3] + t * _ERF_A[4]))))
+    erf = 1.0 - polynomial * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * erf)
+
+
+def quantile(u, low, high, mode=None):
+    """n at quantile ``u`` of a uniform, or with ``mode`` triangular, distribution over [low, high]"""
+    span = high - low
+    if mode is None:
+        return low + u * span
+    # inverse cdf of the triangular distribution, split at the mode
+    split = np.where(span > 0, (mode - low) / np.where(span > 0, span, 1.0), 0.0)
+    lower = low + np.sqrt(u * span * (mode - low))
+    upper = high - np.sqrt((1.0 - u) * span * (high - mode))
+    return np.where(u < split, lower, upper)
+
+
+def _bounds(low, high, mode=None, nodata=NODATA_N):
+    """Lookup bounds as float64 arrays, classes missing from either bound are nodata"""
+    low = np.asarray(getattr(low, "lut", low), dtype=np.float64)
+    high = np.asarray(getattr(high, "lut", high), dtype=np.float64)
+    valid = (low != nodata) & (high != nodata)
+    low, high = np.where(valid, np.minimum(low, high), 0.0), np.where(valid, np.maximum(low, high), 0.0)
+    if mode is not None:
+        mode = np.asarray(getattr(mode, "lut", mode), dtype=np.float64)
+        mode = np.where(valid & (mode != nodata), np.clip(mode, low, high), (low + high) / 2.0)
+    return low, high, mode, valid
+
+
+def class_ensemble(low, high, size, seed=DEFAULT_ENSEMBLE_SEED, mode=None, nodata=NODATA_N):
+    """(size, 256) lookup arrays, every class drawn independently between its ``low`` and ``high`` n
+
+    ``low``, ``high`` and the optional triangular ``mode`` are compiled
+    lookups or 256-entry arrays. Draws are reproducible for a ``seed``.
+    """
+    low, high, mode, valid = _bounds(low, high, mode, nodata)
+    u = np.random.default_rng(seed).random((size, 256))
+    luts = quantile(u, low, high, mode)
+    luts[:, ~valid] = nodata
+    return luts.astype(np.float32)
+
+
+def realization_lookups(luts, nodata=NODATA_N):
+    """Compiled lookups named realization_001... for the rows of an ensemble"""
+    lookups = []
+    for name, lut in zip(realization_names(len(luts)), luts):
+        values = tuple((lc_value, float(lut[lc_value])) for lc_value in WORLDCOVER_CLASSES if lut[lc_value] != nodata)
+        missing = [lc_value for lc_value in WORLDCOVER_CLASSES if lut[lc_value] == nodata]
+        lut = np.array(lut, dtype=np.float32)
+        lut.setflags(write=False)
+        digest = hashlib.sha1(";".join(f"{lc_value}:{n_value!r}" for lc_value, n_value in values).encode("ascii")).hexdigest()
+        lookups.append(CompiledLookup(name, None, values, lut, digest, missing))
+    return lookups
+
+
+def _hash_uniform(rows, cols, key):
+    """Uniform (0, 1) value per lattice node, a pure function of the node and ``key``"""
+    with np.errstate(over="ignore"):
+        x = rows.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= cols.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+        x ^= np.uint64(key)
+        # splitmix64 finaliser
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return ((x >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+
+
+class CorrelatedEnsemble:
+    """Spatially correlated n realizations between two lookup tables
+
+    Each realization is a smooth quantile field: standard normal values on
+    a lattice spaced ``correlation_length`` pixels apart, interpolated
+    bilinearly with the variance restored, and mapped to (0, 1) through the
+    normal cdf. A pixel takes the n of its class at that quantile, so
+    neighbouring pixels of one class get similar n and every class keeps
+    its own range. Lattice values are hashed from the node, the realization
+    and the seed, so any chunk is computed on its own and chunks join
+    without seams.
+    """
+
+    def __init__(self, low, high, size, correlation_length, seed=DEFAULT_ENSEMBLE_SEED, mode=None, nodata=NODATA_N):
+        if correlation_length <= 0:
+            raise ValueError("correlation length must be positive")
+        self.low, self.high, self.mode, valid = _bounds(low, high, mode, nodata)
+        self.size = size
+        self.correlation_length = float(correlation_length)
+        self.seed = seed
+        self.nodata = nodata
+        # upper bounds per realization, they set the nodata classes and the value range
+        self.luts = np.repeat(np.where(valid, self.high, nodata)[None].astype(np.float32), size, axis=0)
+
+    @property
+    def key(self):
+        """Bytes identifying the realizations, for checkpoints"""
+        mode = self.mode.tobytes() if self.mode is not None else b""
+        return b"".join([self.low.tobytes(), self.high.tobytes(), mode, repr((self.size, self.correlation_length, self.seed)).encode()])
+
+    def _key(self, realization, salt):
+        return (self.seed * 0x100000001B3 + realization * 0x9E3779B1 + salt) & _MASK64
+
+    def quantiles(self, realization, xoff, yoff, xsize, ysize):
+        """(ysize, xsize) quantile field of a realization over a chunk of the window"""
+        spacing = self.correlation_length
+        gy = (yoff + np.arange(ysize) + 0.5) / spacing
+        gx = (xoff + np.arange(xsize) + 0.5) / spacing
+        row0, col0 = np.floor(gy).astype(np.int64), np.floor(gx).astype(np.int64)
+        fy, fx = gy - row0, gx - col0
+        rows = np.arange(row0[0], row0[-1] + 2)
+        cols = np.arange(col0[0], col0[-1] + 2)
+        node_rows, node_cols = np.meshgrid(rows, cols, indexing="ij")
+        u1 = _hash_uniform(node_rows, node_cols, self._key(realization, 1))
+        u2 = _hash_uniform(node_rows, node_cols, self._key(realization, 2))
+        nodes = np.sqrt(-2.0 * np.log(u1)) * np.cos(2.0 * np.pi * u2)
+        # separable bilinear interpolation, along the columns then the rows
+        c = col0 - cols[0]
+        along = nodes[:, c] * (1.0 - fx) + nodes[:, c + 1] * fx
+        r = row0 - rows[0]
+        field = along[r] * (1.0 - fy)[:, None] + along[r + 1] * fy[:, None]
+        field /= np.sqrt(((1.0 - fy) ** 2 + fy ** 2)[:, None] * ((1.0 - fx) ** 2 + fx ** 2)[None, :])
+        return normal_cdf(field)
+
+    def values(self, classes, xoff, yoff):
+        """(size, rows, cols) n of a chunk of classes at (xoff, yoff) in the output window"""
+        ysize, xsize = classes.shape
+        low, high = self.low[classes], self.high[classes]
+        mode = self.mode[classes] if self.mode is not None else None
+        values = np.empty((self.size, ysize, xsize), dtype=np.float32)
+        for realization in range(self.size):
+            values[realization] = quantile(self.quantiles(realization, xoff, yoff, xsize, ysize), low, high, mode)
+        return values
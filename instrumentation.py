@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import contextlib
+import configparser
+
+from osgeo import gdal
+
+METADATA_PATH = os.path.join(os.path.dirname(__file__), "metadata.txt")
+
+REPORT_VERSION = 2
+
+# seconds between two resident memory samples of a stage
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def io_counters():
+    """Bytes read and written by this process, zeros where /proc is not available"""
+    counters = {}
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as file:
+            for line in file:
+                key, value = line.split(":")
+                counters[key.strip()] = int(value)
+    except OSError:
+        pass
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+def peak_rss_mb():
+    """Peak resident memory over the life of this process in mb, None where it is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident memory of this process now in mb, None where it is not available"""
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+class MemorySampler:
+    """Highest resident memory seen while a block runs, sampled on a background thread
+
+    Unlike ``peak_rss_mb`` the peak only covers the block, so a stage does
+    not inherit the high-water mark of earlier stages or of the host
+    application. Spikes shorter than the ``interval`` may be missed.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = None
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and rss > self.peak_mb:
+            self.peak_mb = rss
+
+    def stop(self):
+        """End the sampling, returns the peak in mb or None where memory is not available"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._sample()
+        return self.peak_mb
+
+
+def plugin_version():
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read(METADATA_PATH, encoding="utf-8")
+        return parser.get("general", "version")
+    except (OSError, configparser.Error):
+        return None
+
+
+def enable_network_stats():
+    """Let gdal count the bytes its /vsicurl/ reads download, gdal >= 3.2"""
+    gdal.SetConfigOption("CPL_VSIL_NETWORK_STATS_ENABLED", "YES")
+
+
+def gdal_network_bytes():
+    """Bytes downloaded by gdal network reads so far, 0 when gdal does not count them"""
+    stats_json = getattr(gdal, "NetworkStatsGetAsSerializedJSON", None)
+    if stats_json is None:
+        return 0
+    try:
+        stats = json.loads(stats_json() or "{}")
+    except ValueError:
+        return 0
+    return sum(method.get("downloaded_bytes", 0) for method in stats.get("methods", {}).values())
+
+
+class RunReport:
+    """Wall time, cpu time, bytes read, pixels and peak memory of the stages of a run
+
+    Each ``stage`` block records the difference of the counters over the
+    block, and the peak resident memory sampled while it runs
+    (``peak_rss_mb``) with its rise over the memory at the start of the
+    stage (``peak_rss_delta_mb``). ``process_peak_rss_mb`` is the high-water
+    mark of the whole process, e.g. of qgis, for reference. Remote bytes are those downloaded by gdal (when it counts them)
+    plus the ``remote_counters``, callables returning the bytes downloaded
+    so far by the tile cache or the prefetcher; local bytes are the other
+    bytes read by the process. Cpu time is for the whole process, so worker
+    threads are included.
+    """
+
+    def __init__(self, name, remote_counters=(), metadata=None):
+        self.name = name
+        self.remote_counters = list(remote_counters)
+        self.metadata = dict(metadata or {})
+        self.stages = []
+        # label of the aoi the next stages belong to, for runs over several aois
+        self.aoi = None
+        self.created = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self._started = self._snapshot()
+        self._started_mb = current_rss_mb()
+        enable_network_stats()
+
+    def _snapshot(self):
+        read, written = io_counters()
+        remote = gdal_network_bytes() + sum(counter() for counter in self.remote_counters)
+        return {"wall": time.perf_counter(), "cpu": time.process_time(), "read": read, "written": written, "remote": remote}
+
+    def _record(self, name, before, after, start_mb=None, peak_mb=None):
+        remote = after["remote"] - before["remote"]
+        return {
+            "stage": name,
+            "wall_s": round(after["wall"] - before["wall"], 6),
+            "cpu_s": round(after["cpu"] - before["cpu"], 6),
+            "bytes_read_local": max(0, after["read"] - before["read"] - remote),
+            "bytes_read_remote": remote,
+            "bytes_written": after["written"] - before["written"],
+            "pixels": None,
+            "peak_rss_mb": round(peak_mb, 1) if peak_mb is not None else None,
+            "peak_rss_delta_mb": round(peak_mb - start_mb, 1) if peak_mb is not None and start_mb is not None else None,
+            "process_peak_rss_mb": peak_rss_mb(),
+        }
+
+    @contextlib.contextmanager
+    def stage(self, name, pixels=None):
+        """Measure the enclosed block, the yielded record takes ``pixels`` once known"""
+        before = self._snapshot()
+        sampler = MemorySampler()
+        record = {"pixels": pixels}
+        try:
+            yield record
+        finally:
+            peak = sampler.stop()
+            stage = self._record(name, before, self._snapshot(), sampler.start_mb, peak)
+            stage["pixels"] = record["pixels"]
+            if self.aoi is not None:
+                stage["aoi"] = self.aoi
+            if stage["pixels"] and stage["wall_s"] > 0:
+                stage["mpixels_per_s"] = round(stage["pixels"] / 1e6 / stage["wall_s"], 3)
+            self.stages.append(stage)
+
+    def to_dict(self):
+        # the run peaks in its highest stage, memory between stages is not sampled
+        peaks = [stage["peak_rss_mb"] for stage in self.stages if stage["peak_rss_mb"] is not None]
+        total = self._record("total", self._started, self._snapshot(), self._started_mb, max(peaks) if peaks else None)
+        total["pixels"] = sum(stage["pixels"] or 0 for stage in self.stages) or None
+        return {
+            "report_version": REPORT_VERSION,
+            "name": self.name,
+            "created": self.created,
+            "plugin_version": plugin_version(),
+            "gdal": gdal.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "metadata": self.metadata,
+            "stages": self.stages,
+            "total": total,
+        }
+
+    def summary(self):
+        """One line per stage for the processing log"""
+        lines = []
+        report = self.to_dict()
+        for stage in report["stages"] + [report["total"]]:
+            line = (
+                f"{stage.get('aoi', '') + ' ' if stage.get('aoi') else ''}{stage['stage']:<14} {stage['wall_s']:>9.2f} s wall {stage['cpu_s']:>9.2f} s cpu "
+                f"{stage['bytes_read_local'] / 1e6:>9.1f} mb local {stage['bytes_read_remote'] / 1e6:>8.1f} mb remote"
+            )
+            if stage["pixels"]:
+                line += f" {stage['pixels'] / 1e6:>9.1f} Mpx"
+            if stage["peak_rss_mb"] is not None:
+                line += f" peak {stage['peak_rss_mb']:.0f} mb"
+                if stage["peak_rss_delta_mb"] is not None:
+                    line += f" (+{stage['peak_rss_delta_mb']:.0f})"
+            elif stage["process_peak_rss_mb"] is not None:
+                line += f" process peak {stage['process_peak_rss_mb']:.0f} mb"
+            lines.append(line)
+        return lines
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=1)
+        return path
+
+
+def stage(report, name, pixels=None):
+    """``report.stage`` when there is a report, else a no-op context"""
+    if report is None:
+        return contextlib.nullcontext({"pixels": pixels})
+    return report.stage(name, pixels)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import csv
+import math
+import hashlib
+import functools
+
+from .reclassify import LC_NODATA, compile_lookup
+
+# land cover classes of esa worldcover
+WORLDCOVER_CLASSES = (10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100)
+
+BUNDLED_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "lookups"))
+
+
+class CompiledLookup:
+    """Validated lookup table compiled into a dense 256-entry n array
+
+    ``digest`` hashes the (class, n) pairs rather than the file, so tables
+    that only differ in formatting share it. ``missing`` lists the
+    WorldCover classes the table leaves unmapped, which come out as nodata.
+    """
+
+    __slots__ = ("name", "path", "values", "lut", "digest", "missing")
+
+    def __init__(self, name, path, values, lut, digest, missing):
+        self.name = name
+        self.path = path
+        self.values = values
+        self.lut = lut
+        self.digest = digest
+        self.missing = missing
+
+    def __repr__(self):
+        return f"CompiledLookup({self.name!r}, {len(self.values)} classes, {self.digest[:12]})"
+
+
+def parse_lookup(path):
+    """Read the (land cover, n) pairs of a two column csv, raising ValueError on any bad row
+
+    A header row is allowed as the first row, blank lines and lines starting
+    with ``#`` are ignored.
+    """
+    values = []
+    seen = set()
+    header_allowed = True
+    with open(path, "r", newline="", encoding="utf-8-sig") as file:
+        for line_number, row in enumerate(csv.reader(file), start=1):
+            row = [cell.strip() for cell in row]
+            if not any(row) or row[0].startswith("#"):
+                continue
+            if len(row) != 2:
+                raise ValueError(f"{os.path.basename(path)} line {line_number}: expected 2 columns, got {len(row)}")
+            try:
+                lc_value, n_value = int(row[0]), float(row[1])
+            except ValueError:
+                if header_allowed:
+                    header_allowed = False
+                    continue
+                raise ValueError(f"{os.path.basename(path)} line {line_number}: not a (class, n) pair: {','.join(row)}")
+            header_allowed = False
+            if not 0 < lc_value <= 255 or lc_value == LC_NODATA:
+                raise ValueError(f"{os.path.basename(path)} line {line_number}: land cover class out of range: {lc_value}")
+            if not math.isfinite(n_value) or n_value <= 0:
+                raise ValueError(f"{os.path.basename(path)} line {line_number}: n must be positive: {row[1]}")
+            if lc_value in seen:
+                raise ValueError(f"{os.path.basename(path)} line {line_number}: duplicate land cover class {lc_value}")
+            seen.add(lc_value)
+            values.append((lc_value, n_value))
+    if not values:
+        raise ValueError(f"{os.path.basename(path)}: lookup table is empty")
+    return values
+
+
+def validate_lookup(values, classes=WORLDCOVER_CLASSES):
+    """Check a table against the land cover classes, returns the unmapped classes"""
+    unknown = sorted({lc_value for lc_value, _ in values} - set(classes))
+    if unknown:
+        raise ValueError(f"classes not in the land cover legend: {', '.join(map(str, unknown))}")
+    return sorted(set(classes) - {lc_value for lc_value, _ in values})
+
+
+def load_lookup(path):
+    """Parse, validate and compile a lookup table once per file version"""
+    path = os.path.normpath(os.path.abspath(path))
+    stat = os.stat(path)
+    return _load_compiled(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_compiled(path, mtime_ns, size):
+    # mtime and size are part of the cache key so an edited table is picked up
+    values = sorted(parse_lookup(path))
+    try:
+        missing = validate_lookup(values)
+    except ValueError as e:
+        raise ValueError(f"{os.path.basename(path)}: {e}")
+    lut = compile_lookup(values)
+    lut.setflags(write=False)
+    digest = hashlib.sha1(";".join(f"{lc_value}:{n_value!r}" for lc_value, n_value in values).encode("ascii")).hexdigest()
+    name = os.path.splitext(os.path.basename(path))[0]
+    return CompiledLookup(name, path, tuple(values), lut, digest, missing)
+
+
+def bundled_lookups():
+    """Paths of the lookup tables shipped in ``lookups/``, keyed by table name"""
+    return {
+        os.path.splitext(filename)[0]: os.path.join(BUNDLED_DIR, filename)
+        for filename in sorted(os.listdir(BUNDLED_DIR))
+        if filename.lower().endswith(".csv")
+    }
@@ -27,28 +27,62 @@ __date__ = "2025-02-08"
 __copyright__ = "(C) 2025 by Abdullah Azzam"
 
 import os
+import re
 import sys
 import inspect
-import processing
 from qgis.core import (
     QgsProcessing,
     QgsProcessingAlgorithm,
     QgsProcessingException,
     QgsProcessingMultiStepFeedback,
     QgsProcessingUtils,
-    QgsVectorLayer,
     QgsApplication,
     QgsRasterLayer,
     QgsProject,
     QgsCoordinateReferenceSystem,
     QgsProcessingOutputLayerDefinition,
-    QgsProcessingParameterVectorLayer,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterString,
     QgsProcessingParameterEnum,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterDefinition,
     QgsProcessingOutputLayerDefinition,
+    QgsRasterFileWriter,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterNumber,
+    QgsProcessingOutputMultipleLayers,
+    QgsGeometry,
+    QgsRectangle,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingOutputNumber,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsWkbTypes,
 )
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+
+from .aggregate import AGGREGATION_METHODS
+from .core import RoughnessEngine, geographic_extent, snap_grid, transform_bounds, unwrap_extent
+from .dataset_registry import CHANGE_VINTAGES, DEFAULT_VINTAGE, vintage_label, vintage_names, vintage_vrt
+from .ensemble import DEFAULT_ENSEMBLE_SEED, CorrelatedEnsemble, class_ensemble, realization_lookups, realization_names
+from .instrumentation import RunReport
+from .output_format import COMPRESSION_METHODS, OutputFormat
+from .reclassify import NODATA_N
+from .prefetch import DEFAULT_WORKERS, RangePrefetcher
+from .scheduler import DEFAULT_MEMORY_MB, ChunkScheduler
+from .lookup_registry import BUNDLED_DIR, load_lookup
+from .tile_cache import DEFAULT_CACHE_SIZE_MB, TileCache
+from .web_tiles import DEFAULT_MIN_ZOOM, MAX_ZOOM
 #from .mannings_roughness_calculator import ManningsRoughnessCalculator
 
 class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
@@ -66,14 +100,16 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
                 """<html><body>
                 <h2>Algorithm description</h2>
                 <p>This algorithm generates a <b>Manning’s roughness coefficient layer</b> for the given Area of Interest (AOI). 
-                It derives roughness values from the <b>ESA WorldCover 2021</b> dataset using predefined lookup tables corresponding to different hydrological surface types.</p>
+                It derives roughness values from the <b>ESA WorldCover</b> dataset, 2021 (v200) by default or 2020 (v100), using predefined lookup tables corresponding to different hydrological surface types.</p>
 
                 <p>Users can select from three predefined roughness classes: <b>Low, Medium, and High</b>, 
                 each representing a different hydrological scenario. The roughness values are applied based on ESA Land Cover classification.</p>
 
                 <h2>Input parameters</h2>
                 <h3>Area of Interest</h3>
-                <p>Polygon layer representing an area of interest.</p>
+                <p>Polygon layer representing an area of interest. Only selected features are used when "Selected features only" is checked, and only the listed features when <b>AOI feature IDs</b> (advanced) is set. 
+                The area read is the bounding box of these features transformed to EPSG:4326 along densified edges; the polygons themselves are only reprojected when the output is masked to them. 
+                An AOI crossing the antimeridian is read on both sides of it and written as one raster continuing past 180° east, instead of over the whole width of the world.</p>
 
                 <h3>Roughness Class</h3>
                 <p>Selects the Manning's roughness classification scheme to be applied. Options include:</p>
@@ -83,6 +119,28 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
                 <li><b>High</b> - Represents maximum roughness (e.g., dense forests, wetlands).</li>
                 </ul>
 
+                <p>Several classes can be selected at once. The land cover is then read a single time and every lookup table is applied to each block in memory. 
+                The results are written either as one band per class in the Manning's Roughness raster, or as separate rasters named after the output with a <code>_low_n</code>, <code>_med_n</code> or <code>_high_n</code> suffix.</p>
+
+                <h3>Mask output to the AOI polygons (advanced)</h3>
+                <p>Writes NoData outside the AOI polygons instead of filling their whole bounding box. 
+                Blocks that lie fully outside the polygons are never read from WorldCover nor computed, and GeoTIFF outputs are written tiled, DEFLATE compressed and sparse, which keeps long river corridors and dendritic watersheds small.</p>
+
+                <h3>Target grid (advanced)</h3>
+                <p>Set a <b>Target CRS</b>, a <b>Target resolution</b> and/or a <b>Snap raster</b> to write n directly on the grid of a hydraulic model (e.g. HEC-RAS or LISFLOOD at 5-30 m). 
+                The 10 m land cover is aggregated to each cell in a single streaming pass, without intermediate rasters. 
+                <b>Area-weighted mean</b> averages n over the land cover inside the cell, <b>Mode of class, then lookup</b> uses n of the most common class, and <b>Geometric mean</b> averages log n. 
+                Cells are aligned to the snap raster origin when given, otherwise to multiples of the resolution. In this mode the ESA WorldCover output holds the most common class of each cell. 
+                Cells of 80 m or more (e.g. 100 m+ national screening grids) are sampled 4 x 4 times from the nearest internal overview of the WorldCover tiles instead of reading every 10 m pixel, which cuts the bytes read by orders of magnitude on coarse grids. 
+                Class fractions then become 16-sample estimates per cell: area means stay unbiased, but a single mixed cell may be off by the sampling error and its mode class may differ. 
+                Check <b>Read full resolution on coarse grids</b> for exact class fractions.</p>
+
+                <h3>Output GeoTIFF layout (advanced)</h3>
+                <p><b>Plain GeoTIFF</b> keeps the default GDAL layout. The other layouts write tiled rasters compressed with <b>DEFLATE</b>, <b>ZSTD</b> or <b>LZW</b> and a floating point predictor, 
+                with internal overviews that are filled from each block while it is written, so large outputs render quickly without a second pass over the raster. 
+                <b>Cloud optimized GeoTIFF</b> finally reorders the file into COG layout, copying the streamed overviews. 
+                <b>Round n to decimals</b> (e.g. 4) stores n at fixed precision, which makes the compressed output several times smaller.</p>
+
                 <h3>Lookup Table (default)</h3>
                 <p>The algorithm uses predefined lookup tables that assign Manning’s n-values to ESA WorldCover land cover classes. 
                 These tables are stored in the plugin directory under <code>lookups/</code> and include:</p>
@@ -93,12 +151,79 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
                 </ul>
                 <p>Each file contains two columns: <code>grid_code</code> (ESA Land Cover class) and <code>n</code> (Manning's roughness coefficient).</p>
 
+                <h3>Custom lookup tables (advanced)</h3>
+                <p>Calibrated tables in the same two column format can be added without editing the plugin folder. Each one is written as an extra scenario named after its file. 
+                Tables are validated once when loaded: every row must be a WorldCover class and a positive n, and classes left out of the table are reported and written as NoData. 
+                Compiled tables are kept in memory until the file changes, so repeated and batch runs never parse them again.</p>
+
+                <h3>Tile cache (advanced)</h3>
+                <p>When enabled, every WorldCover source tile touched by the AOI is downloaded once into a local cache folder and read from disk on later runs. 
+                The least recently used tiles are evicted once the cache grows beyond the size limit. 
+                <b>Offline mode</b> never touches the network and serves tiles only from the cache or from a local mirror folder holding the original tile files.</p>
+
+                <h3>Memory budget, threads and resuming (advanced)</h3>
+                <p>The output is processed in square chunks sized so that all chunks in memory at once fit the <b>Memory budget</b>, which keeps continental AOIs within RAM. 
+                With several <b>Processing threads</b> chunks are read and computed in parallel and written in order. Progress is reported after every chunk and cancelling stops after the current one. 
+                With <b>Resume</b>, completed chunks are journaled next to the output; running the algorithm again with the same inputs and outputs after a cancel or crash continues from the last completed chunk.</p>
+
+                <h3>Concurrent block downloads (advanced)</h3>
+                <p>Without the tile cache, the WorldCover blocks under the AOI are downloaded before processing by this many parallel range requests over kept-alive connections, 
+                with adjacent blocks merged into one request, and then read from a temporary local copy. This hides the round trip latency of reading the blocks one after another. 
+                Set to 0 to let GDAL read the tiles directly.</p>
+
+                <h3>Reuse computed roughness tiles (advanced)</h3>
+                <p>Keeps the computed n in 256 x 256 pixel tiles aligned to the WorldCover grid, keyed by the WorldCover version and by the n of the classes present in each tile. 
+                A rerun for a slightly edited AOI, or with a changed n for one class, only reads and computes the tiles that are new or contain that class, and assembles all others from the cache. 
+                The output then covers whole cache tiles around the AOI.</p>
+
+                <h3>ESA WorldCover vintage</h3>
+                <p>Map year of the land cover, <b>2021 (v200)</b> or <b>2020 (v100)</b>. Both are read from the ESA WorldCover bucket through their own tile index; cached tiles and reused results of the two years never mix.</p>
+
                 <h2>Outputs</h2>
-                <h3>ESA WorldCover 2021</h3>
-                <p>Clipped ESA Land Cover raster for the specified AOI.</p>
+                <h3>ESA WorldCover</h3>
+                <p>Clipped ESA Land Cover raster of the selected vintage for the specified AOI. It is written in the same read pass as the roughness raster and only when this output is requested.</p>
 
                 <h3>Manning's Roughness</h3>
-                <p>Generated raster layer with Manning’s roughness coefficients derived from the selected lookup table.</p>
+                <p>Generated raster layer with Manning’s roughness coefficients derived from the selected lookup table. 
+                Land cover classes missing from the lookup table and ESA NoData (class 0) are written as NoData (<code>-9999</code>).</p>
+
+                <h3>Change in Manning's n</h3>
+                <p>When set, the algorithm runs in change mode: both vintages are read together over the same windows and, in one pass, the n of the selected vintage is written to the roughness output, 
+                the n of the other vintage next to it with the year appended to its name, and this raster receives the later minus the earlier n, NoData where either year is NoData. 
+                The share of pixels whose land cover class changed is logged. The land cover output, web tiles, statistics and the target grid are not available in change mode.</p>
+
+                <h3>Web tiles</h3>
+                <p>Optional MBTiles or GeoPackage file of styled 256 x 256 PNG web mercator tiles for viewing in a browser, coloured with the ramp of <code>mannings_n.qml</code>. 
+                The deepest zoom, by default the one matching the 10 m land cover, is sampled from the land cover blocks while they are reclassified, without reading the land cover again (with a target grid it takes a read of its own), and every coarser zoom down to the minimum zoom is averaged from the zoom above, never from the source. 
+                <b>Add land cover web tiles</b> also writes the WorldCover classes with the palette of <code>esa_worldcover_2021.qml</code>, as a second table of the GeoPackage or a <code>_esa_worldcover.mbtiles</code> file next to the output. 
+                Several roughness classes get one tileset each.</p>
+
+                <h3>Roughness zones</h3>
+                <p>Optional GeoPackage of land cover zone polygons with their class, label and the n of every roughness class, e.g. for HEC-RAS land cover layers. 
+                The land cover is polygonized in 2048 x 2048 pixel tiles on as many worker processes as <b>Processing threads</b>, and zones cut by the tiling are merged along the seams. 
+                <b>Minimum area</b> first merges smaller regions into their largest neighbour over the whole AOI. <b>Simplification tolerance</b>, in pixels, removes the pixel staircase 
+                while neighbouring zones keep one shared boundary, so no gaps or overlaps appear. Zones follow the WorldCover grid, also with a target grid.</p>
+
+                <h3>Statistics (advanced)</h3>
+                <p>While the raster is written, the pixels and area of every land cover class and the minimum, mean, standard deviation, percentiles and area-weighted mean of n are accumulated, 
+                with pixel areas corrected for latitude on the EPSG:4326 grid. They are stored in the <code>.aux.xml</code> sidecar of each output, so QGIS does not scan the raster again, 
+                logged, returned as outputs and, when <b>Land cover statistics</b> is set, written as a table with one row per class. With the result cache, the land cover of reused tiles is still read for the class areas.</p>
+
+                <h3>Compact output (advanced)</h3>
+                <p>Writes the roughness output as the uint8 WorldCover classes of the AOI instead of float32 n, a quarter of the size or less. The n of every selected roughness class is stored per land cover class in a raster attribute table 
+                and in the <code>MANNINGS_N</code> metadata of the <code>.aux.xml</code> sidecar, and the palette colours every class with the n ramp of <code>mannings_n.qml</code> for the first roughness class. 
+                Switching scenarios only rewrites the sidecar. <code>compact.CompactRoughness</code> expands blocks to float n on demand. Not available with a target grid, spatially correlated ensembles or change mode.</p>
+
+                <h3>Ensemble realizations (advanced)</h3>
+                <p>Monte Carlo ensemble of n for uncertainty studies. Each realization draws the n of every land cover class between the <b>Low</b> and <b>High</b> tables, 
+                uniformly or from a triangular distribution peaked at <b>Medium</b>, reproducibly for the <b>seed</b>. The clipped WorldCover classes are read once per chunk and every realization is gathered from the same class blocks, 
+                so the run time grows with the writing of the realizations, not with reads of the source. They are written as bands, or as separate rasters, named <code>realization_001</code> onwards. 
+                With a <b>correlation length</b> the n also varies within a class: each realization is a smooth random field over that distance, so nearby pixels of a class get similar n. 
+                Correlated realizations are written on the WorldCover grid, without the result cache or web tiles. The roughness class selection is ignored and change mode is not available.</p>
+
+                <h3>Run report</h3>
+                <p>The wall time, CPU time, bytes read from local disk and from the network, pixels processed and peak memory of each stage (AOI, lookup tables, source tiles, reclassification or aggregation, web tiles and styling) are always summarised in the log. 
+                When a path is given they are also written as JSON, with the plugin, GDAL and Python versions, for comparing runs and machines.</p>
 
                 <br>
                 <p align="right">Author: Abdullah Azzam</p>
@@ -113,11 +238,12 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
 
     def initAlgorithm(self, config=None):
         self.roughness_classes = ["Low", "Medium", "High"]
+        self.roughness_lookup = ["low_n.csv", "med_n.csv", "high_n.csv"]
         self.lc_pixel_size = 0.000083333333333
 
         # add aoi parameter
         self.addParameter(
-            QgsProcessingParameterVectorLayer(
+            QgsProcessingParameterFeatureSource(
                 "aoi",
                 "Area of Interest",
                 types=[QgsProcessing.TypeVectorPolygon],
@@ -125,13 +251,81 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # add land cover vintage selection
+        self._addVintageParameter()
+
         # add roughness class selection
         param = QgsProcessingParameterEnum(
             "ROUGHNESS_CLASS",
             "Roughness Class",
             options=self.roughness_classes,
+            allowMultiple=True,
+            defaultValue=[1],
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add user lookup tables
+        self._addCustomLookupParameter()
+
+        # add multi scenario output layout
+        param = QgsProcessingParameterEnum(
+            "SCENARIO_OUTPUT",
+            "Output for several roughness classes",
+            options=["Multi-band raster", "Separate rasters"],
+            allowMultiple=False,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add compact class output, n of every scenario in the attribute table
+        param = QgsProcessingParameterBoolean(
+            "COMPACT_OUTPUT",
+            "Write land cover classes with an n attribute table (compact uint8)",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add monte carlo ensemble between the low and high tables
+        param = QgsProcessingParameterNumber(
+            "ENSEMBLE_SIZE",
+            "Ensemble realizations (0 = off)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterEnum(
+            "ENSEMBLE_DISTRIBUTION",
+            "Ensemble distribution",
+            options=["Uniform between Low and High", "Triangular, peaked at Medium"],
             allowMultiple=False,
-            defaultValue=1,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "ENSEMBLE_SEED",
+            "Ensemble random seed",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=DEFAULT_ENSEMBLE_SEED,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "CORRELATION_LENGTH",
+            "Ensemble correlation length (m, 0 = independent per class)",
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0.0,
+            defaultValue=0.0,
         )
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
@@ -140,7 +334,7 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                 "EsaWorldcoverAOI",
-                "ESA WorldCover 2021",
+                "ESA WorldCover",
                 optional=True,
                 createByDefault=False,
                 defaultValue=None,
@@ -157,110 +351,648 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
                 defaultValue=None,
             )
         )
-    def processAlgorithm(self, parameters, context, model_feedback):
-        feedback = QgsProcessingMultiStepFeedback(3, model_feedback)
 
-        # load aoi
-        aoi_layer = QgsProcessingUtils.mapLayerFromString(parameters["aoi"], context)
-        if aoi_layer is None or not isinstance(aoi_layer, QgsVectorLayer):
-            raise QgsProcessingException("invalid aoi vector layer.")
+        # add polygon masking option
+        param = QgsProcessingParameterBoolean(
+            "MASK_TO_AOI",
+            "Mask output to the AOI polygons",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
 
-        feedback.pushInfo(f"aoi original crs: {aoi_layer.crs().authid()}")
-
-        # reproject aoi to epsg:4326
-        target_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-        transformed_layer = processing.run(
-                "native:reprojectlayer",
-                {
-                    "INPUT": aoi_layer,
-                    "TARGET_CRS": target_crs,
-                    "OUTPUT": "memory:"
-                    },
-                context=context,
-                feedback=feedback
-                )["OUTPUT"]
-
-        if transformed_layer is None:
-            raise QgsProcessingException("failed to reproject aoi to epsg:4326.")
-
-        # extract extent
-        reprojected_extent = transformed_layer.extent()
-        feedback.pushInfo(f"aoi reprojected extent (epsg:4326): {reprojected_extent.toString()}")
-
-        if not hasattr(self, "lc_pixel_size") or self.lc_pixel_size is None:
-            raise QgsProcessingException("lc_pixel_size is not defined!")
-
-        extent_esa = (
-                reprojected_extent.xMinimum() - 2 * self.lc_pixel_size,
-                reprojected_extent.yMinimum() - 2 * self.lc_pixel_size,
-                reprojected_extent.xMaximum() + 2 * self.lc_pixel_size,
-                reprojected_extent.yMaximum() + 2 * self.lc_pixel_size,
-                )
-        feedback.pushInfo(f"buffered esa extent: {extent_esa}")
+        # add aoi feature id filter
+        param = QgsProcessingParameterString(
+            "FEATURE_IDS",
+            "AOI feature IDs (comma separated, all features when empty)",
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
 
-        # clip esa worldcover and rename temp layer
-        #esa_output = parameters.get("EsaWorldcoverAOI", QgsProcessing.TEMPORARY_OUTPUT)
-        if parameters.get("EsaWorldcoverAOI", None):
+        # add model grid options
+        param = QgsProcessingParameterCrs(
+            "TARGET_CRS",
+            "Target CRS",
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "TARGET_RESOLUTION",
+            "Target resolution (target CRS units)",
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            defaultValue=0,
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterRasterLayer(
+            "SNAP_RASTER",
+            "Snap raster",
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterEnum(
+            "AGGREGATION",
+            "Aggregation method",
+            options=["Area-weighted mean", "Mode of class, then lookup", "Geometric mean"],
+            allowMultiple=False,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterBoolean(
+            "FULL_RESOLUTION",
+            "Read full resolution on coarse grids",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers("ScenarioRasters", "Manning's roughness per scenario"))
+
+        # add output layout options
+        self._addOutputFormatParameters()
+
+        # add local tile cache options
+        self._addTileCacheParameters()
+
+        # add concurrent block prefetch for remote reads
+        param = QgsProcessingParameterNumber(
+            "PREFETCH_WORKERS",
+            "Concurrent block downloads without tile cache (0 to disable)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            maxValue=64,
+            defaultValue=DEFAULT_WORKERS,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add chunk scheduling options
+        param = QgsProcessingParameterNumber(
+            "MEMORY_BUDGET",
+            "Memory budget for processing chunks (MB)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=16,
+            defaultValue=DEFAULT_MEMORY_MB,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "THREADS",
+            "Processing threads",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=1,
+            maxValue=64,
+            defaultValue=max(1, min(4, os.cpu_count() or 1)),
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterBoolean(
+            "RESUME",
+            "Resume an interrupted run from its last completed chunk",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add computed tile reuse
+        param = QgsProcessingParameterBoolean(
+            "RESULT_CACHE",
+            "Reuse computed roughness tiles between runs",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add styled web tile pyramid export
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                "WEB_TILES",
+                "Web tiles (MBTiles or GeoPackage)",
+                fileFilter="MBTiles (*.mbtiles);;GeoPackage (*.gpkg)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        param = QgsProcessingParameterBoolean(
+            "WEB_TILES_LANDCOVER",
+            "Add land cover web tiles",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "WEB_TILES_MIN_ZOOM",
+            "Web tiles minimum zoom",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            maxValue=MAX_ZOOM,
+            defaultValue=DEFAULT_MIN_ZOOM,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "WEB_TILES_MAX_ZOOM",
+            "Web tiles maximum zoom (empty for the land cover resolution)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            maxValue=MAX_ZOOM,
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add roughness zone polygons, e.g. for hec-ras land cover layers
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                "ROUGHNESS_ZONES",
+                "Roughness zones",
+                fileFilter="GeoPackage (*.gpkg)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        param = QgsProcessingParameterNumber(
+            "MIN_ZONE_AREA",
+            "Roughness zones minimum area (m²)",
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0.0,
+            defaultValue=0.0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "SIMPLIFY_TOLERANCE",
+            "Roughness zones simplification tolerance (pixels)",
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0.0,
+            defaultValue=0.0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add land cover histogram and n statistics
+        param = QgsProcessingParameterBoolean(
+            "STATISTICS",
+            "Compute statistics while writing (.aux.xml sidecar)",
+            defaultValue=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                "STATISTICS_TABLE",
+                "Land cover statistics",
+                type=QgsProcessing.TypeVector,
+                optional=True,
+                createByDefault=False,
+            )
+        )
+        for name, description in (("N_MIN", "minimum"), ("N_MEAN", "mean"), ("N_MEDIAN", "median"), ("N_MAX", "maximum")):
+            self.addOutput(QgsProcessingOutputNumber(name, f"Manning's n {description}"))
+
+        # add change mode output, n of both vintages and their difference from one read
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                "DELTA_N",
+                f"Change in Manning's n ({CHANGE_VINTAGES[1]} - {CHANGE_VINTAGES[0]})",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        # add machine-readable run report
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                "RUN_REPORT",
+                "Run report",
+                fileFilter="JSON (*.json)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+    def _addOutputFormatParameters(self):
+        """Add the advanced geotiff layout parameters"""
+        param = QgsProcessingParameterEnum(
+            "OUTPUT_FORMAT",
+            "Output GeoTIFF layout",
+            options=["Plain GeoTIFF", "Tiled and compressed GeoTIFF with overviews", "Cloud optimized GeoTIFF (COG)"],
+            allowMultiple=False,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterEnum(
+            "COMPRESSION",
+            "Compression",
+            options=COMPRESSION_METHODS,
+            allowMultiple=False,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "PRECISION",
+            "Round n to decimals (0 keeps full precision)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            maxValue=7,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+    def _addTileCacheParameters(self, cache_by_default=False):
+        """Add the advanced tile cache and offline parameters"""
+        param = QgsProcessingParameterBoolean(
+            "TILE_CACHE",
+            "Cache WorldCover tiles locally",
+            defaultValue=cache_by_default,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterFile(
+            "TILE_CACHE_DIR",
+            "Tile cache folder",
+            behavior=QgsProcessingParameterFile.Folder,
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterNumber(
+            "TILE_CACHE_SIZE",
+            "Tile cache size limit (MB)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=DEFAULT_CACHE_SIZE_MB,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterBoolean(
+            "OFFLINE",
+            "Offline mode (serve tiles only from the cache or mirror folder)",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterFile(
+            "MIRROR_DIR",
+            "Local WorldCover mirror folder",
+            behavior=QgsProcessingParameterFile.Folder,
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+    def _writeStatisticsTable(self, parameters, context, statistics, lookups):
+        """Table of the land cover classes of the output with their area and n"""
+        fields = QgsFields()
+        fields.append(QgsField("class", QVariant.Int))
+        fields.append(QgsField("label", QVariant.String))
+        fields.append(QgsField("pixels", QVariant.LongLong))
+        fields.append(QgsField("area_m2" if statistics["area_units"] == "m2" else "area", QVariant.Double, len=20, prec=2))
+        fields.append(QgsField("fraction", QVariant.Double, len=10, prec=6))
+        for lookup in lookups:
+            fields.append(QgsField("n" if len(lookups) == 1 else f"n_{lookup.name}", QVariant.Double, len=10, prec=6))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, "STATISTICS_TABLE", context, fields, QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+        if sink is None:
+            return None
+        for row in statistics["classes"]:
+            feature = QgsFeature(fields)
+            n_values = [float(lookup.lut[row["class"]]) if lookup.lut[row["class"]] != NODATA_N else None for lookup in lookups]
+            feature.setAttributes([row["class"], row["label"], row["pixels"], row["area"], row["fraction"]] + n_values)
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        return dest_id
+
+    def _driverForPath(self, path):
+        """Gdal driver short name for an output path, GTiff when unknown"""
+        return QgsRasterFileWriter.driverForExtension(os.path.splitext(path)[1]) or "GTiff"
+
+    def _addCustomLookupParameter(self):
+        """Add the user lookup tables parameter"""
+        param = QgsProcessingParameterMultipleLayers(
+            "CUSTOM_LOOKUPS",
+            "Custom lookup tables (csv: land cover class, n)",
+            layerType=QgsProcessing.TypeFile,
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+    def _addVintageParameter(self):
+        """Add the esa worldcover vintage selection"""
+        self.vintages = vintage_names()
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "VINTAGE",
+                "ESA WorldCover vintage",
+                options=[vintage_label(vintage) for vintage in self.vintages],
+                allowMultiple=False,
+                defaultValue=self.vintages.index(DEFAULT_VINTAGE),
+            )
+        )
+
+    def _vintage(self, parameters, context):
+        """Selected vintage, e.g. 2021"""
+        return vintage_names()[self.parameterAsEnum(parameters, "VINTAGE", context)]
+
+    def _loadLookups(self, parameters, context, feedback):
+        """Selected bundled and custom lookup tables, compiled once per file version
+
+        Returns the scenario names and the compiled tables in output order.
+        """
+        paths = [(self.roughness_classes[scenario], os.path.join(BUNDLED_DIR, self.roughness_lookup[scenario]))
+                 for scenario in self.parameterAsEnums(parameters, "ROUGHNESS_CLASS", context)]
+        for path in self.parameterAsFileList(parameters, "CUSTOM_LOOKUPS", context):
+            paths.append((os.path.splitext(os.path.basename(path))[0], path))
+        if not paths:
+            raise QgsProcessingException("select at least one roughness class or custom lookup table.")
+
+        names, lookups = [], []
+        for name, path in paths:
             try:
-                parameters["EsaWorldcoverAOI"].destinationName = "ESA WorldCover 2021"
-            except AttributeError:
-                pass
-            esa_output = parameters["EsaWorldcoverAOI"]
+                lookup = load_lookup(path)
+            except OSError as e:
+                raise QgsProcessingException(f"lookup table not found: {path} ({e})")
+            except ValueError as e:
+                raise QgsProcessingException(f"invalid lookup table: {e}")
+            if any(lookup.name == other.name for other in lookups):
+                raise QgsProcessingException(f"two lookup tables are named {lookup.name}, rename one of them.")
+            feedback.pushInfo(f"lookup table {lookup.name}: {len(lookup.values)} land cover classes from {lookup.path}")
+            if lookup.missing:
+                feedback.pushWarning(f"lookup table {lookup.name} has no n for classes {', '.join(map(str, lookup.missing))}, they are written as nodata.")
+            names.append(name)
+            lookups.append(lookup)
+        return names, lookups
+
+    def _loadEnsemble(self, parameters, context, feedback):
+        """Monte carlo realizations between the bundled low and high tables, None when off
+
+        Returns the realization names, a compiled lookup per realization, the
+        spatially correlated field or None, and the tables bounding the n.
+        """
+        size = self.parameterAsInt(parameters, "ENSEMBLE_SIZE", context)
+        if size <= 0:
+            return None
+        try:
+            low, medium, high = (load_lookup(os.path.join(BUNDLED_DIR, filename)) for filename in self.roughness_lookup)
+        except (OSError, ValueError) as e:
+            raise QgsProcessingException(f"unable to load the bundled lookup tables: {e}")
+        mode = medium if self.parameterAsEnum(parameters, "ENSEMBLE_DISTRIBUTION", context) == 1 else None
+        seed = self.parameterAsInt(parameters, "ENSEMBLE_SEED", context)
+        correlation_length = self.parameterAsDouble(parameters, "CORRELATION_LENGTH", context)
+        if self.parameterAsFileList(parameters, "CUSTOM_LOOKUPS", context):
+            feedback.pushWarning("ensembles are drawn between the Low and High tables, the custom lookup tables are not used.")
+        field = None
+        if correlation_length > 0:
+            # metres to land cover pixels, along the meridian
+            field = CorrelatedEnsemble(low, high, size, correlation_length / (self.lc_pixel_size * 111320.0), seed=seed, mode=mode)
+            luts = field.luts
+            feedback.pushInfo(f"{size} spatially correlated realization(s) over {correlation_length:g} m, seed {seed}")
         else:
-            esa_output = QgsProcessing.TEMPORARY_OUTPUT
-
-
-        gdal_output = processing.run(
-                "gdal:cliprasterbyextent",
-                {
-                    "INPUT": os.path.normpath(os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.vrt")),
-                    "PROJWIN": f"{extent_esa[0]},{extent_esa[2]},{extent_esa[1]},{extent_esa[3]} [EPSG:4326]",
-                    "OUTPUT": esa_output,
-                    },
-                context=context, feedback=feedback,
-                is_child_algorithm=True
-                )
+            luts = class_ensemble(low, high, size, seed=seed, mode=mode)
+            feedback.pushInfo(f"{size} realization(s) with every class drawn independently, seed {seed}")
+        return realization_names(size), realization_lookups(luts), field, [low, high]
 
-        if "OUTPUT" not in gdal_output or not os.path.exists(gdal_output["OUTPUT"]):
-            raise QgsProcessingException("esa raster processing failed.")
+    def _targetGrid(self, parameters, context, aoi_crs, aoi_bounds):
+        """Output grid from the target crs, resolution and snap raster, None for the native grid"""
+        target_crs = self.parameterAsCrs(parameters, "TARGET_CRS", context)
+        resolution = self.parameterAsDouble(parameters, "TARGET_RESOLUTION", context)
+        snap_layer = self.parameterAsRasterLayer(parameters, "SNAP_RASTER", context)
+        if not target_crs.isValid() and resolution <= 0 and snap_layer is None:
+            return None
 
-        esa_raster = gdal_output["OUTPUT"]
-        feedback.pushInfo(f"esa worldcover raster processed at: {esa_raster}")
+        if not target_crs.isValid():
+            target_crs = snap_layer.crs() if snap_layer is not None else QgsCoordinateReferenceSystem("EPSG:4326")
+        if resolution > 0:
+            res_x = res_y = resolution
+        elif snap_layer is not None:
+            res_x, res_y = snap_layer.rasterUnitsPerPixelX(), snap_layer.rasterUnitsPerPixelY()
+        else:
+            raise QgsProcessingException("a target resolution or snap raster is required with a target crs.")
 
+        # cells are aligned to the snap raster origin, or to multiples of the resolution
+        origin = (0.0, 0.0)
+        if snap_layer is not None:
+            if snap_layer.crs() != target_crs:
+                raise QgsProcessingException("snap raster must be in the target crs.")
+            origin = (snap_layer.extent().xMinimum(), snap_layer.extent().yMaximum())
 
-        feedback.pushInfo("starting Manning's roughness calculation...")
+        try:
+            extent = QgsCoordinateTransform(aoi_crs, target_crs, context.transformContext()).transformBoundingBox(
+                    aoi_bounds, QgsCoordinateTransform.ForwardTransform, target_crs.isGeographic())
+        except QgsCsException as e:
+            raise QgsProcessingException(f"failed to transform aoi to the target crs: {e}")
+        bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        grid = snap_grid(target_crs.toWkt(), unwrap_extent(bounds), res_x, res_y, origin)
+        grid["qgs_crs"] = target_crs
+        return grid
 
-        roughness_lookup = ["low_n.csv", "med_n.csv", "high_n.csv"]
-        selected_lookup = roughness_lookup[parameters["ROUGHNESS_CLASS"]]
-        lookup_file = os.path.normpath(os.path.join(os.path.dirname(__file__), "lookups", selected_lookup))
+    def _outputFormat(self, parameters, context):
+        """Geotiff layout configured by the output parameters, None for a plain geotiff"""
+        layout = self.parameterAsEnum(parameters, "OUTPUT_FORMAT", context)
+        if layout == 0:
+            return None
+        precision = self.parameterAsInt(parameters, "PRECISION", context)
+        return OutputFormat(
+            compress=COMPRESSION_METHODS[self.parameterAsEnum(parameters, "COMPRESSION", context)],
+            overviews=True,
+            cog=layout == 2,
+            precision=precision or None,
+        )
+
+    def _tileCache(self, parameters, context):
+        """Tile cache configured by the cache parameters, None when tiles are read remotely"""
+        use_cache = self.parameterAsBoolean(parameters, "TILE_CACHE", context)
+        offline = self.parameterAsBoolean(parameters, "OFFLINE", context)
+        mirror_dir = self.parameterAsFile(parameters, "MIRROR_DIR", context)
+        if not (use_cache or offline or mirror_dir):
+            return None
+        cache_dir = self.parameterAsFile(parameters, "TILE_CACHE_DIR", context)
+        if not cache_dir:
+            cache_dir = os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "mannings_roughness")
+        return TileCache(
+            cache_dir,
+            max_size_mb=self.parameterAsInt(parameters, "TILE_CACHE_SIZE", context),
+            offline=offline,
+            mirror_dir=mirror_dir or None,
+        )
+
+    def _aoiRequest(self, parameters, context):
+        """Geometry only request of the aoi features, limited to the feature ids when given"""
+        request = QgsFeatureRequest().setNoAttributes()
+        feature_ids = self.parameterAsString(parameters, "FEATURE_IDS", context).strip()
+        if feature_ids:
+            try:
+                request.setFilterFids([int(value) for value in re.split(r"[\s,;]+", feature_ids) if value])
+            except ValueError:
+                raise QgsProcessingException(f"aoi feature ids must be integers separated by commas: {feature_ids}")
+        return request
+
+    def _aoiBounds(self, source, request):
+        """Bounding box of the requested aoi features in the layer crs, no geometry is reprojected"""
+        if request.filterType() == QgsFeatureRequest.FilterNone:
+            # the provider extent, or the box of the selection for selected features only
+            return source.sourceExtent()
+        bounds = QgsRectangle()
+        bounds.setMinimal()
+        for feature in source.getFeatures(request):
+            if feature.hasGeometry():
+                bounds.combineExtentWith(feature.geometry().boundingBox())
+        return bounds
 
-        feedback.pushInfo(f"loading Manning's roughness lookup table from: {lookup_file}")
+    def _aoiGeographicExtent(self, source, request):
+        """Extent of the aoi parts in a geographic layer crs, xmin > xmax across the antimeridian
 
-        if not os.path.exists(lookup_file):
-            raise QgsProcessingException(f"lookup table not found: {lookup_file}")
+        Parts split at the antimeridian only show as a gap between their
+        boxes, the extent of the layer spans every longitude.
+        """
+        boxes = []
+        for feature in source.getFeatures(request):
+            if feature.hasGeometry():
+                for part in feature.geometry().asGeometryCollection():
+                    box = part.boundingBox()
+                    boxes.append((box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()))
+        return geographic_extent(boxes) if boxes else None
 
-        lookup_values = []
-        with open(lookup_file, "r", encoding="utf-8") as file:
-            lines = file.readlines()
-            for line in lines[1:]:
-                parts = line.strip().split(",")
-                if len(parts) == 2:
-                    try:
-                        lc_value = int(parts[0])
-                        n_value = float(parts[1])
-                        lookup_values.append((lc_value, n_value))
-                    except ValueError:
-                        feedback.pushWarning(f"skipping invalid row in lookup file: {line.strip()}")
+    def _aoiMask(self, source, request, crs, context, antimeridian=False):
+        """Union of the aoi polygons in ``crs`` as wkb, the only place they are reprojected
 
-        if not lookup_values:
-            raise QgsProcessingException(f"lookup table {selected_lookup} is empty or malformed.")
+        Across the antimeridian the polygons are first taken to longitudes
+        about 180 degrees, so they stay whole with x continuing past 180.
+        """
+        if antimeridian:
+            crs = QgsCoordinateReferenceSystem.fromProj("+proj=longlat +ellps=WGS84 +towgs84=0,0,0 +pm=180 +no_defs")
+        request = QgsFeatureRequest(request).setDestinationCrs(crs, context.transformContext())
+        geometries = [feature.geometry() for feature in source.getFeatures(request) if feature.hasGeometry()]
+        if not geometries:
+            raise QgsProcessingException("aoi has no polygon geometry to mask with.")
+        mask_geometry = QgsGeometry.unaryUnion(geometries)
+        if antimeridian:
+            mask_geometry.translate(180.0, 0.0)
+        return bytes(mask_geometry.asWkb())
 
-        feedback.pushInfo(f"loaded {len(lookup_values)} land cover to roughness mappings.")
+    def processAlgorithm(self, parameters, context, model_feedback):
+        feedback = QgsProcessingMultiStepFeedback(2, model_feedback)
 
-        exprs = " + ".join([f"(A == {lc}) * {n}" for lc, n in lookup_values])
-        feedback.pushInfo(f"generated raster math expression: {exprs}")
+        # load aoi, selected features only when asked for
+        source = self.parameterAsSource(parameters, "aoi", context)
+        if source is None:
+            raise QgsProcessingException("invalid aoi vector layer.")
 
-        input_dict = {"input_a": esa_raster, "band_a": 1}
+        feedback.pushInfo(f"aoi original crs: {source.sourceCrs().authid()}")
+
+        # per stage wall and cpu time, bytes read and peak memory of this run
+        report = RunReport(self.name(), metadata={"aoi": source.sourceName(), "aoi_crs": source.sourceCrs().authid()})
+
+        # aoi extent in epsg:4326, the crs of the worldcover mosaic, from its densified bounding box
+        with report.stage("aoi"):
+            request = self._aoiRequest(parameters, context)
+            if source.sourceCrs().isGeographic():
+                layer_extent = self._aoiGeographicExtent(source, request)
+                if layer_extent is None:
+                    raise QgsProcessingException("aoi has no polygon geometry.")
+                # continuous in the layer crs too, so a target grid only covers the aoi
+                aoi_bounds = QgsRectangle(*unwrap_extent(layer_extent))
+                try:
+                    extent = transform_bounds(layer_extent, source.sourceCrs().toWkt(), QgsCoordinateReferenceSystem("EPSG:4326").toWkt())
+                except RuntimeError as e:
+                    raise QgsProcessingException(f"failed to reproject aoi to epsg:4326: {e}")
+            else:
+                aoi_bounds = self._aoiBounds(source, request)
+                if aoi_bounds.isEmpty():
+                    raise QgsProcessingException("aoi has no polygon geometry.")
+                transform = QgsCoordinateTransform(source.sourceCrs(), QgsCoordinateReferenceSystem("EPSG:4326"), context.transformContext())
+                try:
+                    # xmin > xmax when the aoi crosses the antimeridian
+                    reprojected_extent = transform.transformBoundingBox(aoi_bounds, QgsCoordinateTransform.ForwardTransform, True)
+                except QgsCsException as e:
+                    raise QgsProcessingException(f"failed to reproject aoi to epsg:4326: {e}")
+                extent = unwrap_extent((reprojected_extent.xMinimum(), reprojected_extent.yMinimum(), reprojected_extent.xMaximum(), reprojected_extent.yMaximum()))
+        feedback.pushInfo(f"aoi reprojected extent (epsg:4326): {', '.join(f'{value:.6f}' for value in extent)}")
+        if extent[2] > 180.0:
+            feedback.pushInfo("aoi crosses the antimeridian, only the land cover on either side of it is read.")
+
+        # optional model grid, it then sets the area read from worldcover
+        target_grid = self._targetGrid(parameters, context, source.sourceCrs(), aoi_bounds)
+        if target_grid is not None:
+            feedback.pushInfo(
+                    f"target grid: {target_grid['qgs_crs'].authid()}, {target_grid['xsize']} x {target_grid['ysize']} cells "
+                    f"of {target_grid['geotransform'][1]} x {abs(target_grid['geotransform'][5])}"
+                    )
+
+        # aoi polygons in the output crs for block and pixel masking, only reprojected here
+        mask_wkb = None
+        if self.parameterAsBoolean(parameters, "MASK_TO_AOI", context):
+            if target_grid is None:
+                mask_crs, antimeridian = QgsCoordinateReferenceSystem("EPSG:4326"), extent[2] > 180.0
+            else:
+                mask_crs = target_grid["qgs_crs"]
+                gt = target_grid["geotransform"]
+                antimeridian = mask_crs.isGeographic() and gt[0] + target_grid["xsize"] * gt[1] > 180.0
+            try:
+                mask_wkb = self._aoiMask(source, request, mask_crs, context, antimeridian)
+            except QgsCsException as e:
+                raise QgsProcessingException(f"failed to reproject aoi to the output crs: {e}")
+            feedback.pushInfo("masking output to the aoi polygons, blocks outside the aoi are skipped.")
+
+        feedback.pushInfo("starting Manning's roughness calculation...")
+
+        # every selected scenario is applied to the same land cover blocks
+        with report.stage("lookups"):
+            ensemble = self._loadEnsemble(parameters, context, feedback)
+            if ensemble is not None:
+                scenario_names, lookups, field, table_lookups = ensemble
+            else:
+                scenario_names, lookups = self._loadLookups(parameters, context, feedback)
+                field, table_lookups = None, lookups
+        feedback.pushInfo(f"compiled lookup arrays for scenarios: {', '.join(scenario_names)}")
+
+        # the clipped esa raster is only written when the user asked for it
+        vintage = self._vintage(parameters, context)
+        esa_raster = None
+        if parameters.get("EsaWorldcoverAOI", None):
+            try:
+                parameters["EsaWorldcoverAOI"].destinationName = f"ESA WorldCover {vintage}"
+            except AttributeError:
+                pass
+            esa_raster = self.parameterAsOutputLayer(parameters, "EsaWorldcoverAOI", context) or None
+
+        # change mode writes the n of both vintages and their difference
+        delta_path = self.parameterAsOutputLayer(parameters, "DELTA_N", context) if parameters.get("DELTA_N") else None
+        if delta_path:
+            if target_grid is not None:
+                raise QgsProcessingException("change mode writes on the worldcover grid, clear the target grid.")
+            if ensemble is not None:
+                raise QgsProcessingException("ensembles are not written in change mode, set the realizations to 0.")
+            if esa_raster:
+                feedback.pushWarning("the land cover output is not written in change mode.")
+                esa_raster = None
 
         # rename temp roughness output
         #roughness_output = parameters.get("ManningsRoughness", QgsProcessing.TEMPORARY_OUTPUT)
@@ -269,71 +1001,244 @@ class ManningsRoughnessAlgorithm(QgsProcessingAlgorithm):
                 parameters["ManningsRoughness"].destinationName = "Manning's n"
             except AttributeError:
                 pass
-            roughness_output = parameters["ManningsRoughness"]
+        roughness_output = self.parameterAsOutputLayer(parameters, "ManningsRoughness", context)
+        if not roughness_output:
+            roughness_output = QgsProcessingUtils.generateTempFilename("mannings_n.tif")
+
+        # one raster per scenario, named after the roughness output
+        compact = self.parameterAsBoolean(parameters, "COMPACT_OUTPUT", context)
+        if compact and delta_path:
+            raise QgsProcessingException("change mode writes n, clear the compact output option.")
+        separate_rasters = len(lookups) > 1 and self.parameterAsEnum(parameters, "SCENARIO_OUTPUT", context) == 1
+        if separate_rasters and compact:
+            feedback.pushWarning("the compact raster holds every roughness class in its attribute table.")
+            separate_rasters = False
+        if separate_rasters and delta_path:
+            feedback.pushWarning("change mode writes the roughness classes as bands of each raster.")
+            separate_rasters = False
+        base, extension = os.path.splitext(roughness_output)
+        raster_labels = [None]
+        if separate_rasters:
+            roughness_targets = [f"{base}_{lookup.name}{extension}" for lookup in lookups]
+            raster_labels = scenario_names
+        elif delta_path:
+            # the selected vintage goes to the roughness output, the other one next to it
+            other = CHANGE_VINTAGES[1] if vintage == CHANGE_VINTAGES[0] else CHANGE_VINTAGES[0]
+            roughness_targets = [roughness_output, f"{base}_{other}{extension}"]
+            raster_labels = [vintage, other]
         else:
-            roughness_output = QgsProcessing.TEMPORARY_OUTPUT
-
-        gdal_result = processing.run(
-                "gdal:rastercalculator",
-                {
-                    "FORMULA": exprs,
-                    "INPUT_A": input_dict["input_a"],
-                    "BAND_A": input_dict["band_a"],
-                    "NO_DATA": -9999,
-                    "RTYPE": 5,
-                    "OUTPUT": roughness_output,
-                    },
-                context=context, feedback=feedback,
-                is_child_algorithm=True
+            roughness_targets = roughness_output
+
+        # the qgis independent core does the clip, reclassification and writing
+        result_cache_dir = None
+        if self.parameterAsBoolean(parameters, "RESULT_CACHE", context):
+            result_cache_dir = os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "mannings_roughness_results")
+        try:
+            prefetch_workers = self.parameterAsInt(parameters, "PREFETCH_WORKERS", context)
+            tile_cache = self._tileCache(parameters, context)
+            prefetcher = RangePrefetcher(workers=prefetch_workers) if prefetch_workers > 0 else None
+            engine = RoughnessEngine(
+                vrt_path=vintage_vrt(vintage),
+                tile_cache=tile_cache,
+                result_cache_dir=result_cache_dir,
+                prefetcher=prefetcher,
+            )
+            other_engine = None
+            if delta_path:
+                # both engines share the cache and prefetcher, so downloads are counted once
+                other_engine = RoughnessEngine(vrt_path=vintage_vrt(other), tile_cache=tile_cache, prefetcher=prefetcher)
+        except (OSError, ValueError, KeyError) as e:
+            raise QgsProcessingException(f"unable to load worldcover tile index: {e}")
+        report.remote_counters.append(engine.downloaded_bytes)
+        feedback.pushInfo(f"esa worldcover vintage: {vintage_label(vintage)}")
+        if engine.tile_cache is not None:
+            feedback.pushInfo(f"reading worldcover tiles through cache: {engine.tile_cache.cache_dir}")
+
+        # optional styled tile pyramid, built after the raster from the same source
+        web_tiles = None
+        web_tiles_path = self.parameterAsFileOutput(parameters, "WEB_TILES", context)
+        if web_tiles_path and delta_path:
+            feedback.pushWarning("web tiles are not written in change mode.")
+            web_tiles_path = None
+        if web_tiles_path:
+            web_tiles = {
+                "path": web_tiles_path,
+                "landcover": self.parameterAsBoolean(parameters, "WEB_TILES_LANDCOVER", context),
+                "min_zoom": self.parameterAsInt(parameters, "WEB_TILES_MIN_ZOOM", context),
+                "max_zoom": self.parameterAsInt(parameters, "WEB_TILES_MAX_ZOOM", context) if parameters.get("WEB_TILES_MAX_ZOOM") not in (None, "") else None,
+            }
+
+        # optional zone polygons, traced from the same source per tile in worker processes
+        zones = None
+        zones_path = self.parameterAsFileOutput(parameters, "ROUGHNESS_ZONES", context)
+        if zones_path and delta_path:
+            feedback.pushWarning("roughness zones are not written in change mode.")
+            zones_path = None
+        if zones_path:
+            zones = {
+                "path": zones_path,
+                "min_area": self.parameterAsDouble(parameters, "MIN_ZONE_AREA", context),
+                "simplify": self.parameterAsDouble(parameters, "SIMPLIFY_TOLERANCE", context),
+                "workers": self.parameterAsInt(parameters, "THREADS", context),
+            }
+
+        feedback.setCurrentStep(1)
+        scheduler = ChunkScheduler(
+            memory_mb=self.parameterAsInt(parameters, "MEMORY_BUDGET", context),
+            threads=self.parameterAsInt(parameters, "THREADS", context),
+            resume=self.parameterAsBoolean(parameters, "RESUME", context),
+        )
+        try:
+            if delta_path:
+                # earlier vintage first, the delta is later minus earlier
+                if vintage == CHANGE_VINTAGES[0]:
+                    earlier, later, change_targets = engine, other_engine, roughness_targets
+                else:
+                    earlier, later, change_targets = other_engine, engine, roughness_targets[::-1]
+                result = later.run_change(
+                    earlier, extent, change_targets, delta_path, lookups,
+                    band_names=scenario_names,
+                    mask_wkb=mask_wkb,
+                    output_format=self._outputFormat(parameters, context),
+                    driver_name=self._driverForPath(roughness_output),
+                    scheduler=scheduler,
+                    report=report,
+                    feedback=feedback,
+                )
+            else:
+                result = engine.run(
+                    extent, roughness_targets, lookups,
+                    esa_path=esa_raster,
+                    band_names=scenario_names,
+                    mask_wkb=mask_wkb,
+                    target_grid=target_grid,
+                    aggregation=AGGREGATION_METHODS[self.parameterAsEnum(parameters, "AGGREGATION", context)],
+                    output_format=self._outputFormat(parameters, context),
+                    driver_name=self._driverForPath(roughness_output),
+                    esa_driver_name=self._driverForPath(esa_raster) if esa_raster else "GTiff",
+                    vrt_path=QgsProcessingUtils.generateTempFilename("esa_worldcover_aoi.vrt"),
+                    web_tiles=web_tiles,
+                    report=report,
+                    statistics=self.parameterAsBoolean(parameters, "STATISTICS", context),
+                    field=field,
+                    compact=compact,
+                    full_resolution=self.parameterAsBoolean(parameters, "FULL_RESOLUTION", context),
+                    zones=zones,
+                    scheduler=scheduler,
+                    feedback=feedback,
                 )
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+        except (OSError, RuntimeError) as e:
+            raise QgsProcessingException(f"manning's roughness reclassification failed: {e}")
+
+        for removed in result["evicted"]:
+            feedback.pushInfo(f"evicted cached tile: {os.path.basename(removed)}")
+
+        if feedback.isCanceled():
+            return {}
 
-        if "OUTPUT" not in gdal_result or not os.path.exists(gdal_result["OUTPUT"]):
+        scenario_rasters = roughness_targets if separate_rasters or delta_path else [roughness_output]
+        if not all(os.path.exists(path) for path in scenario_rasters + ([delta_path] if delta_path else [])):
             raise QgsProcessingException("manning's roughness raster was not created!")
+        if delta_path:
+            feedback.pushInfo(f"change in Manning's n ({CHANGE_VINTAGES[1]} - {CHANGE_VINTAGES[0]}) saved at: {delta_path}")
+        if esa_raster:
+            feedback.pushInfo(f"esa worldcover raster processed at: {esa_raster}")
+        for path in result.get("web_tiles", []):
+            feedback.pushInfo(f"web tiles written to: {path}")
+        if result.get("zones"):
+            feedback.pushInfo(f"{result['zones']['zones']} roughness zone(s) written to: {zones_path}")
+        else:
+            zones_path = None
 
-        mannings_raster = gdal_result["OUTPUT"]
-        feedback.pushInfo(f"Manning's roughness raster saved at: {mannings_raster}")
+        mannings_raster = scenario_rasters[0]
+        for path in scenario_rasters:
+            feedback.pushInfo(f"Manning's roughness raster saved at: {path}")
         feedback.pushInfo("applying styling...")
 
         esa_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.qml"))
         roughness_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "mannings_n.qml"))
 
         ## renaming and styling 
-        # check if esa output is defined to avoid keyerror
-        esa_output_selected = "EsaWorldcoverAOI" in parameters and parameters["EsaWorldcoverAOI"] not in [None, ""]
-
-        # normalize raster paths to avoid OS issues
-        esa_raster = os.path.normpath(esa_raster) if esa_output_selected else None
-        mannings_raster = os.path.normpath(mannings_raster) if "ManningsRoughness" in parameters and parameters["ManningsRoughness"] not in [None, ""] else None
-
-        # only apply esa styling if the user selected an output
-        if esa_output_selected:
-            if os.path.exists(esa_raster):
-                esa_layer = QgsRasterLayer(esa_raster, "", "gdal")
-                if esa_layer.isValid():
-                    esa_layer.setName("ESA WorldCover 2021")
-                    esa_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.qml"))
-                    if os.path.exists(esa_style_path):
-                        esa_layer.loadNamedStyle(esa_style_path)
-                    esa_layer.triggerRepaint()
-                    QgsProject.instance().addMapLayer(esa_layer)
-
-        # apply styling to mannings n (independent of esa) 
-        if mannings_raster:
-            if os.path.exists(mannings_raster):
-                roughness_layer = QgsRasterLayer(mannings_raster, "", "gdal")
-                if roughness_layer.isValid():
-                    roughness_layer.setName("Manning's n")
-                    roughness_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "mannings_n.qml"))
-                    if os.path.exists(roughness_style_path):
-                        roughness_layer.loadNamedStyle(roughness_style_path)
-                    roughness_layer.triggerRepaint()
-                    QgsProject.instance().addMapLayer(roughness_layer)
+        with report.stage("styling"):
+            # check if esa output is defined to avoid keyerror
+            esa_output_selected = esa_raster is not None
+
+            # normalize raster paths to avoid OS issues
+            esa_raster = os.path.normpath(esa_raster) if esa_output_selected else None
+            mannings_raster = os.path.normpath(mannings_raster) if "ManningsRoughness" in parameters and parameters["ManningsRoughness"] not in [None, ""] else None
+
+            # only apply esa styling if the user selected an output
+            if esa_output_selected:
+                if os.path.exists(esa_raster):
+                    esa_layer = QgsRasterLayer(esa_raster, "", "gdal")
+                    if esa_layer.isValid():
+                        esa_layer.setName(f"ESA WorldCover {vintage}")
+                        esa_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.qml"))
+                        if os.path.exists(esa_style_path):
+                            esa_layer.loadNamedStyle(esa_style_path)
+                        esa_layer.triggerRepaint()
+                        QgsProject.instance().addMapLayer(esa_layer)
+
+            # apply styling to mannings n (independent of esa) 
+            if mannings_raster:
+                for scenario_name, path in zip(raster_labels, scenario_rasters):
+                    path = os.path.normpath(path)
+                    if os.path.exists(path):
+                        roughness_layer = QgsRasterLayer(path, "", "gdal")
+                        if roughness_layer.isValid():
+                            roughness_layer.setName(f"Manning's n ({scenario_name})" if scenario_name else "Manning's n")
+                            roughness_style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "mannings_n.qml"))
+                            # compact classes are coloured by the n ramp through their palette
+                            if os.path.exists(roughness_style_path) and not compact:
+                                roughness_layer.loadNamedStyle(roughness_style_path)
+                            roughness_layer.triggerRepaint()
+                            QgsProject.instance().addMapLayer(roughness_layer)
 
         feedback.pushInfo("styling applied. returning results.")
 
+        # class areas and n statistics gathered while the raster was written
+        statistics_outputs = {}
+        statistics = result.get("statistics")
+        if statistics is not None:
+            for row in statistics["classes"]:
+                feedback.pushInfo(f"class {row['class']:>3} {row['label']:<32} {row['fraction'] * 100:6.2f} %")
+            for stats in statistics["n"]:
+                if stats["count"]:
+                    feedback.pushInfo(
+                        f"n {stats['name']}: min {stats['min']:.4f}, mean {stats['mean']:.4f}, median {stats['p50']:.4f}, "
+                        f"max {stats['max']:.4f}, area-weighted mean {stats['area_weighted_mean'] or 0.0:.4f}"
+                    )
+            first = statistics["n"][0]
+            if first["count"]:
+                statistics_outputs.update({"N_MIN": first["min"], "N_MEAN": first["mean"], "N_MEDIAN": first["p50"], "N_MAX": first["max"]})
+            if parameters.get("STATISTICS_TABLE"):
+                statistics_outputs["STATISTICS_TABLE"] = self._writeStatisticsTable(parameters, context, statistics, table_lookups)
+            report.metadata["statistics"] = statistics
+
+        # stage summary in the log and, when requested, the machine-readable report
+        for line in report.summary():
+            feedback.pushInfo(line)
+        run_report_path = self.parameterAsFileOutput(parameters, "RUN_REPORT", context)
+        if run_report_path:
+            try:
+                report.write(run_report_path)
+            except OSError as e:
+                feedback.pushWarning(f"unable to write run report: {e}")
+                run_report_path = None
+            else:
+                feedback.pushInfo(f"run report written to: {run_report_path}")
+
         # return only the outputs that were selected
         return {
             "EsaWorldcoverAOI": esa_raster,
-            "ManningsRoughness": mannings_raster
+            "ManningsRoughness": mannings_raster,
+            "ScenarioRasters": [os.path.normpath(path) for path in scenario_rasters] if mannings_raster else [],
+            "WEB_TILES": web_tiles_path or None,
+            "ROUGHNESS_ZONES": zones_path or None,
+            "RUN_REPORT": run_report_path or None,
+            "DELTA_N": delta_path or None,
+            **statistics_outputs,
         }
 
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import re
+import shutil
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingUtils,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterDefinition,
+    QgsProcessingOutputMultipleLayers,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+import numpy as np
+
+from .batch import run_jobs
+from .dataset_registry import vintage_vrt
+from .mannings_roughness_algorithm import ManningsRoughnessAlgorithm
+from .reclassify import window_from_extent
+from .tile_index import TileIndex, index_path_for
+
+
+class ManningsRoughnessBatchAlgorithm(ManningsRoughnessAlgorithm):
+    """QGIS Processing Algorithm for Manning's Roughness, one raster per AOI feature"""
+
+    def name(self):
+        return "manningsroughnessbatch"
+
+    def displayName(self):
+        return "Manning's Roughness Generator (Batch AOI)"
+
+    def shortHelpString(self):
+        return QCoreApplication.translate(
+                "Processing",
+                """<html><body>
+                <h2>Algorithm description</h2>
+                <p>This algorithm generates one <b>Manning’s roughness coefficient raster</b> per feature of the AOI layer,
+                e.g. for every sub-catchment of a basin, instead of one raster over the bounding box of the whole layer.</p>
+
+                <p>Features are processed in parallel across worker processes.
+                WorldCover tiles shared by several features are fetched once into the local tile cache before the workers start, so no tile is downloaded twice.</p>
+
+                <h2>Input parameters</h2>
+                <h3>Area of Interest</h3>
+                <p>Polygon layer, each feature is an area of interest. Only selected features are used when "Selected features only" is checked.</p>
+
+                <h3>Name Field</h3>
+                <p>Attribute used to name the output rasters. The feature id is used when empty.</p>
+
+                <h3>Roughness Class</h3>
+                <p>One or more of <b>Low, Medium, and High</b>, plus any custom lookup tables. Several tables are written as bands of each output raster.</p>
+
+                <h3>Worker Processes</h3>
+                <p>Number of features processed at the same time.</p>
+
+                <h2>Outputs</h2>
+                <h3>Output Folder</h3>
+                <p>Folder receiving one <code>.tif</code> per feature, each with a <code>mannings_n.qml</code> style sidecar.</p>
+
+                <br>
+                <p align="right">Author: Abdullah Azzam</p>
+                <p align="right">Algorithm version: 1.0.0</p>
+                <p align="right">Contact email: mabdazzam@outlook.com</p>
+                <p>Disclaimer: The roughness values generated by this algorithm are approximations and should be reviewed before use in detailed hydrological modeling.</p>
+                </body></html>"""
+                )
+
+    def createInstance(self):
+        return ManningsRoughnessBatchAlgorithm()
+
+    def initAlgorithm(self, config=None):
+        self.roughness_classes = ["Low", "Medium", "High"]
+        self.roughness_lookup = ["low_n.csv", "med_n.csv", "high_n.csv"]
+        self.lc_pixel_size = 0.000083333333333
+
+        # add aoi parameter
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                "aoi",
+                "Area of Interest",
+                types=[QgsProcessing.TypeVectorPolygon],
+                defaultValue=None,
+            )
+        )
+
+        # add land cover vintage selection
+        self._addVintageParameter()
+
+        # add output naming field
+        self.addParameter(
+            QgsProcessingParameterField(
+                "NAME_FIELD",
+                "Name Field",
+                parentLayerParameterName="aoi",
+                optional=True,
+            )
+        )
+
+        # add roughness class selection
+        param = QgsProcessingParameterEnum(
+            "ROUGHNESS_CLASS",
+            "Roughness Class",
+            options=self.roughness_classes,
+            allowMultiple=True,
+            defaultValue=[1],
+            optional=True,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # add user lookup tables
+        self._addCustomLookupParameter()
+
+        # add worker count
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "WORKERS",
+                "Worker Processes",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=max(1, min(4, os.cpu_count() or 1)),
+            )
+        )
+
+        # add output folder
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "OUTPUT_FOLDER",
+                "Output Folder",
+            )
+        )
+
+        self.addOutput(QgsProcessingOutputMultipleLayers("OUTPUT_LAYERS", "Manning's roughness per feature"))
+
+        # add output layout options
+        self._addOutputFormatParameters()
+
+        # shared tiles are only fetched once through the cache
+        self._addTileCacheParameters(cache_by_default=True)
+
+    def _featureName(self, feature, name_field, used_names):
+        """File-system safe, unique output name for a feature"""
+        value = feature[name_field] if name_field else None
+        name = re.sub(r"[^\w\-.]+", "_", str(value)).strip("_") if value not in (None, "") else ""
+        name = name or f"feature_{feature.id()}"
+        unique, suffix = name, 1
+        while unique.lower() in used_names:
+            suffix += 1
+            unique = f"{name}_{suffix}"
+        used_names.add(unique.lower())
+        return unique
+
+    def processAlgorithm(self, parameters, context, model_feedback):
+        source = self.parameterAsSource(parameters, "aoi", context)
+        if source is None:
+            raise QgsProcessingException("invalid aoi vector layer.")
+
+        name_field = self.parameterAsString(parameters, "NAME_FIELD", context)
+        workers = self.parameterAsInt(parameters, "WORKERS", context)
+        output_folder = self.parameterAsString(parameters, "OUTPUT_FOLDER", context)
+        os.makedirs(output_folder, exist_ok=True)
+
+        scenario_names, lookups = self._loadLookups(parameters, context, model_feedback)
+        lookup_array = np.stack([lookup.lut for lookup in lookups])
+
+        landcover_vrt = vintage_vrt(self._vintage(parameters, context))
+        try:
+            tile_index = TileIndex.load(index_path_for(landcover_vrt))
+        except (OSError, ValueError, KeyError) as e:
+            raise QgsProcessingException(f"unable to load worldcover tile index: {e}")
+
+        # one job per feature, each on its own buffered extent
+        transform = QgsCoordinateTransform(source.sourceCrs(), QgsCoordinateReferenceSystem("EPSG:4326"), context.transformContext())
+        jobs = []
+        used_names = set()
+        for feature in source.getFeatures():
+            if model_feedback.isCanceled():
+                return {}
+            if not feature.hasGeometry() or feature.geometry().isEmpty():
+                model_feedback.pushWarning(f"skipping feature {feature.id()} without geometry.")
+                continue
+            try:
+                extent = transform.transformBoundingBox(feature.geometry().boundingBox())
+            except QgsCsException as e:
+                model_feedback.pushWarning(f"skipping feature {feature.id()}, reprojection failed: {e}")
+                continue
+            extent_esa = (
+                    extent.xMinimum() - 2 * self.lc_pixel_size,
+                    extent.yMinimum() - 2 * self.lc_pixel_size,
+                    extent.xMaximum() + 2 * self.lc_pixel_size,
+                    extent.yMaximum() + 2 * self.lc_pixel_size,
+                    )
+            try:
+                window = window_from_extent(tile_index.geotransform, extent_esa, tile_index.raster_xsize, tile_index.raster_ysize)
+            except ValueError as e:
+                model_feedback.pushWarning(f"skipping feature {feature.id()}: {e}")
+                continue
+            name = self._featureName(feature, name_field, used_names)
+            jobs.append({"name": name, "window": window, "dst_path": os.path.join(output_folder, f"{name}.tif")})
+
+        if not jobs:
+            raise QgsProcessingException("no aoi feature overlaps the land cover raster.")
+
+        feedback = QgsProcessingMultiStepFeedback(len(jobs) + 1, model_feedback)
+
+        # fetch every tile needed by any feature exactly once
+        tile_cache = self._tileCache(parameters, context)
+        needed_tiles = sorted({filename for job in jobs for filename, _, _ in tile_index.sources(job["window"])})
+        feedback.pushInfo(f"{len(jobs)} aoi feature(s) touch {len(needed_tiles)} worldcover tile(s).")
+        local_tiles = {}
+        if tile_cache is not None:
+            for current, filename in enumerate(needed_tiles):
+                if feedback.isCanceled():
+                    return {}
+                try:
+                    local_tiles[filename] = tile_cache.fetch(filename, feedback=feedback)
+                except (OSError, RuntimeError) as e:
+                    raise QgsProcessingException(f"unable to serve worldcover tiles from cache: {e}")
+                feedback.setProgress(100.0 * (current + 1) / len(needed_tiles))
+        else:
+            feedback.pushWarning("tile cache disabled, features sharing tiles read them remotely each time.")
+
+        output_format = self._outputFormat(parameters, context)
+        for job in jobs:
+            job["src_path"], _ = tile_index.write_window_vrt(
+                job["window"],
+                QgsProcessingUtils.generateTempFilename(f"{job['name']}.vrt"),
+                resolve=local_tiles.get if tile_cache is not None else None,
+            )
+            job["lut"] = lookup_array
+            job["band_names"] = scenario_names
+            job["output_format"] = output_format
+
+        style_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "mannings_n.qml"))
+        written = []
+        finished = []
+
+        def on_done(job, error):
+            finished.append(job["name"])
+            if error is not None:
+                feedback.pushWarning(f"{job['name']} failed: {error}")
+            else:
+                # style sidecar picked up by qgis when the raster is opened
+                shutil.copyfile(style_path, os.path.splitext(job["dst_path"])[0] + ".qml")
+                written.append(job["dst_path"])
+                feedback.pushInfo(f"{job['name']} written to: {job['dst_path']}")
+            feedback.setCurrentStep(1 + len(finished))
+
+        feedback.setCurrentStep(1)
+        feedback.pushInfo(f"processing {len(jobs)} aoi feature(s) with {workers} worker process(es)...")
+        run_jobs(jobs, workers=workers, feedback=feedback, on_done=on_done)
+
+        if tile_cache is not None:
+            tile_cache.evict(keep=local_tiles.values())
+
+        if feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo(f"{len(written)} of {len(jobs)} roughness raster(s) written.")
+        return {
+            "OUTPUT_FOLDER": output_folder,
+            "OUTPUT_LAYERS": written,
+        }
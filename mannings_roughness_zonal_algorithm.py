@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import math
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingUtils,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsRectangle,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterFeatureSink,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+import numpy as np
+
+from .dataset_registry import vintage_vrt
+from .mannings_roughness_algorithm import ManningsRoughnessAlgorithm
+from .reclassify import window_from_extent
+from .tile_index import TileIndex, index_path_for
+from .zonal import zonal_class_areas, zonal_statistics
+
+
+class ManningsRoughnessZonalAlgorithm(ManningsRoughnessAlgorithm):
+    """QGIS Processing Algorithm for area-weighted Manning's n per polygon feature"""
+
+    def name(self):
+        return "manningsroughnesszonal"
+
+    def displayName(self):
+        return "Manning's Roughness per Feature (Zonal)"
+
+    def shortHelpString(self):
+        return QCoreApplication.translate(
+                "Processing",
+                """<html><body>
+                <h2>Algorithm description</h2>
+                <p>This algorithm computes one <b>area-weighted Manning’s n</b> per polygon feature, e.g. per cell of a 2D model mesh, 
+                directly from the ESA WorldCover 2021 classes and the same lookup tables as the Manning's Roughness Generator.</p>
+
+                <p>The land cover is read once, block by block. Each block rasterizes the ids of the features touching it and adds up the area of every class per feature, 
+                so hundreds of thousands of features are handled without writing a roughness raster or running zonal statistics on it.</p>
+
+                <h2>Input parameters</h2>
+                <h3>Polygons</h3>
+                <p>Polygon layer, e.g. model mesh cells. Features should not overlap, a pixel is counted for one feature only. 
+                Features too small to contain a land cover pixel centre take the class under a point inside the feature.</p>
+
+                <h3>Roughness Class</h3>
+                <p>One or more of <b>Low, Medium, and High</b>, plus any custom lookup tables. A single table is written to an <code>n</code> field, several tables to <code>n_</code> followed by the table name, e.g. <code>n_low_n</code>.</p>
+
+                <h3>Add class fractions</h3>
+                <p>Adds a <code>frac_&lt;class&gt;</code> field per land cover class with the share of the feature area it covers.</p>
+
+                <h2>Outputs</h2>
+                <h3>Zonal roughness</h3>
+                <p>Copy of the input features with the roughness fields appended. n is NULL where the feature has no mapped land cover.</p>
+
+                <br>
+                <p align="right">Author: Abdullah Azzam</p>
+                <p align="right">Algorithm version: 1.0.0</p>
+                <p align="right">Contact email: mabdazzam@outlook.com</p>
+                <p>Disclaimer: The roughness values generated by this algorithm are approximations and should be reviewed before use in detailed hydrological modeling.</p>
+                </body></html>"""
+                )
+
+    def createInstance(self):
+        return ManningsRoughnessZonalAlgorithm()
+
+    def initAlgorithm(self, config=None):
+        self.roughness_classes = ["Low", "Medium", "High"]
+        self.roughness_lookup = ["low_n.csv", "med_n.csv", "high_n.csv"]
+        self.lc_pixel_size = 0.000083333333333
+
+        # add polygon layer
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                "INPUT",
+                "Polygons",
+                types=[QgsProcessing.TypeVectorPolygon],
+                defaultValue=None,
+            )
+        )
+
+        # add land cover vintage selection
+        self._addVintageParameter()
+
+        # add roughness class selection
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "ROUGHNESS_CLASS",
+                "Roughness Class",
+                options=self.roughness_classes,
+                allowMultiple=True,
+                defaultValue=[1],
+                optional=True,
+            )
+        )
+
+        # add user lookup tables
+        self._addCustomLookupParameter()
+
+        # add class fraction option
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "CLASS_FRACTIONS",
+                "Add class fractions",
+                defaultValue=False,
+            )
+        )
+
+        # add output layer
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                "OUTPUT",
+                "Zonal roughness",
+                type=QgsProcessing.TypeVectorPolygon,
+            )
+        )
+
+        # add local tile cache options
+        self._addTileCacheParameters()
+
+    def processAlgorithm(self, parameters, context, model_feedback):
+        source = self.parameterAsSource(parameters, "INPUT", context)
+        if source is None:
+            raise QgsProcessingException("invalid polygon layer.")
+
+        _, lookups = self._loadLookups(parameters, context, model_feedback)
+        class_fractions = self.parameterAsBoolean(parameters, "CLASS_FRACTIONS", context)
+        lookup_array = np.stack([lookup.lut for lookup in lookups])
+
+        feedback = QgsProcessingMultiStepFeedback(4, model_feedback)
+
+        # zone geometries in epsg:4326, the zone id is the position in the list
+        request = QgsFeatureRequest().setNoAttributes().setDestinationCrs(QgsCoordinateReferenceSystem("EPSG:4326"), context.transformContext())
+        zone_of = {}
+        geometries = []
+        points = []
+        extent = QgsRectangle()
+        extent.setMinimal()
+        total = source.featureCount() or 1
+        for current, feature in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                return {}
+            zone_of[feature.id()] = len(geometries)
+            geometry = feature.geometry()
+            if geometry is None or geometry.isEmpty():
+                geometries.append(None)
+                points.append((math.nan, math.nan))
+            else:
+                geometries.append(bytes(geometry.asWkb()))
+                point = geometry.pointOnSurface()
+                point = (point if not point.isEmpty() else geometry.centroid()).asPoint()
+                points.append((point.x(), point.y()))
+                extent.combineExtentWith(geometry.boundingBox())
+            feedback.setProgress(100.0 * (current + 1) / total)
+
+        if all(geometry is None for geometry in geometries):
+            raise QgsProcessingException("polygon layer has no geometry.")
+        feedback.pushInfo(f"{len(geometries)} feature(s), extent (epsg:4326): {extent.toString()}")
+
+        extent_esa = (
+                extent.xMinimum() - 2 * self.lc_pixel_size,
+                extent.yMinimum() - 2 * self.lc_pixel_size,
+                extent.xMaximum() + 2 * self.lc_pixel_size,
+                extent.yMaximum() + 2 * self.lc_pixel_size,
+                )
+
+        # minimal vrt over the tiles under the features
+        landcover_vrt = vintage_vrt(self._vintage(parameters, context))
+        try:
+            tile_index = TileIndex.load(index_path_for(landcover_vrt))
+            window = window_from_extent(tile_index.geotransform, extent_esa, tile_index.raster_xsize, tile_index.raster_ysize)
+        except (OSError, ValueError, KeyError) as e:
+            raise QgsProcessingException(f"unable to locate worldcover tiles: {e}")
+        if tile_index.is_empty(window):
+            feedback.pushWarning("features fall entirely over ocean or nodata, no worldcover tiles are read.")
+
+        feedback.setCurrentStep(1)
+        tile_cache = self._tileCache(parameters, context)
+        try:
+            landcover_vrt, window_tiles = tile_index.write_window_vrt(
+                window,
+                QgsProcessingUtils.generateTempFilename("esa_worldcover_zones.vrt"),
+                resolve=(lambda filename: tile_cache.fetch(filename, feedback=feedback)) if tile_cache is not None else None,
+            )
+        except (OSError, RuntimeError) as e:
+            raise QgsProcessingException(f"unable to prepare worldcover tiles: {e}")
+        feedback.pushInfo(f"{len(window_tiles)} worldcover tile(s) intersect the features.")
+
+        # class areas per zone in a single pass over the land cover
+        feedback.setCurrentStep(2)
+        try:
+            areas, classes, point_slots = zonal_class_areas(landcover_vrt, geometries, lookup_array, points=points, feedback=feedback)
+        except (RuntimeError, ValueError) as e:
+            raise QgsProcessingException(f"zonal roughness failed: {e}")
+        if tile_cache is not None:
+            tile_cache.evict(keep=window_tiles)
+        if feedback.isCanceled():
+            return {}
+        n_values, fractions = zonal_statistics(areas, classes, lookup_array, point_slots)
+
+        # input fields followed by the roughness fields
+        fields = QgsFields(source.fields())
+        if len(lookups) == 1:
+            n_fields = ["n"]
+        else:
+            n_fields = [f"n_{lookup.name}" for lookup in lookups]
+        for name in n_fields:
+            fields.append(QgsField(name, QVariant.Double, len=10, prec=6))
+        if class_fractions:
+            for value in classes:
+                fields.append(QgsField(f"frac_{value}", QVariant.Double, len=10, prec=6))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, "OUTPUT", context, fields, source.wkbType(), source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException("unable to create the output layer.")
+
+        feedback.setCurrentStep(3)
+        for current, feature in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                return {}
+            zone = zone_of.get(feature.id())
+            values = []
+            if zone is not None:
+                values = [None if np.isnan(value) else float(value) for value in n_values[zone]]
+                if class_fractions:
+                    values += [None if np.isnan(value) else float(value) for value in fractions[zone]]
+            output = QgsFeature(fields)
+            output.setGeometry(feature.geometry())
+            output.setAttributes(feature.attributes() + (values or [None] * (len(fields) - len(source.fields()))))
+            sink.addFeature(output, QgsFeatureSink.FastInsert)
+            feedback.setProgress(100.0 * (current + 1) / total)
+
+        return {"OUTPUT": dest_id}
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+COMPRESSION_METHODS = ["DEFLATE", "ZSTD", "LZW", "NONE"]
+
+# internal tile edge, also the size the smallest overview level fits in
+DEFAULT_TILE_SIZE = 512
+
+
+class OutputFormat:
+    """GeoTIFF layout of the rasters written block by block
+
+    Outputs are tiled and compressed with a predictor matching the data
+    type. Overview levels are allocated empty up front and filled from each
+    block as it is written, so they never need a second read of the output.
+    With ``cog`` the streamed GeoTIFF is finally rewritten in cloud optimized
+    layout, copying the existing overviews instead of recomputing them.
+    ``precision`` rounds n to that many decimals, which compresses far better.
+    """
+
+    def __init__(self, compress="DEFLATE", overviews=True, cog=False, precision=None, tile_size=DEFAULT_TILE_SIZE):
+        if compress.upper() not in COMPRESSION_METHODS:
+            raise ValueError(f"unknown compression: {compress}")
+        self.compress = compress.upper()
+        self.overviews = overviews or cog
+        self.cog = cog
+        self.precision = precision
+        self.tile_size = tile_size
+
+    def creation_options(self, driver_name, data_type):
+        if driver_name != "GTiff":
+            return []
+        options = [
+            "TILED=YES",
+            f"BLOCKXSIZE={self.tile_size}",
+            f"BLOCKYSIZE={self.tile_size}",
+            "SPARSE_OK=TRUE",
+            "BIGTIFF=IF_SAFER",
+            f"COMPRESS={self.compress}",
+        ]
+        if self.compress != "NONE":
+            options.append("NUM_THREADS=ALL_CPUS")
+            if data_type == gdal.GDT_Float32:
+                options.append("PREDICTOR=3")
+        return options
+
+    def staging_path(self, path, driver_name):
+        """Path the streamed raster is written to before the cloud optimized copy"""
+        if self.cog and driver_name == "GTiff":
+            return os.path.splitext(path)[0] + ".stream.tif"
+        return path
+
+    def overview_factors(self, xsize, ysize, block_size):
+        """Power of two overview factors down to one tile, each dividing the processing block"""
+        factors = []
+        factor = 2
+        while (self.overviews and factor <= block_size and block_size % factor == 0
+               and max(xsize, ysize) > self.tile_size * factor // 2):
+            factors.append(factor)
+            factor *= 2
+        return factors
+
+    def quantize(self, values, nodata):
+        if self.precision is None:
+            return values
+        return np.where(values == nodata, values, np.round(values, self.precision)).astype(values.dtype)
+
+    def overview_blocks(self, values, factors, nodata, resampling="average"):
+        """Overview pixels of a block for every factor, computed without touching the raster"""
+        blocks = []
+        for factor in factors:
+            reduced = downsample(values, factor, nodata, resampling)
+            if resampling != "nearest":
+                reduced = self.quantize(reduced, nodata)
+            blocks.append(reduced)
+        return blocks
+
+    def write_overview_blocks(self, band, blocks, xoff, yoff, factors):
+        """Write precomputed overview pixels of a block, offsets must be multiples of every factor"""
+        for level, (factor, reduced) in enumerate(zip(factors, blocks)):
+            band.GetOverview(level).WriteArray(reduced, xoff // factor, yoff // factor)
+
+    def write_overviews(self, band, values, xoff, yoff, factors, nodata, resampling="average"):
+        """Write the overview pixels of a block, offsets must be multiples of every factor"""
+        self.write_overview_blocks(band, self.overview_blocks(values, factors, nodata, resampling), xoff, yoff, factors)
+
+    def finalize(self, path, driver_name):
+        """Rewrite the streamed raster of ``path`` in cloud optimized layout"""
+        staging = self.staging_path(path, driver_name)
+        if staging == path:
+            return path
+        src = gdal.Open(staging, gdal.GA_ReadOnly)
+        if src is None:
+            raise RuntimeError(f"unable to open streamed raster: {staging}")
+        floating = src.GetRasterBand(1).DataType == gdal.GDT_Float32
+        if gdal.GetDriverByName("COG") is not None:
+            options = gdal.TranslateOptions(format="COG", creationOptions=[
+                f"COMPRESS={self.compress}",
+                f"BLOCKSIZE={self.tile_size}",
+                f"PREDICTOR={'FLOATING_POINT' if floating and self.compress != 'NONE' else 'NO'}",
+                "OVERVIEWS=FORCE_USE_EXISTING",
+                "BIGTIFF=IF_SAFER",
+                "NUM_THREADS=ALL_CPUS",
+            ])
+        else:
+            # gdal < 3.1, a tiled copy with the overviews in front is cloud optimized too
+            options = gdal.TranslateOptions(format="GTiff", creationOptions=self.creation_options(
+                "GTiff", gdal.GDT_Float32 if floating else gdal.GDT_Byte) + ["COPY_SRC_OVERVIEWS=YES"])
+        dst = gdal.Translate(path, src, options=options)
+        if dst is None:
+            raise RuntimeError(f"unable to write cloud optimized geotiff: {path}")
+        dst = None
+        src = None
+        gdal.GetDriverByName("GTiff").Delete(staging)
+        return path
+
+
+def downsample(values, factor, nodata, resampling="average"):
+    """Reduce a block by ``factor``, partial edge cells keep their valid pixels"""
+    if resampling == "nearest":
+        return values[::factor, ::factor]
+    rows, cols = -(-values.shape[0] // factor), -(-values.shape[1] // factor)
+    padded = np.full((rows * factor, cols * factor), nodata, dtype=values.dtype)
+    padded[:values.shape[0], :values.shape[1]] = values
+    cells = padded.reshape(rows, factor, cols, factor)
+    valid = cells != nodata
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, cells, 0).sum(axis=(1, 3), dtype=np.float64)
+    return np.where(count > 0, total / np.maximum(count, 1), nodata).astype(values.dtype)
+
+
+def build_empty_overviews(dataset, factors):
+    """Allocate overview levels without computing them, levels follow the factor order"""
+    if factors and dataset.BuildOverviews("NONE", factors) != 0:
+        raise RuntimeError("unable to allocate overviews")
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import struct
+import tempfile
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from .batch import run_jobs
+from .raster_stats import class_labels, row_areas
+from .reclassify import LC_NODATA, NODATA_N, BlockMask, iter_windows
+
+DEFAULT_TILE_SIZE = 2048
+
+ZONES_LAYER = "roughness_zones"
+
+# geotransform of pixel corner coordinates themselves
+PIXEL_GRID = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+
+def junctions(classes):
+    """(rows + 1, cols + 1) mask of the pixel corners where three or more region edges meet"""
+    padded = np.pad(classes.astype(np.int16), 1, constant_values=-1)
+    north_west, north_east = padded[:-1, :-1], padded[:-1, 1:]
+    south_west, south_east = padded[1:, :-1], padded[1:, 1:]
+    degree = (
+        (north_west != north_east).astype(np.uint8) + (south_west != south_east)
+        + (north_west != south_west) + (north_east != south_east)
+    )
+    return degree >= 3
+
+
+def _pick(points, candidates):
+    # lowest x, then y, so a chain and its reverse choose the same vertex
+    return candidates[np.lexsort((points[candidates, 1], points[candidates, 0]))[0]]
+
+
+def douglas_peucker(points, tolerance):
+    """Vertices of a chain kept by douglas-peucker, the same whichever end the chain starts from"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = points[last] - points[first]
+        inner = points[first + 1:last] - points[first]
+        distance = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / np.hypot(segment[0], segment[1])
+        largest = distance.max()
+        if largest <= tolerance:
+            continue
+        split = _pick(points, np.flatnonzero(distance == largest) + first + 1)
+        keep[split] = True
+        stack.extend([(first, split), (split, last)])
+    return keep
+
+
+def _densify(ring):
+    """Every pixel corner along a closed axis aligned ring, without the closing vertex"""
+    corners = np.rint(ring).astype(np.int64)
+    delta = corners[1:] - corners[:-1]
+    length = np.abs(delta).sum(axis=1)
+    corners, delta, length = corners[:-1][length > 0], delta[length > 0], length[length > 0]
+    segment = np.repeat(np.arange(len(length)), length)
+    offset = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length)
+    return corners[segment] + (delta // length[:, None])[segment] * offset[:, None]
+
+
+def _farthest(points, start):
+    distance = np.square(points - points[start]).sum(axis=1)
+    return _pick(points, np.flatnonzero(distance == distance.max()))
+
+
+def ring_arcs(points, nodes, tile):
+    """Chains of a densified ring between the nodes it passes, each ending where the next starts
+
+    A ring meeting no node, or a chain returning to its first node, is cut
+    again at its vertex farthest from there, which both zones sharing it
+    find alike.
+    """
+    xoff, yoff = tile[:2]
+    anchors = list(np.flatnonzero(nodes[points[:, 1] - yoff, points[:, 0] - xoff]))
+    if not anchors:
+        anchors = [_pick(points, np.arange(len(points)))]
+    anchors.append(anchors[0] + len(points))
+    chains = []
+    for first, last in zip(anchors, anchors[1:]):
+        chain = np.take(points, np.arange(first, last + 1), axis=0, mode="wrap")
+        if (chain[0] == chain[-1]).all():
+            split = _farthest(chain[:-1], 0)
+            chains.extend([chain[:split + 1], chain[split:]])
+        else:
+            chains.append(chain)
+    return chains
+
+
+def simplify_zones(zones, nodes, tile, tolerance):
+    """Simplified rings of each zone, given as lists of rings in pixel corner coordinates
+
+    The rings are cut into arcs at the junctions of three or more zones and
+    at the tile corners, so an arc is the whole boundary between two zones
+    or along the tile edge. Each arc is simplified once and the rings are
+    rebuilt from the arcs, so neighbouring zones keep exactly the same
+    boundary and zones cut by a tile seam still meet along it. When a
+    rebuilt zone is not a valid polygon its arcs go back to the pixel
+    outline for every zone sharing them, until all zones are valid.
+    """
+    arcs = {}
+    users = {}
+    refs = []
+    for index, rings in enumerate(zones):
+        zone = []
+        for ring in rings:
+            chains = []
+            for chain in ring_arcs(_densify(ring), nodes, tile):
+                # keyed in the same direction from both sides of the boundary
+                forward, backward = chain.tobytes(), chain[::-1].tobytes()
+                key = min(forward, backward)
+                arcs.setdefault(key, chain if key == forward else chain[::-1].copy())
+                users.setdefault(key, set()).add(index)
+                chains.append((key, key != forward))
+            zone.append(chains)
+        refs.append(zone)
+
+    simplified = {key: chain[douglas_peucker(chain, tolerance)] for key, chain in arcs.items()}
+    outline = set()
+
+    def rebuild(chains):
+        parts = []
+        for key, reverse in chains:
+            chain = simplified[key]
+            parts.append((chain[::-1] if reverse else chain)[:-1])
+        ring = np.vstack(parts).astype(np.float64)
+        return np.vstack([ring, ring[:1]])
+
+    result = [None] * len(zones)
+    pending = set(range(len(zones)))
+    while pending:
+        invalid = []
+        for index in sorted(pending):
+            rings = [rebuild(chains) for chains in refs[index]]
+            if (min(len(ring) for ring in rings) >= 4
+                    and ogr.CreateGeometryFromWkb(_polygon_wkb(rings, PIXEL_GRID)).IsValid()):
+                result[index] = rings
+            else:
+                invalid.append(index)
+        reverted = {key for index in invalid for chains in refs[index] for key, _ in chains} - outline
+        if not reverted:
+            # nothing left to revert, the pixel outline of the zone itself
+            for index in invalid:
+                result[index] = zones[index]
+            break
+        for key in reverted:
+            simplified[key] = arcs[key][douglas_peucker(arcs[key], 0.0)]
+        outline |= reverted
+        pending = set(invalid).union(*(users[key] for key in reverted))
+    return result
+
+
+def _polygon_wkb(rings, geotransform):
+    """Little endian wkb of a polygon from rings in pixel corner coordinates"""
+    gt = geotransform
+    parts = [struct.pack("<BII", 1, ogr.wkbPolygon, len(rings))]
+    for ring in rings:
+        xy = np.empty(ring.shape, dtype="<f8")
+        xy[:, 0] = gt[0] + ring[:, 0] * gt[1] + ring[:, 1] * gt[2]
+        xy[:, 1] = gt[3] + ring[:, 0] * gt[4] + ring[:, 1] * gt[5]
+        parts.append(struct.pack("<I", len(ring)))
+        parts.append(xy.tobytes())
+    return b"".join(parts)
+
+
+def polygonize_tile(job):
+    """Zones of one tile as (class, wkb, on_seam) tuples, run in a worker process
+
+    Polygons are traced in pixel corner coordinates, so neighbouring tiles
+    produce exactly the same vertices along their common edge; ``on_seam``
+    marks polygons touching an edge shared with another tile.
+    """
+    xoff, yoff, xsize, ysize = job["tile"]
+    width, height = job["size"]
+    class_nodata = job["class_nodata"]
+    src = gdal.Open(job["src_path"], gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {job['src_path']}")
+    classes = src.GetRasterBand(1).ReadAsArray(xoff, yoff, xsize, ysize)
+    src = None
+    if job.get("mask_wkb") is not None:
+        inside = BlockMask(job["mask_wkb"], job["geotransform"]).block(xoff, yoff, xsize, ysize)
+        if inside is None:
+            return []
+        if inside is not True:
+            classes[~inside] = class_nodata
+    valid = classes != class_nodata
+    if not valid.any():
+        return []
+
+    driver = gdal.GetDriverByName("MEM")
+    raster = driver.Create("", xsize, ysize, 1, gdal.GDT_Byte)
+    raster.SetGeoTransform((xoff, 1, 0, yoff, 0, 1))
+    raster.GetRasterBand(1).WriteArray(classes)
+    mask = driver.Create("", xsize, ysize, 1, gdal.GDT_Byte)
+    mask.GetRasterBand(1).WriteArray(valid.astype(np.uint8))
+    source = (ogr.GetDriverByName("Memory") or ogr.GetDriverByName("MEM")).CreateDataSource("zones")
+    layer = source.CreateLayer("zones", geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("class", ogr.OFTInteger))
+    gdal.Polygonize(raster.GetRasterBand(1), mask.GetRasterBand(1), layer, 0, [])
+
+    features = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        rings = [np.asarray(geometry.GetGeometryRef(index).GetPoints(), dtype=np.float64)[:, :2]
+                 for index in range(geometry.GetGeometryCount())]
+        features.append((feature.GetField(0), rings))
+    layer = source = None
+
+    outlines = [rings for _, rings in features]
+    tolerance = job.get("simplify", 0.0)
+    if tolerance > 0 and features:
+        nodes = junctions(classes)
+        nodes[0, 0] = nodes[0, -1] = nodes[-1, 0] = nodes[-1, -1] = True
+        outlines = simplify_zones(outlines, nodes, job["tile"], tolerance)
+    zones = []
+    for (value, rings), simplified in zip(features, outlines):
+        wkb = _polygon_wkb(simplified, job["geotransform"])
+        (min_x, min_y), (max_x, max_y) = rings[0].min(axis=0), rings[0].max(axis=0)
+        on_seam = bool(
+            (min_x == xoff and xoff > 0) or (max_x == xoff + xsize and xoff + xsize < width)
+            or (min_y == yoff and yoff > 0) or (max_y == yoff + ysize and yoff + ysize < height)
+        )
+        zones.append((value, wkb, on_seam))
+    return zones
+
+
+def _parts(geometry):
+    """Polygons of a polygon or multipolygon"""
+    if geometry is None or geometry.IsEmpty():
+        return []
+    if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbPolygon:
+        return [geometry]
+    return [geometry.GetGeometryRef(index).Clone() for index in range(geometry.GetGeometryCount())
+            if ogr.GT_Flatten(geometry.GetGeometryRef(index).GetGeometryType()) == ogr.wkbPolygon]
+
+
+def polygonize_classes(src_path, dst_path, lut, names=None, mask_wkb=None, min_area=0.0,
+                       simplify=0.0, workers=1, tile_size=DEFAULT_TILE_SIZE, layer_name=ZONES_LAYER, feedback=None):
+    """Write the land cover zones of a uint8 class raster with their n to a geopackage
+
+    The raster is polygonized tile by tile across ``workers`` processes.
+    Zones touching a tile seam are merged per class once all tiles are
+    done, so no zone is split along the tiling. With ``min_area``, in square
+    metres on geographic grids, regions smaller than that are first merged
+    into their largest neighbour by a sieve over the whole raster, as a
+    region cut by a seam would otherwise look small. ``simplify``, in pixels, removes the pixel
+    staircase with douglas-peucker, once per boundary arc between junctions,
+    so neighbouring zones keep a shared boundary. Every zone gets its class,
+    label and the n of each scenario of ``lut``. Returns a dict with the
+    number of ``zones`` and ``tiles`` and whether the run is ``complete``.
+    """
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float32))
+    names = list(names or [f"n_{index + 1}" for index in range(len(luts))])
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {src_path}")
+    src_band = src.GetRasterBand(1)
+    if src_band.DataType != gdal.GDT_Byte:
+        raise RuntimeError(f"land cover raster must be uint8: {src_path}")
+    src_nodata = src_band.GetNoDataValue()
+    class_nodata = LC_NODATA if src_nodata is None else int(src_nodata)
+    geotransform, projection = src.GetGeoTransform(), src.GetProjection()
+    width, height = src.RasterXSize, src.RasterYSize
+
+    # pixel area at the centre row sets the sieve threshold
+    min_area_pixels = int(np.ceil(min_area / row_areas(geotransform, projection, height)[height // 2])) if min_area > 0 else 0
+    sieved = None
+    if min_area_pixels > 1:
+        # one pass over the whole raster, a region cut by a tile edge must not be taken for a small one
+        fd, sieved = tempfile.mkstemp(suffix=".tif", prefix="sieved_classes_")
+        os.close(fd)
+        dst = gdal.GetDriverByName("GTiff").Create(sieved, width, height, 1, gdal.GDT_Byte,
+                                                  ["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"])
+        dst.SetGeoTransform(geotransform)
+        dst.SetProjection(projection)
+        dst.GetRasterBand(1).SetNoDataValue(class_nodata)
+        if feedback is not None:
+            feedback.pushInfo(f"merging regions under {min_area_pixels} pixel(s) into their neighbours...")
+        gdal.SieveFilter(src_band, src_band.GetMaskBand(), dst.GetRasterBand(1), min_area_pixels, 4)
+        dst = None
+        src_path = sieved
+    src_band = None
+    src = None
+
+    jobs = [
+        {
+            "src_path": src_path,
+            "tile": tile,
+            "size": (width, height),
+            "geotransform": geotransform,
+            "class_nodata": class_nodata,
+            "mask_wkb": mask_wkb,
+            "simplify": simplify,
+        }
+        for tile in iter_windows(width, height, tile_size, tile_size)
+    ]
+
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(dst_path):
+        driver.DeleteDataSource(dst_path)
+    output = driver.CreateDataSource(dst_path)
+    if output is None:
+        raise RuntimeError(f"unable to create geopackage: {dst_path}")
+    srs = osr.SpatialReference(wkt=projection)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    layer = output.CreateLayer(layer_name, srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("class", ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn("label", ogr.OFTString))
+    n_fields = ["n"] if len(luts) == 1 else [f"n_{name}" for name in names]
+    for name in n_fields:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
+    definition = layer.GetLayerDefn()
+    labels = class_labels()
+    written = [0]
+
+    def add(value, geometry):
+        feature = ogr.Feature(definition)
+        feature.SetField("class", int(value))
+        feature.SetField("label", labels.get(int(value), ""))
+        for name, scenario_lut in zip(n_fields, luts):
+            if scenario_lut[value] != NODATA_N:
+                feature.SetField(name, float(scenario_lut[value]))
+            else:
+                feature.SetFieldNull(name)
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+        written[0] += 1
+
+    seams = {}
+    errors = []
+    finished = [0]
+
+    def on_done(job, error):
+        finished[0] += 1
+        if error is not None:
+            errors.append(error)
+        for value, wkb, on_seam in job.pop("result", None) or []:
+            if on_seam:
+                seams.setdefault(value, []).append(wkb)
+            else:
+                add(value, ogr.CreateGeometryFromWkb(wkb))
+        if feedback is not None:
+            feedback.setProgress(90.0 * finished[0] / len(jobs))
+
+    if feedback is not None:
+        feedback.pushInfo(f"polygonizing {len(jobs)} tile(s) of {tile_size} pixels with {workers} worker process(es)...")
+    output.StartTransaction()
+    try:
+        run_jobs(jobs, workers=workers, feedback=feedback, on_done=on_done, function=polygonize_tile)
+        complete = not errors and finished[0] == len(jobs)
+        if complete:
+            # zones cut by the tiling are joined per class, pieces of a class only touch across seams
+            pieces = sum(len(wkbs) for wkbs in seams.values())
+            for value, wkbs in sorted(seams.items()):
+                collection = ogr.Geometry(ogr.wkbMultiPolygon)
+                for wkb in wkbs:
+                    collection.AddGeometry(ogr.CreateGeometryFromWkb(wkb))
+                for part in _parts(collection.UnionCascaded()):
+                    add(value, part)
+            if feedback is not None:
+                feedback.pushInfo(f"{pieces} zone piece(s) along tile seams merged.")
+        output.CommitTransaction()
+    finally:
+        layer = definition = None
+        output = None
+        if sieved is not None and os.path.exists(sieved):
+            os.remove(sieved)
+    if errors:
+        raise RuntimeError(f"polygonizing failed: {errors[0]}")
+    return {"zones": written[0], "tiles": len(jobs), "complete": complete}
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import time
+import struct
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .tile_cache import source_url
+
+DEFAULT_WORKERS = 8
+
+# adjacent block ranges closer than this are fetched in one request
+DEFAULT_MAX_GAP = 64 * 1024
+
+# upper bound of a coalesced request
+DEFAULT_MAX_REQUEST = 16 * 1024 * 1024
+
+# first read of a file, holds the header and all ifds of a worldcover cog
+HEADER_BYTES = 64 * 1024
+
+# gdal cogs carry a 4 byte size before and a 4 byte copy of the last bytes after each block
+BLOCK_LEADER = 4
+
+# tiff field types as (struct format, size)
+TIFF_TYPES = {
+    1: ("B", 1), 2: ("c", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 6: ("b", 1), 7: ("B", 1),
+    8: ("h", 2), 9: ("i", 4), 10: ("ii", 8), 11: ("f", 4), 12: ("d", 8), 13: ("I", 4),
+    16: ("Q", 8), 17: ("q", 8), 18: ("Q", 8),
+}
+
+IMAGE_WIDTH, IMAGE_LENGTH = 256, 257
+STRIP_OFFSETS, ROWS_PER_STRIP, STRIP_BYTE_COUNTS = 273, 278, 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS = 322, 323, 324, 325
+SAMPLES_PER_PIXEL = 277
+LAYOUT_TAGS = {
+    IMAGE_WIDTH, IMAGE_LENGTH, STRIP_OFFSETS, ROWS_PER_STRIP, STRIP_BYTE_COUNTS, PLANAR_CONFIGURATION,
+    TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS, SAMPLES_PER_PIXEL,
+}
+
+
+def is_remote(filename):
+    return urllib.parse.urlsplit(source_url(filename)).scheme in ("http", "https")
+
+
+def coalesce(ranges, max_gap=DEFAULT_MAX_GAP, max_request=DEFAULT_MAX_REQUEST):
+    """Merge (start, end) byte ranges that overlap or lie within ``max_gap`` of each other"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start - merged[-1][1] <= max_gap and max(end, merged[-1][1]) - merged[-1][0] <= max_request:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class ConnectionPool:
+    """Keep-alive http(s) connections, one per host and worker thread"""
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.opened = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self, parts, fresh=False):
+        connections = self._local.__dict__.setdefault("connections", {})
+        key = (parts.scheme, parts.netloc)
+        if fresh and key in connections:
+            connections.pop(key).close()
+        if key not in connections:
+            connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            connections[key] = connection_class(parts.netloc, timeout=self.timeout)
+            with self._lock:
+                self.opened += 1
+                self._connections.append(connections[key])
+        return connections[key]
+
+    def get(self, url, start, end):
+        """Bytes ``start`` to ``end`` (exclusive) of ``url`` and the total size of the file"""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            # a kept-alive connection may have been closed by the server meanwhile, retry once on a new one
+            connection = self._connection(parts, fresh=attempt > 0)
+            try:
+                connection.request("GET", path, headers={"Range": f"bytes={start}-{end - 1}"})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                if attempt:
+                    raise RuntimeError(f"range request failed for {url}: {e}")
+                continue
+            if response.status != 206:
+                raise RuntimeError(f"range request for {url} answered with http {response.status}")
+            content_range = response.getheader("Content-Range", "")
+            total = content_range.rpartition("/")[2]
+            return data, int(total) if total.isdigit() else None
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+class RemoteFile:
+    """Byte ranges of one remote file fetched so far, written out as a local sparse copy"""
+
+    def __init__(self, url, pool):
+        self.url = url
+        self.pool = pool
+        self.size = None
+        self.chunks = {}
+        self.requests = 0
+
+    def read(self, offset, size):
+        for start, data in self.chunks.items():
+            if start <= offset and offset + size <= start + len(data):
+                return data[offset - start:offset - start + size]
+        data, total = self.pool.get(self.url, offset, offset + max(size, HEADER_BYTES))
+        self.requests += 1
+        if total is None:
+            raise RuntimeError(f"range response without file size for {self.url}")
+        self.size = total
+        self.chunks[offset] = data
+        return data[:size]
+
+    def covered(self, start, end):
+        return any(offset <= start and end <= offset + len(data) for offset, data in self.chunks.items())
+
+
+def tiff_layout(remote):
+    """Block grid, offsets and byte counts of the full resolution image of a remote tiff
+
+    Every ifd and every tag value stored outside the ifds is read, so gdal
+    can open the local copy; in a cog they all sit in the first read.
+    """
+    head = remote.read(0, 16)
+    order = {b"II": "<", b"MM": ">"}.get(head[:2])
+    if order is None:
+        raise RuntimeError(f"not a tiff file: {remote.url}")
+    magic = struct.unpack(order + "H", head[2:4])[0]
+    if magic == 42:
+        big, count_format, offset_format, entry_size = False, "H", "I", 12
+        offset = struct.unpack(order + "I", head[4:8])[0]
+    elif magic == 43:
+        big, count_format, offset_format, entry_size = True, "Q", "Q", 20
+        offset = struct.unpack(order + "Q", head[8:16])[0]
+    else:
+        raise RuntimeError(f"not a tiff file: {remote.url}")
+    offset_size = struct.calcsize(offset_format)
+    count_size = struct.calcsize(count_format)
+
+    ifds = []
+    seen = set()
+    while offset and offset not in seen:
+        seen.add(offset)
+        count = struct.unpack(order + count_format, remote.read(offset, count_size))[0]
+        raw = remote.read(offset + count_size, count * entry_size + offset_size)
+        tags = {}
+        for i in range(count):
+            entry = raw[i * entry_size:(i + 1) * entry_size]
+            tag, field_type = struct.unpack(order + "HH", entry[:4])
+            values = struct.unpack(order + offset_format, entry[4:4 + offset_size])[0]
+            field = entry[4 + offset_size:]
+            if field_type not in TIFF_TYPES:
+                continue
+            value_format, value_size = TIFF_TYPES[field_type]
+            length = value_size * values
+            if length <= offset_size:
+                data = field[:length]
+            else:
+                data = remote.read(struct.unpack(order + offset_format, field)[0], length)
+            if tag in LAYOUT_TAGS:
+                tags[tag] = struct.unpack(order + value_format * values, data)
+        ifds.append(tags)
+        offset = struct.unpack(order + offset_format, raw[count * entry_size:count * entry_size + offset_size])[0]
+
+    tags = ifds[0]
+    width, height = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+    if TILE_OFFSETS in tags:
+        block_width, block_height = tags[TILE_WIDTH][0], tags[TILE_LENGTH][0]
+        offsets, counts = tags[TILE_OFFSETS], tags[TILE_BYTE_COUNTS]
+    else:
+        block_width, block_height = width, tags.get(ROWS_PER_STRIP, (height,))[0]
+        offsets, counts = tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS]
+    planes = tags.get(SAMPLES_PER_PIXEL, (1,))[0] if tags.get(PLANAR_CONFIGURATION, (1,))[0] == 2 else 1
+    return {
+        "width": width,
+        "height": height,
+        "block_width": block_width,
+        "block_height": min(block_height, height),
+        "planes": planes,
+        "offsets": offsets,
+        "counts": counts,
+        "big": big,
+    }
+
+
+def block_ranges(layout, rect, size=None):
+    """Byte ranges of the blocks under a pixel ``rect`` (xoff, yoff, xsize, ysize) of a tiff layout"""
+    xoff, yoff, xsize, ysize = rect
+    across = -(-layout["width"] // layout["block_width"])
+    down = -(-layout["height"] // layout["block_height"])
+    ranges = []
+    for plane in range(layout["planes"]):
+        for row in range(yoff // layout["block_height"], (yoff + ysize - 1) // layout["block_height"] + 1):
+            for col in range(xoff // layout["block_width"], (xoff + xsize - 1) // layout["block_width"] + 1):
+                index = plane * across * down + row * across + col
+                offset, count = layout["offsets"][index], layout["counts"][index]
+                # sparse blocks have no bytes
+                if count == 0:
+                    continue
+                end = offset + count + BLOCK_LEADER
+                ranges.append((max(0, offset - BLOCK_LEADER), end if size is None else min(size, end)))
+    return ranges
+
+
+class RangePrefetcher:
+    """Concurrent prefetch of the cog blocks a window reads from remote sources
+
+    The headers of all sources are read first, then the blocks under the
+    window are fetched as coalesced byte ranges by a bounded pool of workers
+    over kept-alive connections. Each source becomes a local sparse file with
+    the same byte layout holding only those ranges, so gdal reads the window
+    from disk. Reading blocks outside the prefetched rectangles from such a
+    file is not valid.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_gap=DEFAULT_MAX_GAP, max_request=DEFAULT_MAX_REQUEST, timeout=60):
+        self.workers = max(1, int(workers))
+        self.max_gap = max_gap
+        self.max_request = max_request
+        self.timeout = timeout
+        self.stats = {}
+        # bytes fetched over the life of the prefetcher, for run reports
+        self.downloaded_bytes = 0
+
+    def prefetch(self, sources, folder, feedback=None):
+        """Fetch the blocks of ``sources``, (filename, src_rect) pairs, into ``folder``
+
+        Returns a dict from filename to the local copy; filenames that are
+        not http(s) urls are left out.
+        """
+        started = time.perf_counter()
+        rects = {}
+        for filename, rect in sources:
+            if is_remote(filename):
+                rects.setdefault(filename, []).append(rect)
+        pool = ConnectionPool(self.timeout)
+        remotes = {filename: RemoteFile(source_url(filename), pool) for filename in rects}
+        local = {}
+        self.stats = {"files": len(remotes), "blocks": 0, "requests": 0, "bytes": 0}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                try:
+                    layouts = dict(zip(remotes, executor.map(tiff_layout, remotes.values())))
+                except (struct.error, KeyError, IndexError) as e:
+                    raise RuntimeError(f"unable to read the block layout of a remote tile: {e}")
+
+                requests = []
+                for filename, remote in remotes.items():
+                    ranges = [
+                        byte_range
+                        for rect in rects[filename]
+                        for byte_range in block_ranges(layouts[filename], rect, remote.size)
+                    ]
+                    self.stats["blocks"] += len(ranges)
+                    requests.extend(
+                        (filename, start, end)
+                        for start, end in coalesce(ranges, self.max_gap, self.max_request)
+                        if not remote.covered(start, end)
+                    )
+                    local[filename] = self._create_local(remote, folder)
+
+                if feedback is not None:
+                    feedback.pushInfo(
+                        f"prefetching {self.stats['blocks']} block(s) of {len(remotes)} remote tile(s) "
+                        f"in {len(requests)} range request(s) with {self.workers} worker(s)..."
+                    )
+                # workers write their range straight into the local file, no payload is held in memory
+                futures = [
+                    executor.submit(self._fetch_range, pool, remotes[filename].url, start, end, local[filename])
+                    for filename, start, end in requests
+                ]
+                for current, future in enumerate(as_completed(futures)):
+                    if feedback is not None and feedback.isCanceled():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    self.stats["bytes"] += future.result()
+                    if feedback is not None:
+                        feedback.setProgress(100.0 * (current + 1) / len(futures))
+        finally:
+            pool.close()
+
+        self.stats["requests"] = len(requests) + sum(remote.requests for remote in remotes.values())
+        self.stats["bytes"] += sum(len(data) for remote in remotes.values() for data in remote.chunks.values())
+        self.stats["connections"] = pool.opened
+        self.stats["seconds"] = round(time.perf_counter() - started, 3)
+        self.downloaded_bytes += self.stats["bytes"]
+        return local
+
+    @staticmethod
+    def _fetch_range(pool, url, start, end, path):
+        """Download a byte range into the same offset of a local file, returns its size"""
+        data, _ = pool.get(url, start, end)
+        with open(path, "r+b") as file:
+            file.seek(start)
+            file.write(data)
+        return len(data)
+
+    @staticmethod
+    def _create_local(remote, folder):
+        path = os.path.join(folder, os.path.basename(urllib.parse.urlsplit(remote.url).path))
+        with open(path, "wb") as file:
+            # unwritten ranges stay holes on file systems with sparse files
+            file.truncate(remote.size)
+            for offset, data in remote.chunks.items():
+                file.seek(offset)
+                file.write(data)
+        return path
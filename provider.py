@@ -34,6 +34,8 @@ from qgis.core import QgsProcessingProvider, QgsApplication
 from qgis.PyQt.QtGui import QIcon
 
 from .mannings_roughness_algorithm import ManningsRoughnessAlgorithm
+from .mannings_roughness_batch_algorithm import ManningsRoughnessBatchAlgorithm
+from .mannings_roughness_zonal_algorithm import ManningsRoughnessZonalAlgorithm
 
 class ManningsRoughnessProvider(QgsProcessingProvider):
     def __init__(self):
@@ -45,6 +47,8 @@ class ManningsRoughnessProvider(QgsProcessingProvider):
     def loadAlgorithms(self):
         """Load the processing algorithms"""
         self.addAlgorithm(ManningsRoughnessAlgorithm())
+        self.addAlgorithm(ManningsRoughnessBatchAlgorithm())
+        self.addAlgorithm(ManningsRoughnessZonalAlgorithm())
 
     def id(self):
         return "manningsroughness"
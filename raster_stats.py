@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from osgeo import gdal, osr
+
+# mean earth radius in metres, for pixel areas of geographic rasters
+EARTH_RADIUS = 6371008.8
+
+# width of the n histogram bins, exact for n given to four decimals
+N_BIN_WIDTH = 1e-4
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# working memory per pixel of the statistics of a chunk, on top of the reclassification
+STATISTICS_BYTES_PER_PIXEL = 24
+
+LANDCOVER_STYLE = os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.qml")
+
+
+def row_areas(geotransform, projection, rows):
+    """Pixel area in square metres (or squared crs units) of every row of a grid"""
+    gt = geotransform
+    srs = osr.SpatialReference(wkt=projection)
+    if not srs.IsGeographic():
+        return np.full(rows, abs(gt[1] * gt[5]), dtype=np.float64)
+    lat = gt[3] + (np.arange(rows) + 0.5) * gt[5]
+    return EARTH_RADIUS ** 2 * math.radians(abs(gt[1])) * math.radians(abs(gt[5])) * np.cos(np.radians(lat))
+
+
+def class_labels(qml_path=LANDCOVER_STYLE):
+    """Labels of the land cover classes from the palette of a qml style"""
+    try:
+        entries = ET.parse(qml_path).getroot().findall(".//colorPalette/paletteEntry")
+    except (OSError, ET.ParseError):
+        return {}
+    return {int(entry.get("value")): entry.get("label", "") for entry in entries}
+
+
+class RasterStatistics:
+    """Land cover histogram and n statistics accumulated chunk by chunk
+
+    ``start`` sets the output grid, ``measure`` summarises the classes and
+    n of one chunk and may run on worker threads, ``add`` merges a summary
+    in the writing thread. Areas account for the latitude of every row on
+    geographic grids. Percentiles come from an n histogram of
+    ``N_BIN_WIDTH`` wide bins. ``complete`` is only set once every chunk of
+    the output has been added.
+    """
+
+    def __init__(self, names=None, bin_width=N_BIN_WIDTH):
+        self.names = list(names or [])
+        self.bin_width = bin_width
+        self.complete = False
+        self.geographic = False
+
+    def start(self, luts, geotransform, projection, ysize, class_nodata, nodata):
+        luts = np.atleast_2d(luts)
+        self.class_nodata = class_nodata
+        self.nodata = nodata
+        self.geographic = bool(osr.SpatialReference(wkt=projection).IsGeographic())
+        self.row_areas = row_areas(geotransform, projection, ysize)
+        valid = luts[luts != nodata]
+        self.bins = int(math.ceil(max(float(valid.max()) if valid.size else 0.0, 0.0) / self.bin_width)) + 2
+        scenarios = len(luts)
+        self.pixels = np.zeros(256, dtype=np.int64)
+        self.areas = np.zeros(256, dtype=np.float64)
+        self.count = np.zeros(scenarios, dtype=np.int64)
+        self.total = np.zeros(scenarios, dtype=np.float64)
+        self.squares = np.zeros(scenarios, dtype=np.float64)
+        self.area = np.zeros(scenarios, dtype=np.float64)
+        self.area_total = np.zeros(scenarios, dtype=np.float64)
+        self.minimum = np.full(scenarios, np.inf)
+        self.maximum = np.full(scenarios, -np.inf)
+        self.histogram = np.zeros((scenarios, self.bins), dtype=np.int64)
+        self.complete = False
+
+    def measure(self, classes, values, yoff, factor=1):
+        """Summary of a chunk, ``classes`` may hold ``factor`` x ``factor`` sub-samples per n value"""
+        ysize = values.shape[1]
+        areas = self.row_areas[yoff:yoff + ysize]
+        summary = {}
+        if classes is not None:
+            # per row counts, as the pixel area only changes with the row
+            sample_areas = np.repeat(areas, factor) / (factor * factor)
+            pixels = np.zeros(256, dtype=np.int64)
+            class_areas = np.zeros(256, dtype=np.float64)
+            for row, sample_area in zip(classes, sample_areas):
+                counts = np.bincount(row, minlength=256)
+                pixels += counts
+                class_areas += counts * sample_area
+            summary["classes"] = pixels, class_areas
+
+        scenarios = []
+        for band in values:
+            valid = band != self.nodata
+            selected = band[valid].astype(np.float64)
+            if selected.size == 0:
+                scenarios.append(None)
+                continue
+            row_counts = valid.sum(axis=1)
+            row_sums = np.where(valid, band, 0.0).sum(axis=1, dtype=np.float64)
+            bins = np.clip(np.rint(selected / self.bin_width).astype(np.int64), 0, self.bins - 1)
+            scenarios.append((
+                selected.size, selected.sum(), np.square(selected).sum(),
+                float((row_counts * areas).sum()), float((row_sums * areas).sum()),
+                selected.min(), selected.max(), np.bincount(bins, minlength=self.bins),
+            ))
+        summary["n"] = scenarios
+        return summary
+
+    def add(self, summary):
+        if "classes" in summary:
+            pixels, class_areas = summary["classes"]
+            self.pixels += pixels
+            self.areas += class_areas
+        for scenario, measured in enumerate(summary["n"]):
+            if measured is None:
+                continue
+            count, total, squares, area, area_total, minimum, maximum, histogram = measured
+            self.count[scenario] += count
+            self.total[scenario] += total
+            self.squares[scenario] += squares
+            self.area[scenario] += area
+            self.area_total[scenario] += area_total
+            self.minimum[scenario] = min(self.minimum[scenario], minimum)
+            self.maximum[scenario] = max(self.maximum[scenario], maximum)
+            self.histogram[scenario] += histogram
+
+    def percentile(self, scenario, percent):
+        """Nearest rank percentile of n, to the bin width"""
+        cumulative = np.cumsum(self.histogram[scenario])
+        if cumulative[-1] == 0:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * cumulative[-1])))
+        return round(int(np.searchsorted(cumulative, rank)) * self.bin_width, 10)
+
+    def n_statistics(self, scenario):
+        """Min, max, mean, standard deviation, area-weighted mean and percentiles of a scenario"""
+        count = int(self.count[scenario])
+        name = (self.names[scenario] if scenario < len(self.names) else None) or f"band_{scenario + 1}"
+        if count == 0:
+            return {"name": name, "count": 0}
+        mean = self.total[scenario] / count
+        result = {
+            "name": name,
+            "count": count,
+            "min": round(float(self.minimum[scenario]), 7),
+            "max": round(float(self.maximum[scenario]), 7),
+            "mean": float(mean),
+            "std": float(math.sqrt(max(0.0, self.squares[scenario] / count - mean * mean))),
+            "area_weighted_mean": float(self.area_total[scenario] / self.area[scenario]) if self.area[scenario] > 0 else None,
+        }
+        for percent in PERCENTILES:
+            result[f"p{percent}"] = self.percentile(scenario, percent)
+        return result
+
+    def class_table(self, labels=None):
+        """One row per land cover class present, with its pixels, area and share of the valid area"""
+        labels = class_labels() if labels is None else labels
+        valid = np.arange(256) != self.class_nodata
+        total = self.areas[valid].sum()
+        return [
+            {
+                "class": int(value),
+                "label": labels.get(int(value), ""),
+                "pixels": int(self.pixels[value]),
+                "area": float(self.areas[value]),
+                "fraction": float(self.areas[value] / total) if total > 0 else 0.0,
+            }
+            for value in np.flatnonzero(self.pixels)
+            if value != self.class_nodata
+        ]
+
+    def to_dict(self):
+        return {
+            "area_units": "m2" if self.geographic else "crs units squared",
+            "classes": self.class_table(),
+            "nodata_pixels": int(self.pixels[self.class_nodata]),
+            "n": [self.n_statistics(scenario) for scenario in range(len(self.count))],
+        }
+
+    def write_sidecars(self, dst_path, esa_path=None):
+        """Store the statistics and histograms in the gdal .aux.xml sidecars of the outputs
+
+        ``dst_path`` is one raster with a band per scenario or a list with
+        one raster per scenario, or None when only the land cover is
+        written. Qgis reads these instead of scanning the rasters again.
+        """
+        paths = list(dst_path) if isinstance(dst_path, (list, tuple)) else [dst_path] if dst_path else []
+        targets = [(path, 1) for path in paths] if len(paths) != 1 else [(paths[0], band + 1) for band in range(len(self.count))]
+        datasets = {}
+        for scenario, (path, band_number) in enumerate(targets):
+            if path not in datasets:
+                datasets[path] = gdal.Open(path, gdal.GA_ReadOnly)
+            dst = datasets[path]
+            stats = self.n_statistics(scenario)
+            if dst is None or not stats["count"]:
+                continue
+            band = dst.GetRasterBand(band_number)
+            band.SetStatistics(stats["min"], stats["max"], stats["mean"], stats["std"])
+            band.SetMetadataItem("STATISTICS_VALID_PERCENT", str(100.0 * stats["count"] / (dst.RasterXSize * dst.RasterYSize)))
+            # histogram trimmed to the n range, one bucket per bin
+            first = int(round(stats["min"] / self.bin_width))
+            last = int(round(stats["max"] / self.bin_width))
+            buckets = [int(count) for count in self.histogram[scenario][first:last + 1]]
+            band.SetDefaultHistogram((first - 0.5) * self.bin_width, (last + 0.5) * self.bin_width, buckets)
+        dst = band = None
+        datasets = None
+
+        if esa_path and self.pixels.sum():
+            dst = gdal.Open(esa_path, gdal.GA_ReadOnly)
+            if dst is not None:
+                band = dst.GetRasterBand(1)
+                values = np.arange(256)
+                pixels = np.where(values == self.class_nodata, 0, self.pixels)
+                count = pixels.sum()
+                if count:
+                    present = np.flatnonzero(pixels)
+                    mean = float((values * pixels).sum() / count)
+                    std = float(math.sqrt(max(0.0, (values * values * pixels).sum() / count - mean * mean)))
+                    band.SetStatistics(float(present.min()), float(present.max()), mean, std)
+                band.SetDefaultHistogram(-0.5, 255.5, [int(value) for value in self.pixels])
+                dst = None
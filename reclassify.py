@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from .output_format import build_empty_overviews
+from .raster_stats import STATISTICS_BYTES_PER_PIXEL
+from .scheduler import ChunkScheduler, run_key
+
+# nodata written for unmapped land cover classes and esa nodata (class 0)
+NODATA_N = -9999.0
+LC_NODATA = 0
+
+# processing window edge in pixels, 1024 x 1024 float32 is 4 mb per block
+DEFAULT_BLOCK_SIZE = 1024
+
+# gtiff options for masked outputs, blocks outside the aoi are never allocated
+SPARSE_GTIFF_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "SPARSE_OK=TRUE"]
+
+
+def compile_lookup(lookup_values, nodata=NODATA_N):
+    """Compile (land cover, n) pairs into a dense 256-entry float32 lookup array"""
+    lut = np.full(256, nodata, dtype=np.float32)
+    for lc_value, n_value in lookup_values:
+        if not 0 <= int(lc_value) <= 255:
+            raise ValueError(f"land cover class out of uint8 range: {lc_value}")
+        lut[int(lc_value)] = n_value
+    # esa nodata never carries a roughness value
+    lut[LC_NODATA] = nodata
+    return lut
+
+
+def iter_windows(xsize, ysize, block_xsize=DEFAULT_BLOCK_SIZE, block_ysize=DEFAULT_BLOCK_SIZE):
+    """Yield (xoff, yoff, xsize, ysize) windows covering a raster of the given size"""
+    for yoff in range(0, ysize, block_ysize):
+        win_ysize = min(block_ysize, ysize - yoff)
+        for xoff in range(0, xsize, block_xsize):
+            yield xoff, yoff, min(block_xsize, xsize - xoff), win_ysize
+
+
+def window_from_extent(geotransform, extent, raster_xsize, raster_ysize, wrap=False):
+    """Convert an (xmin, ymin, xmax, ymax) extent into a pixel window clamped to the raster
+
+    With ``wrap``, for rasters spanning all longitudes, columns are not
+    clamped: the window starts within the raster and may continue past its
+    east edge, e.g. across the antimeridian.
+    """
+    xmin, ymin, xmax, ymax = extent
+    # small tolerance keeps extents that sit on pixel edges from growing a column
+    xoff = int(np.floor((xmin - geotransform[0]) / geotransform[1] + 1e-6))
+    yoff = int(np.floor((ymax - geotransform[3]) / geotransform[5] + 1e-6))
+    xend = int(np.ceil((xmax - geotransform[0]) / geotransform[1] - 1e-6))
+    yend = int(np.ceil((ymin - geotransform[3]) / geotransform[5] - 1e-6))
+    if wrap:
+        xsize = min(xend - xoff, raster_xsize)
+        xoff %= raster_xsize
+        xend = xoff + xsize
+    else:
+        xoff, xend = max(xoff, 0), min(xend, raster_xsize)
+    yoff, yend = max(yoff, 0), min(yend, raster_ysize)
+    if xend <= xoff or yend <= yoff:
+        raise ValueError(f"extent {extent} does not overlap the land cover raster")
+    return xoff, yoff, xend - xoff, yend - yoff
+
+
+def _create_like(path, driver_name, xsize, ysize, data_type, geotransform, projection, nodata, bands=1,
+                 sparse=False, output_format=None):
+    """Create an output raster on the given grid
+
+    A ``sparse`` raster may leave blocks unwritten. GTiff stores those as
+    unallocated blocks that read back as nodata, other drivers are filled
+    with nodata up front. An ``output_format`` sets the GTiff layout and may
+    stage the raster under another path until it is finalized.
+    """
+    driver = gdal.GetDriverByName(driver_name)
+    if driver is None:
+        raise RuntimeError(f"gdal driver not available: {driver_name}")
+    if output_format is not None:
+        options = output_format.creation_options(driver_name, data_type)
+        path = output_format.staging_path(path, driver_name)
+    else:
+        options = SPARSE_GTIFF_OPTIONS if sparse and driver_name == "GTiff" else []
+    dst = driver.Create(path, xsize, ysize, bands, data_type, options=options)
+    if dst is None:
+        raise RuntimeError(f"unable to create raster: {path}")
+    dst.SetGeoTransform(geotransform)
+    dst.SetProjection(projection)
+    for band in range(bands):
+        dst.GetRasterBand(band + 1).SetNoDataValue(nodata)
+        if sparse and "SPARSE_OK=TRUE" not in options:
+            dst.GetRasterBand(band + 1).Fill(nodata)
+    return dst
+
+
+def create_roughness_outputs(dst_path, driver_name, xsize, ysize, geotransform, projection,
+                             scenarios, band_names=None, sparse=False, output_format=None):
+    """Create the float32 roughness output(s), one band or one raster per scenario
+
+    Returns the datasets and the band receiving each scenario, in order.
+    """
+    if isinstance(dst_path, (list, tuple)):
+        if len(dst_path) != scenarios:
+            raise ValueError("one output path is required per lookup table")
+        outputs = [_create_like(path, driver_name, xsize, ysize, gdal.GDT_Float32,
+                                geotransform, projection, NODATA_N, sparse=sparse,
+                                output_format=output_format) for path in dst_path]
+        bands = [dst.GetRasterBand(1) for dst in outputs]
+    else:
+        dst = _create_like(dst_path, driver_name, xsize, ysize, gdal.GDT_Float32,
+                           geotransform, projection, NODATA_N, bands=scenarios, sparse=sparse,
+                           output_format=output_format)
+        outputs = [dst]
+        bands = [dst.GetRasterBand(band + 1) for band in range(scenarios)]
+    for band, name in zip(bands, band_names or []):
+        band.SetDescription(name)
+    return outputs, bands
+
+
+def create_landcover_output(path, driver_name, xsize, ysize, geotransform, projection,
+                            nodata, color_table=None, sparse=False, output_format=None):
+    """Create the uint8 land cover output with the worldcover palette"""
+    dst = _create_like(path, driver_name, xsize, ysize, gdal.GDT_Byte,
+                       geotransform, projection, nodata, sparse=sparse, output_format=output_format)
+    if color_table is not None:
+        dst.GetRasterBand(1).SetColorTable(color_table)
+    return dst
+
+
+def prepare_overviews(outputs, output_format, driver_name, xsize, ysize, block_size, existing=False):
+    """Allocate the streamed overviews of the outputs, returns the overview factors
+
+    ``existing`` outputs of a resumed run already hold their overviews.
+    """
+    if output_format is None or driver_name != "GTiff":
+        return []
+    factors = output_format.overview_factors(xsize, ysize, block_size)
+    if not existing:
+        for dst in outputs:
+            build_empty_overviews(dst, factors)
+    return factors
+
+
+def checkpoint_path(dst_path, driver_name, output_format=None):
+    """Journal of the completed chunks, next to the first raster being written"""
+    path = dst_path[0] if isinstance(dst_path, (list, tuple)) else dst_path
+    if output_format is not None:
+        path = output_format.staging_path(path, driver_name)
+    return path + ".chunks.json"
+
+
+def source_key(src):
+    """Grid and source files of a dataset, stable across runs writing the window vrt to a new path"""
+    files = src.GetFileList() or []
+    return (src.GetGeoTransform(), src.RasterXSize, src.RasterYSize, sorted(os.path.basename(path) for path in files[1:]))
+
+
+def open_existing_outputs(dst_path, driver_name, bands, output_format=None):
+    """Reopen the outputs of an interrupted run for update, (None, None) when one is missing
+
+    Returns the datasets and the band receiving each of ``bands`` layers.
+    """
+    paths = list(dst_path) if isinstance(dst_path, (list, tuple)) else [dst_path]
+    outputs = []
+    for path in paths:
+        if output_format is not None:
+            path = output_format.staging_path(path, driver_name)
+        dst = gdal.Open(path, gdal.GA_Update) if os.path.exists(path) else None
+        if dst is None:
+            return None, None
+        outputs.append(dst)
+    if len(outputs) > 1:
+        return outputs, [dst.GetRasterBand(1) for dst in outputs]
+    if outputs[0].RasterCount != bands:
+        return None, None
+    return outputs, [outputs[0].GetRasterBand(band + 1) for band in range(bands)]
+
+
+def finalize_outputs(paths, output_format, driver_name):
+    """Finish the closed outputs, e.g. rewrite them as cloud optimized geotiff"""
+    if output_format is not None:
+        for path in paths:
+            output_format.finalize(path, driver_name)
+
+
+class BlockMask:
+    """Pixel mask of a polygon evaluated block by block
+
+    ``wkb`` is the polygon in the raster crs. Blocks are first tested
+    against the polygon so that blocks fully outside or fully inside never
+    need rasterizing.
+    """
+
+    def __init__(self, wkb, geotransform):
+        self.geometry = ogr.CreateGeometryFromWkb(bytes(wkb))
+        if self.geometry is None:
+            raise ValueError("invalid mask geometry")
+        self.geotransform = geotransform
+        driver = ogr.GetDriverByName("Memory") or ogr.GetDriverByName("MEM")
+        self._source = driver.CreateDataSource("mask")
+        self._layer = self._source.CreateLayer("mask", geom_type=ogr.wkbUnknown)
+        feature = ogr.Feature(self._layer.GetLayerDefn())
+        feature.SetGeometry(self.geometry)
+        self._layer.CreateFeature(feature)
+
+    def _block_geotransform(self, xoff, yoff):
+        gt = self.geotransform
+        return (gt[0] + xoff * gt[1], gt[1], gt[2], gt[3] + yoff * gt[5], gt[4], gt[5])
+
+    def block(self, xoff, yoff, xsize, ysize):
+        """None when the block is fully outside, True when fully inside, else a boolean array"""
+        gt = self._block_geotransform(xoff, yoff)
+        x0, y1 = gt[0], gt[3]
+        x1, y0 = gt[0] + xsize * gt[1], gt[3] + ysize * gt[5]
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)):
+            ring.AddPoint_2D(x, y)
+        rect = ogr.Geometry(ogr.wkbPolygon)
+        rect.AddGeometry(ring)
+
+        if not self.geometry.Intersects(rect):
+            return None
+        if self.geometry.Contains(rect):
+            return True
+
+        # burn pixel centres inside the polygon
+        target = gdal.GetDriverByName("MEM").Create("", xsize, ysize, 1, gdal.GDT_Byte)
+        target.SetGeoTransform(gt)
+        gdal.RasterizeLayer(target, [1], self._layer, burn_values=[1])
+        return target.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def reclassify_raster(src_path, dst_path, lut, window=None, esa_path=None,
+                      driver_name="GTiff", esa_driver_name="GTiff", band_names=None,
+                      mask_wkb=None, output_format=None, result_cache=None, scheduler=None,
+                      statistics=None, field=None, class_color_table=None, web_tiles=None, feedback=None):
+    """Reclassify a uint8 land cover raster into Manning's n chunk by chunk
+
+    ``lut`` is a single 256-entry lookup array or a (scenarios, 256) stack of
+    them. Every chunk is read once and all scenarios are gathered from it; a
+    stack is written as one band per scenario to ``dst_path``, or to one
+    raster per scenario when ``dst_path`` is a list of paths.
+
+    When ``window`` is given only that (xoff, yoff, xsize, ysize) pixel window of
+    the source is read, so clipping and reclassification happen in one pass. The
+    clipped land cover is written alongside only when ``esa_path`` is set, with
+    the ``class_color_table`` instead of the source palette when given. With
+    ``dst_path`` None only the land cover is written, e.g. for compact outputs.
+
+    With ``mask_wkb``, a polygon in the source crs, chunks outside the polygon
+    are neither read nor written and pixels outside it are set to nodata.
+
+    ``output_format`` controls compression, precision and the overviews,
+    which are filled from each chunk as it is written.
+
+    With a ``result_cache`` the n of each chunk is assembled from cached
+    tiles and the land cover is only read for tiles that are missing; the
+    chunks are then processed on one thread.
+
+    ``scheduler``, a ``ChunkScheduler``, sets the chunk size from its memory
+    budget, the worker threads and whether an interrupted run is resumed.
+
+    A ``statistics``, ``raster_stats.RasterStatistics``, accumulates the class
+    histogram and n statistics of the written pixels in the same pass and
+    stores them in the .aux.xml sidecars of the outputs. The land cover of
+    result cache tiles is then still read, for the class histogram. A resumed
+    run leaves it incomplete.
+
+    A ``field``, e.g. an ``ensemble.CorrelatedEnsemble``, replaces the lookup
+    gather with its ``values(classes, xoff, yoff)``, which vary within a
+    class; ``lut`` then only sets the nodata classes and the value range, and
+    no result cache is used.
+
+    A ``web_tiles``, ``web_tiles.WebTileBuilder``, samples its deepest zoom
+    from the classes of every chunk as it is written, so the tile pyramid
+    needs no second read of the land cover. Only the chunks a resumed run
+    completed earlier are read again for it.
+    """
+    if field is not None and result_cache is not None:
+        raise ValueError("a result cache cannot serve values that vary within a class")
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {src_path}")
+    src_band = src.GetRasterBand(1)
+    if src_band.DataType != gdal.GDT_Byte:
+        raise RuntimeError(f"land cover raster must be uint8: {src_path}")
+
+    # a source nodata other than 0 maps to nodata as well
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float32))
+    src_nodata = src_band.GetNoDataValue()
+    if src_nodata is not None and 0 <= src_nodata <= 255:
+        luts = luts.copy()
+        luts[:, int(src_nodata)] = NODATA_N
+
+    if window is None:
+        window = (0, 0, src.RasterXSize, src.RasterYSize)
+    win_xoff, win_yoff, win_xsize, win_ysize = window
+    src_gt = src.GetGeoTransform()
+    geotransform = (
+        src_gt[0] + win_xoff * src_gt[1], src_gt[1], src_gt[2],
+        src_gt[3] + win_yoff * src_gt[5], src_gt[4], src_gt[5],
+    )
+    projection = src.GetProjection()
+    sparse = mask_wkb is not None
+    class_nodata = LC_NODATA if src_nodata is None else int(src_nodata)
+    color_table = class_color_table or src_band.GetColorTable()
+
+    # working memory per pixel: classes, the gathered n and its quantized copy per scenario
+    scheduler = scheduler or ChunkScheduler()
+    block_size = scheduler.chunk_size(2 + 8 * len(luts) + (STATISTICS_BYTES_PER_PIXEL if statistics is not None else 0))
+    chunks = list(iter_windows(win_xsize, win_ysize, block_size, block_size))
+    key = run_key(source_key(src), window, luts.tobytes(), field.key if field is not None else None, dst_path, esa_path, driver_name, mask_wkb,
+                  block_size, vars(output_format) if output_format is not None else None)
+    if dst_path is None and not esa_path:
+        raise ValueError("no output to write")
+    writes_n = dst_path is not None
+    resuming = bool(scheduler.open_checkpoint(
+        checkpoint_path(dst_path if writes_n else esa_path, driver_name if writes_n else esa_driver_name, output_format), key))
+    if statistics is not None:
+        statistics.start(luts, geotransform, projection, win_ysize, class_nodata, NODATA_N)
+        if resuming and feedback is not None:
+            feedback.pushWarning("statistics are not computed when resuming, the completed chunks are not read again.")
+    measured = statistics if statistics is not None and not resuming else None
+
+    outputs, dst_bands, esa = [], [], None
+    if resuming:
+        if writes_n:
+            outputs, dst_bands = open_existing_outputs(dst_path, driver_name, len(luts), output_format)
+        if esa_path:
+            esa = (open_existing_outputs(esa_path, esa_driver_name, 1, output_format)[0] or [None])[0]
+        resuming = outputs is not None and (esa is not None or not esa_path)
+        if not resuming:
+            scheduler.checkpoint.done.clear()
+    if web_tiles is not None:
+        web_tiles.start(geotransform, win_xsize, win_ysize, chunks, class_nodata)
+        if resuming:
+            # the chunks written by the interrupted run are only read for their tiles
+            mask = BlockMask(mask_wkb, geotransform) if mask_wkb is not None else None
+            for index in sorted(scheduler.checkpoint.done):
+                xoff, yoff, block_xsize, block_ysize = chunks[index]
+                inside = mask.block(xoff, yoff, block_xsize, block_ysize) if mask is not None else True
+                classes = None
+                if inside is not None:
+                    classes = src_band.ReadAsArray(win_xoff + xoff, win_yoff + yoff, block_xsize, block_ysize)
+                    if inside is not True:
+                        classes[~inside] = class_nodata
+                web_tiles.add(chunks[index], classes)
+    if not resuming:
+        if writes_n:
+            outputs, dst_bands = create_roughness_outputs(
+                dst_path, driver_name, win_xsize, win_ysize, geotransform, projection,
+                len(luts), band_names=band_names, sparse=sparse, output_format=output_format,
+            )
+        if esa_path:
+            esa = create_landcover_output(esa_path, esa_driver_name, win_xsize, win_ysize, geotransform, projection,
+                                          class_nodata, color_table, sparse=sparse, output_format=output_format)
+    factors = prepare_overviews(outputs, output_format, driver_name, win_xsize, win_ysize, block_size, resuming)
+    esa_band = esa.GetRasterBand(1) if esa is not None else None
+    esa_factors = prepare_overviews([esa], output_format, esa_driver_name, win_xsize, win_ysize, block_size, resuming) if esa is not None else []
+
+    def thread_band():
+        # gdal datasets are not shared between threads
+        return scheduler.local("src", lambda: gdal.Open(src_path, gdal.GA_ReadOnly)).GetRasterBand(1)
+
+    def process(chunk):
+        xoff, yoff, block_xsize, block_ysize = chunk
+        mask = scheduler.local("mask", lambda: BlockMask(mask_wkb, geotransform)) if mask_wkb is not None else None
+        inside = mask.block(xoff, yoff, block_xsize, block_ysize) if mask is not None else True
+        if inside is None:
+            # outside the aoi, nothing is read and the chunk stays nodata
+            return None
+        if result_cache is not None:
+            values, classes = result_cache.block(
+                luts, xoff, yoff, block_xsize, block_ysize,
+                read=lambda: src_band.ReadAsArray(win_xoff + xoff, win_yoff + yoff, block_xsize, block_ysize),
+                need_classes=esa is not None or measured is not None or web_tiles is not None,
+            )
+            if inside is not True:
+                values[:, ~inside] = NODATA_N
+                if classes is not None:
+                    classes[~inside] = class_nodata
+        else:
+            classes = thread_band().ReadAsArray(win_xoff + xoff, win_yoff + yoff, block_xsize, block_ysize)
+            if inside is not True:
+                classes[~inside] = class_nodata
+            if field is not None:
+                values = field.values(classes, xoff, yoff)
+                values[:, luts[0][classes] == NODATA_N] = NODATA_N
+            elif writes_n or measured is not None:
+                # one gather per pixel and scenario, no per-class temporaries
+                values = luts[:, classes]
+            else:
+                values = None
+        if output_format is not None and values is not None:
+            values = output_format.quantize(values, NODATA_N)
+        overviews = [output_format.overview_blocks(band_values, factors, NODATA_N) for band_values in values] if factors and writes_n else None
+        esa_overviews = output_format.overview_blocks(classes, esa_factors, class_nodata, "nearest") if esa_factors else None
+        summary = measured.measure(classes, values, yoff) if measured is not None else None
+        return values, classes, overviews, esa_overviews, summary
+
+    def write(chunk, result):
+        if web_tiles is not None:
+            web_tiles.add(chunk, result[1] if result is not None else None)
+        if result is None:
+            return
+        xoff, yoff = chunk[:2]
+        values, classes, overviews, esa_overviews, summary = result
+        if summary is not None:
+            measured.add(summary)
+        for scenario, dst_band in enumerate(dst_bands):
+            dst_band.WriteArray(values[scenario], xoff, yoff)
+            if overviews:
+                output_format.write_overview_blocks(dst_band, overviews[scenario], xoff, yoff, factors)
+        if esa_band is not None:
+            esa_band.WriteArray(classes, xoff, yoff)
+            if esa_overviews:
+                output_format.write_overview_blocks(esa_band, esa_overviews, xoff, yoff, esa_factors)
+
+    def flush():
+        for dst in outputs + ([esa] if esa is not None else []):
+            dst.FlushCache()
+
+    complete = False
+    try:
+        complete = scheduler.run(chunks, process, write, flush=flush, feedback=feedback, threaded=result_cache is None)
+    finally:
+        if web_tiles is not None:
+            web_tiles.finish(complete)
+
+    flush()
+    dst_bands = None
+    outputs = None
+    esa_band = None
+    esa = None
+    src_band = None
+    src = None
+
+    if complete:
+        if writes_n:
+            finalize_outputs(dst_path if isinstance(dst_path, (list, tuple)) else [dst_path], output_format, driver_name)
+        if esa_path:
+            finalize_outputs([esa_path], output_format, esa_driver_name)
+        if measured is not None:
+            measured.complete = True
+            measured.write_sidecars(dst_path, esa_path)
+    return dst_path
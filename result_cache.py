@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .reclassify import LC_NODATA, NODATA_N
+from .tile_cache import TileCache
+
+# edge of the cached result tiles, aligned to the global land cover pixel grid
+RESULT_TILE_SIZE = 256
+
+DEFAULT_RESULT_CACHE_SIZE_MB = 2048
+
+
+def snap_window(window, tile_size, raster_xsize, raster_ysize):
+    """Grow a pixel window outward to whole cache tiles, clamped to the raster"""
+    xoff, yoff, xsize, ysize = window
+    x0, y0 = xoff // tile_size * tile_size, yoff // tile_size * tile_size
+    x1 = min(-(-(xoff + xsize) // tile_size) * tile_size, raster_xsize)
+    y1 = min(-(-(yoff + ysize) // tile_size) * tile_size, raster_ysize)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+class ResultCache:
+    """Content-addressed cache of computed n tiles with a class presence index
+
+    A tile of one scenario is keyed by the land cover source version, the
+    tile position and the n of only the classes present in the tile. Editing
+    the n of one class therefore changes the key, and forces a recompute,
+    only of the tiles that contain that class, and every other tile is
+    assembled from the cache without reading the land cover. The presence
+    index records the classes of each tile once it has been read.
+    """
+
+    def __init__(self, cache_dir, source_version, max_size_mb=DEFAULT_RESULT_CACHE_SIZE_MB,
+                 tile_size=RESULT_TILE_SIZE, class_nodata=LC_NODATA):
+        self.cache_dir = os.path.normpath(cache_dir)
+        self.tile_size = tile_size
+        self.class_nodata = class_nodata
+        self.version = hashlib.sha1(source_version.encode("utf-8")).hexdigest()
+        # the lru store of the tile cache holds the tile arrays, keyed by file name
+        self.store = TileCache(os.path.join(self.cache_dir, "tiles"), max_size_mb=max_size_mb, offline=True)
+        self.index_path = os.path.join(self.cache_dir, f"presence_{self.version[:16]}.json")
+        self.presence = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                self.presence = {key: tuple(value) for key, value in json.load(file).items()}
+        self._dirty = False
+        self.stats = {"hits": 0, "computed": 0, "blocks_read": 0, "blocks_skipped": 0}
+
+    def tile_key(self, lut, tile, classes):
+        """Content address of one scenario tile, from the n of the classes present only"""
+        content = ";".join(f"{value}:{float(lut[value])!r}" for value in classes)
+        return hashlib.sha1(f"{self.version}|{tile[0]}_{tile[1]}|{content}".encode("ascii")).hexdigest()
+
+    def _load(self, key):
+        path = self.store.cached_path(f"{key}.npy")
+        try:
+            values = np.load(path)
+        except (OSError, ValueError):
+            return None
+        # bump the lru position
+        os.utime(path, None)
+        return values
+
+    def _save(self, key, values):
+        # write under a unique name and rename, so concurrent runs never see partial tiles
+        fd, part_path = tempfile.mkstemp(suffix=".part", dir=self.store.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.save(file, values)
+            os.replace(part_path, self.store.cached_path(f"{key}.npy"))
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def pending(self, luts, window):
+        """Global pixel windows of the tiles in ``window`` that still need the land cover"""
+        xoff, yoff, xsize, ysize = window
+        windows = []
+        for y in range(yoff, yoff + ysize, self.tile_size):
+            for x in range(xoff, xoff + xsize, self.tile_size):
+                tile = (x // self.tile_size, y // self.tile_size)
+                present = self.presence.get(f"{tile[0]}_{tile[1]}")
+                if present is None or (present and not all(
+                        self.store.contains(f"{self.tile_key(lut, tile, present)}.npy") for lut in luts)):
+                    windows.append((x, y, min(self.tile_size, xoff + xsize - x), min(self.tile_size, yoff + ysize - y)))
+        return windows
+
+    def block(self, luts, xoff, yoff, xsize, ysize, read, need_classes=False):
+        """n of a block at global pixel offsets assembled from cached tiles
+
+        ``read()`` returns the land cover classes of the block and is only
+        called when a tile is missing from the cache or its presence is not
+        known yet, or when ``need_classes`` is set. Offsets and sizes must be
+        whole tiles except at the raster edge. Returns the (scenarios, ysize,
+        xsize) values and the classes, None when they were not read.
+        """
+        classes = read() if need_classes else None
+        values = np.empty((len(luts), ysize, xsize), dtype=np.float32)
+        for ty in range(0, ysize, self.tile_size):
+            for tx in range(0, xsize, self.tile_size):
+                rows = slice(ty, min(ty + self.tile_size, ysize))
+                cols = slice(tx, min(tx + self.tile_size, xsize))
+                tile = ((xoff + tx) // self.tile_size, (yoff + ty) // self.tile_size)
+                tile_id = f"{tile[0]}_{tile[1]}"
+                present = self.presence.get(tile_id)
+                if present is None:
+                    if classes is None:
+                        classes = read()
+                    present = tuple(int(value) for value in np.unique(classes[rows, cols]) if value != self.class_nodata)
+                    self.presence[tile_id] = present
+                    self._dirty = True
+                if not present:
+                    # nodata only, e.g. open ocean
+                    values[:, rows, cols] = NODATA_N
+                    continue
+                for scenario, lut in enumerate(luts):
+                    key = self.tile_key(lut, tile, present)
+                    cached = self._load(key)
+                    if cached is not None and cached.shape == (rows.stop - rows.start, cols.stop - cols.start):
+                        values[scenario, rows, cols] = cached
+                        self.stats["hits"] += 1
+                        continue
+                    if classes is None:
+                        classes = read()
+                    values[scenario, rows, cols] = lut[classes[rows, cols]]
+                    self._save(key, values[scenario, rows, cols])
+                    self.stats["computed"] += 1
+        self.stats["blocks_read" if classes is not None else "blocks_skipped"] += 1
+        return values, classes
+
+    def flush(self):
+        """Persist the presence index and keep the tile store within its size cap"""
+        if self._dirty:
+            fd, part_path = tempfile.mkstemp(suffix=".part", dir=self.cache_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({key: list(value) for key, value in self.presence.items()}, file)
+            os.replace(part_path, self.index_path)
+            self._dirty = False
+        return self.store.evict()
+
+
+class WindowResultCache:
+    """Result cache seen from a source window, offsets are relative to the window origin"""
+
+    def __init__(self, cache, window):
+        self.cache = cache
+        self.window = window
+
+    def block(self, luts, xoff, yoff, xsize, ysize, read, need_classes=False):
+        return self.cache.block(luts, self.window[0] + xoff, self.window[1] + yoff, xsize, ysize, read, need_classes)
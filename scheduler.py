@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import json
+import math
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MEMORY_MB = 512
+
+# chunk edges are powers of two between these, which keeps streamed overviews aligned
+MIN_CHUNK_SIZE = 256
+MAX_CHUNK_SIZE = 8192
+
+# completed chunks are flushed to disk and journaled this often
+DEFAULT_CHECKPOINT_EVERY = 16
+
+
+def run_key(*parts):
+    """Digest identifying the inputs of a run, a checkpoint only resumes the same run"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """Journal of the chunks of a run that are safely on disk
+
+    ``state`` is a json-serializable dict saved with the chunks, e.g. counts
+    accumulated over the written chunks, so a resumed run continues them.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.done = set()
+        self.state = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                if data.get("key") == key:
+                    self.done = set(data.get("done", []))
+                    self.state = dict(data.get("state", {}))
+            except (OSError, ValueError):
+                pass
+
+    def save(self):
+        part_path = f"{self.path}.part"
+        with open(part_path, "w", encoding="utf-8") as file:
+            json.dump({"key": self.key, "done": sorted(self.done), "state": self.state}, file)
+        os.replace(part_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ChunkScheduler:
+    """Runs the chunks of an output window within a memory budget
+
+    Chunks are square blocks whose edge is the largest power of two that
+    keeps every chunk in flight within ``memory_mb``. ``process`` computes a
+    chunk, on ``threads`` worker threads when more than one, and ``write``
+    stores it in the calling thread in chunk order, so gdal datasets being
+    written are only touched by one thread. Cancellation is checked and
+    progress reported between chunks.
+
+    With ``resume`` the completed chunks are journaled next to the output
+    every ``checkpoint_every`` chunks and on cancellation; a later run of the
+    same inputs skips them and continues from the last completed chunk.
+    """
+
+    def __init__(self, memory_mb=DEFAULT_MEMORY_MB, threads=1, resume=False, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        if memory_mb <= 0:
+            raise ValueError("memory budget must be positive")
+        self.memory_mb = memory_mb
+        self.threads = max(1, int(threads))
+        self.resume = resume
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint = None
+        self._local = threading.local()
+
+    @property
+    def in_flight(self):
+        """Chunks held in memory at once, two per worker keep the threads busy while writing"""
+        return 1 if self.threads == 1 else 2 * self.threads
+
+    def chunk_size(self, bytes_per_pixel, minimum=MIN_CHUNK_SIZE, maximum=MAX_CHUNK_SIZE):
+        """Chunk edge in pixels for a per pixel working memory of ``bytes_per_pixel``"""
+        pixels = self.memory_mb * 1024 * 1024 / (bytes_per_pixel * self.in_flight)
+        edge = 1 << max(0, int(math.log2(math.sqrt(pixels))))
+        return int(min(maximum, max(minimum, edge)))
+
+    def open_checkpoint(self, path, key):
+        """Load the journal of a run, returns the completed chunk indices"""
+        self.checkpoint = Checkpoint(path, key) if self.resume else None
+        return set(self.checkpoint.done) if self.checkpoint is not None else set()
+
+    def local(self, name, factory):
+        """Per worker thread object, e.g. a gdal dataset that must not be shared between threads"""
+        value = getattr(self._local, name, None)
+        if value is None:
+            value = factory()
+            setattr(self._local, name, value)
+        return value
+
+    def run(self, chunks, process, write, flush=None, feedback=None, threaded=True):
+        """Process and write ``chunks`` in order, returns True when every chunk is done
+
+        ``process(chunk)`` returns a result handed to ``write(chunk, result)``.
+        ``flush()`` must persist everything written so far and is called
+        before each checkpoint. ``threaded=False`` forces one thread, e.g.
+        when ``process`` shares state that is not thread safe.
+        """
+        done = self.checkpoint.done if self.checkpoint is not None else set()
+        todo = [index for index in range(len(chunks)) if index not in done]
+        if feedback is not None and done:
+            feedback.pushInfo(f"resuming after {len(done)} of {len(chunks)} completed chunk(s).")
+        completed = len(chunks) - len(todo)
+        since_checkpoint = 0
+
+        def finished(index):
+            nonlocal completed, since_checkpoint
+            done.add(index)
+            completed += 1
+            since_checkpoint += 1
+            if self.checkpoint is not None and since_checkpoint >= self.checkpoint_every:
+                self._save(flush)
+                since_checkpoint = 0
+            if feedback is not None:
+                feedback.setProgress(100.0 * completed / len(chunks))
+
+        canceled = False
+        if self.threads == 1 or not threaded:
+            for index in todo:
+                if feedback is not None and feedback.isCanceled():
+                    canceled = True
+                    break
+                write(chunks[index], process(chunks[index]))
+                finished(index)
+        else:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                queue = deque()
+                remaining = iter(todo)
+                for index in remaining:
+                    queue.append((index, executor.submit(process, chunks[index])))
+                    if len(queue) >= self.in_flight:
+                        break
+                while queue:
+                    if feedback is not None and feedback.isCanceled():
+                        canceled = True
+                        for _, future in queue:
+                            future.cancel()
+                        break
+                    index, future = queue.popleft()
+                    write(chunks[index], future.result())
+                    finished(index)
+                    following = next(remaining, None)
+                    if following is not None:
+                        queue.append((following, executor.submit(process, chunks[following])))
+
+        # per thread objects of the calling thread are not kept between runs
+        self._local = threading.local()
+        if self.checkpoint is not None:
+            if canceled or len(done) < len(chunks):
+                self._save(flush)
+                if feedback is not None:
+                    feedback.pushInfo(f"{len(done)} of {len(chunks)} chunk(s) kept, run again to resume.")
+            else:
+                self.checkpoint.remove()
+        return not canceled and len(done) == len(chunks)
+
+    def _save(self, flush):
+        if flush is not None:
+            flush()
+        self.checkpoint.save()
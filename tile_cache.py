@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import shutil
+import tempfile
+import urllib.request
+
+VSICURL_PREFIX = "/vsicurl/"
+
+# default cap for the on-disk tile cache, a worldcover tile is roughly 20-120 mb
+DEFAULT_CACHE_SIZE_MB = 4096
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def source_url(filename):
+    """Strip the /vsicurl/ prefix from a vrt source filename"""
+    if filename.startswith(VSICURL_PREFIX):
+        return filename[len(VSICURL_PREFIX):]
+    return filename
+
+
+class TileCache:
+    """On-disk cache of whole worldcover source tiles with lru eviction
+
+    Tiles are keyed by their file name, which is unique per tile and carries
+    the product version. The modification time of a cached file is its last
+    use, so eviction drops the least recently used tiles first. In offline
+    mode nothing is downloaded and tiles are served only from the cache or
+    from ``mirror_dir``.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_CACHE_SIZE_MB, offline=False, mirror_dir=None, timeout=60):
+        self.cache_dir = os.path.normpath(cache_dir)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.offline = offline
+        self.mirror_dir = os.path.normpath(mirror_dir) if mirror_dir else None
+        self.timeout = timeout
+        # bytes downloaded over the life of the cache, for run reports
+        self.downloaded_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, url):
+        """Cache key of a source tile"""
+        return os.path.basename(source_url(url))
+
+    def cached_path(self, url):
+        return os.path.join(self.cache_dir, self.key(url))
+
+    def mirror_path(self, url):
+        if self.mirror_dir is None:
+            return None
+        path = os.path.join(self.mirror_dir, self.key(url))
+        return path if os.path.exists(path) else None
+
+    def contains(self, url):
+        return self.mirror_path(url) is not None or os.path.exists(self.cached_path(url))
+
+    def fetch(self, url, feedback=None):
+        """Return a local path for a source tile, downloading it when allowed"""
+        mirrored = self.mirror_path(url)
+        if mirrored is not None:
+            return mirrored
+
+        path = self.cached_path(url)
+        if os.path.exists(path):
+            # bump the lru position
+            os.utime(path, None)
+            return path
+
+        if self.offline:
+            raise RuntimeError(f"tile not available offline: {self.key(url)}")
+
+        if feedback is not None:
+            feedback.pushInfo(f"downloading tile into cache: {self.key(url)}")
+        self._download(source_url(url), path, feedback)
+        return path
+
+    def _download(self, url, path, feedback=None):
+        # download under a unique name and rename, so concurrent runs never see partial tiles
+        fd, part_path = tempfile.mkstemp(suffix=".part", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as file, urllib.request.urlopen(url, timeout=self.timeout) as response:
+                while True:
+                    if feedback is not None and feedback.isCanceled():
+                        raise RuntimeError("tile download canceled")
+                    chunk = response.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file.write(chunk)
+                    self.downloaded_bytes += len(chunk)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def usage(self):
+        """Total size in bytes of the cached tiles"""
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".part") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def evict(self, keep=()):
+        """Drop least recently used tiles until the cache fits its size cap"""
+        keep = {os.path.normpath(path) for path in keep}
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        removed = []
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.normpath(path) in keep:
+                continue
+            os.remove(path)
+            total -= size
+            removed.append(path)
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
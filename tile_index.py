@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import os
+import json
+import functools
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+
+def index_path_for(vrt_path):
+    """Path of the tile index shipped next to a vrt"""
+    return os.path.splitext(vrt_path)[0] + ".index.json"
+
+
+def _tile_name(lon, lat):
+    """WorldCover tile name from the lower left corner, e.g. S54E168"""
+    return f"{'N' if lat >= 0 else 'S'}{abs(lat):02d}{'E' if lon >= 0 else 'W'}{abs(lon):03d}"
+
+
+class TileIndex:
+    """Compact grid index of the source tiles of a WorldCover mosaic vrt
+
+    The mosaic is a regular grid of equally sized tiles, so the index stores
+    one presence flag per grid cell plus a file name template instead of the
+    thousands of vrt source entries. Looking up the tiles under a window is
+    pure arithmetic and never opens the mosaic vrt.
+    """
+
+    def __init__(self, data):
+        self.raster_xsize, self.raster_ysize = data["raster_size"]
+        self.geotransform = tuple(data["geotransform"])
+        self.srs = data["srs"]
+        self.tile_size = data["tile_size"]
+        self.tile_degrees = data["tile_degrees"]
+        self.block_size = data["block_size"]
+        self.nodata = data["nodata"]
+        self.source_template = data["source_template"]
+        self.color_table = {int(value): tuple(rgba) for value, rgba in data["color_table"].items()}
+        self.grid = data["grid"]
+
+    @classmethod
+    def load(cls, index_path):
+        return _load_index(os.path.normpath(index_path), os.path.getmtime(index_path))
+
+    @property
+    def wraps(self):
+        """True when the mosaic spans all longitudes, so windows may continue across the antimeridian"""
+        return abs(self.raster_xsize * self.geotransform[1] - 360.0) < 1e-6
+
+    def has_tile(self, col, row):
+        return 0 <= row < len(self.grid) and 0 <= col < len(self.grid[row]) and self.grid[row][col] == "1"
+
+    def source_filename(self, col, row):
+        lon = int(round(self.geotransform[0])) + col * self.tile_degrees
+        lat = int(round(self.geotransform[3])) - (row + 1) * self.tile_degrees
+        return self.source_template.format(tile=_tile_name(lon, lat))
+
+    def sources(self, window):
+        """List (filename, src_rect, dst_rect) for tiles intersecting a pixel window
+
+        Rectangles are (xoff, yoff, xsize, ysize) cut to the window, with the
+        destination relative to the window origin. Columns past the east edge
+        of a mosaic that ``wraps`` are read from its west edge.
+        """
+        win_xoff, win_yoff, win_xsize, win_ysize = window
+        first_col, last_col = win_xoff // self.tile_size, (win_xoff + win_xsize - 1) // self.tile_size
+        first_row, last_row = win_yoff // self.tile_size, (win_yoff + win_ysize - 1) // self.tile_size
+        columns = self.raster_xsize // self.tile_size
+        sources = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                source_col = col % columns if self.wraps else col
+                if not self.has_tile(source_col, row):
+                    continue
+                tile_x, tile_y = col * self.tile_size, row * self.tile_size
+                x0, y0 = max(tile_x, win_xoff), max(tile_y, win_yoff)
+                x1 = min(tile_x + self.tile_size, win_xoff + win_xsize)
+                y1 = min(tile_y + self.tile_size, win_yoff + win_ysize)
+                sources.append((
+                    self.source_filename(source_col, row),
+                    (x0 - tile_x, y0 - tile_y, x1 - x0, y1 - y0),
+                    (x0 - win_xoff, y0 - win_yoff, x1 - x0, y1 - y0),
+                ))
+        return sources
+
+    def is_empty(self, window):
+        """True when no source tile covers the window, i.e. open ocean or nodata"""
+        return not self.sources(window)
+
+    def write_window_vrt(self, window, out_path, resolve=None):
+        """Write a minimal vrt covering only ``window`` and the tiles under it
+
+        ``resolve`` maps a source filename to the path actually referenced,
+        e.g. a local copy served by the tile cache. Returns the vrt path and
+        the referenced source paths.
+        """
+        win_xoff, win_yoff, win_xsize, win_ysize = window
+        gt = self.geotransform
+        geotransform = (gt[0] + win_xoff * gt[1], gt[1], gt[2], gt[3] + win_yoff * gt[5], gt[4], gt[5])
+
+        entries = []
+        for value in range(256):
+            r, g, b, a = self.color_table.get(value, (0, 0, 0, 255))
+            entries.append(f'      <Entry c1="{r}" c2="{g}" c3="{b}" c4="{a}" />')
+
+        sources = []
+        referenced = []
+        for filename, src_rect, dst_rect in self.sources(window):
+            path = resolve(filename) if resolve is not None else filename
+            referenced.append(path)
+            sources.append(
+                '    <ComplexSource resampling="nearest">\n'
+                f'      <SourceFilename relativeToVRT="0">{escape(path)}</SourceFilename>\n'
+                "      <SourceBand>1</SourceBand>\n"
+                f'      <SourceProperties RasterXSize="{self.tile_size}" RasterYSize="{self.tile_size}" '
+                f'DataType="Byte" BlockXSize="{self.block_size}" BlockYSize="{self.block_size}" />\n'
+                '      <SrcRect xOff="%d" yOff="%d" xSize="%d" ySize="%d" />\n' % src_rect
+                + '      <DstRect xOff="%d" yOff="%d" xSize="%d" ySize="%d" />\n' % dst_rect
+                + f"      <NODATA>{self.nodata}</NODATA>\n"
+                "    </ComplexSource>"
+            )
+
+        lines = [
+            f'<VRTDataset rasterXSize="{win_xsize}" rasterYSize="{win_ysize}">',
+            f'  <SRS dataAxisToSRSAxisMapping="2,1">{escape(self.srs)}</SRS>',
+            "  <GeoTransform> " + ", ".join(f"{value:.16e}" for value in geotransform) + "</GeoTransform>",
+            '  <VRTRasterBand dataType="Byte" band="1">',
+            f"    <NoDataValue>{self.nodata}</NoDataValue>",
+            "    <ColorInterp>Palette</ColorInterp>",
+            "    <ColorTable>",
+            *entries,
+            "    </ColorTable>",
+            *sources,
+            "  </VRTRasterBand>",
+            "</VRTDataset>",
+        ]
+        with open(out_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        return out_path, referenced
+
+
+@functools.lru_cache(maxsize=8)
+def _load_index(index_path, mtime):
+    # mtime is part of the cache key so a rebuilt index is picked up
+    with open(index_path, "r", encoding="utf-8") as file:
+        return TileIndex(json.load(file))
+
+
+def build_index(vrt_path, index_path=None):
+    """Build the compact tile index of a WorldCover mosaic vrt
+
+    The vrt must be a regular grid of full, unscaled tiles whose file names
+    follow the WorldCover naming scheme, which is checked for every source.
+    """
+    index_path = index_path or index_path_for(vrt_path)
+    root = ET.parse(vrt_path).getroot()
+    geotransform = [float(value) for value in root.find("GeoTransform").text.split(",")]
+    raster_xsize, raster_ysize = int(root.get("rasterXSize")), int(root.get("rasterYSize"))
+    band = root.find("VRTRasterBand")
+
+    color_table = {}
+    palette = band.find("ColorTable")
+    for value, entry in enumerate(palette if palette is not None else []):
+        rgba = [int(entry.get(key)) for key in ("c1", "c2", "c3", "c4")]
+        if rgba != [0, 0, 0, 255]:
+            color_table[str(value)] = rgba
+
+    sources = band.findall("ComplexSource")
+    first = sources[0]
+    tile_size = int(first.find("DstRect").get("xSize"))
+    tile_degrees = int(round(tile_size * geotransform[1]))
+    properties = first.find("SourceProperties")
+    block_size = int(properties.get("BlockXSize")) if properties is not None else 1024
+    first_name = first.find("SourceFilename").text
+
+    cols, rows = raster_xsize // tile_size, raster_ysize // tile_size
+    grid = [["0"] * cols for _ in range(rows)]
+    template = None
+    for source in sources:
+        dst = source.find("DstRect")
+        src = source.find("SrcRect")
+        if any(int(float(rect.get(key))) != tile_size for rect in (src, dst) for key in ("xSize", "ySize")):
+            raise ValueError("vrt sources are not full unscaled tiles")
+        xoff, yoff = int(float(dst.get("xOff"))), int(float(dst.get("yOff")))
+        if xoff % tile_size or yoff % tile_size:
+            raise ValueError("vrt sources are not aligned to a regular tile grid")
+        col, row = xoff // tile_size, yoff // tile_size
+        name = _tile_name(int(round(geotransform[0])) + col * tile_degrees,
+                          int(round(geotransform[3])) - (row + 1) * tile_degrees)
+        filename = source.find("SourceFilename").text
+        if template is None:
+            template = filename.replace(name, "{tile}")
+        if template.format(tile=name) != filename:
+            raise ValueError(f"vrt source does not follow the tile naming scheme: {filename}")
+        grid[row][col] = "1"
+
+    data = {
+        "vrt": os.path.basename(vrt_path),
+        "raster_size": [raster_xsize, raster_ysize],
+        "geotransform": geotransform,
+        "srs": root.find("SRS").text,
+        "tile_size": tile_size,
+        "tile_degrees": tile_degrees,
+        "block_size": block_size,
+        "nodata": int(float(band.find("NoDataValue").text)),
+        "source_template": template or first_name,
+        "color_table": color_table,
+        "grid": ["".join(row) for row in grid],
+    }
+    with open(index_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=1)
+    return index_path
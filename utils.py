@@ -29,8 +29,8 @@ __copyright__ = "(C) 2025 by Abdullah Azzam"
 import os
 import sys
 import inspect
+import time
 import processing
-import requests
 from qgis.core import (
     Qgis,
     QgsApplication,
@@ -46,9 +46,11 @@ from qgis.core import (
     QgsVectorLayer,
 )
 from qgis.PyQt.QtWidgets import QPushButton
-from qgis.utils import iface
 
 def fetchMessage(url, timeout=2) -> str:
+    # imported on use, requests is not needed to load the plugin
+    import requests
+
     response = requests.get(url, timeout=timeout)
     response.raise_for_status()
     return response.text
@@ -118,6 +120,8 @@ def gdalPolygonize(input, field="value", output=QgsProcessing.TEMPORARY_OUTPUT,
     return processing.run("gdal:polygonize", params, context=context, feedback=feedback, is_child_algorithm=True)["OUTPUT"]
 
 def downloadFile(request_URL, context=None, feedback=None):
+    import requests
+
     try:
         alg_params = {"URL": request_URL, "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
         return processing.run("native:filedownloader", alg_params, context=context, feedback=feedback, is_child_algorithm=True)["OUTPUT"]
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import math
+import os
+import sqlite3
+import uuid
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from osgeo import gdal, osr
+
+from .output_format import downsample
+from .reclassify import LC_NODATA, NODATA_N, BlockMask, iter_windows
+
+TILE_SIZE = 256
+EARTH_RADIUS = 6378137.0
+
+# half the width of the web mercator world in metres
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798066
+MAX_ZOOM = 22
+DEFAULT_MIN_ZOOM = 5
+
+TILE_FORMATS = {".mbtiles": "MBTiles", ".gpkg": "GPKG"}
+
+ROUGHNESS_STYLE = os.path.normpath(os.path.join(os.path.dirname(__file__), "mannings_n.qml"))
+LANDCOVER_STYLE = os.path.normpath(os.path.join(os.path.dirname(__file__), "esa_worldcover_2021.qml"))
+
+# tiles inserted per sqlite transaction
+COMMIT_EVERY = 500
+
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+
+GPKG_CORE_TABLES = """
+CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+CREATE TABLE IF NOT EXISTS gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+    description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE IF NOT EXISTS gpkg_tile_matrix_set (
+    table_name TEXT NOT NULL PRIMARY KEY, srs_id INTEGER NOT NULL,
+    min_x DOUBLE NOT NULL, min_y DOUBLE NOT NULL, max_x DOUBLE NOT NULL, max_y DOUBLE NOT NULL,
+    CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+CREATE TABLE IF NOT EXISTS gpkg_tile_matrix (
+    table_name TEXT NOT NULL, zoom_level INTEGER NOT NULL, matrix_width INTEGER NOT NULL,
+    matrix_height INTEGER NOT NULL, tile_width INTEGER NOT NULL, tile_height INTEGER NOT NULL,
+    pixel_x_size DOUBLE NOT NULL, pixel_y_size DOUBLE NOT NULL,
+    CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level),
+    CONSTRAINT fk_tmm_table_name FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name));
+"""
+
+
+def _rgba(color, alpha):
+    color = color.lstrip("#")
+    return [int(color[i:i + 2], 16) for i in (0, 2, 4)] + [int(alpha)]
+
+
+def read_color_ramp(qml_path=ROUGHNESS_STYLE):
+    """Stop values and rgba colours of the interpolated colour ramp of a pseudocolor qml style"""
+    items = ET.parse(qml_path).getroot().findall(".//colorrampshader/item")
+    if not items:
+        raise ValueError(f"no colour ramp in style: {qml_path}")
+    items.sort(key=lambda item: float(item.get("value")))
+    stops = np.array([float(item.get("value")) for item in items])
+    colors = np.array([_rgba(item.get("color"), item.get("alpha", 255)) for item in items], dtype=np.float64)
+    return stops, colors
+
+
+def read_palette(qml_path=LANDCOVER_STYLE, class_nodata=LC_NODATA):
+    """256 x 4 rgba table of a paletted qml style, classes without an entry are transparent"""
+    entries = ET.parse(qml_path).getroot().findall(".//colorPalette/paletteEntry")
+    if not entries:
+        raise ValueError(f"no palette in style: {qml_path}")
+    table = np.zeros((256, 4), dtype=np.uint8)
+    for entry in entries:
+        table[int(entry.get("value"))] = _rgba(entry.get("color"), entry.get("alpha", 255))
+    table[class_nodata] = 0
+    return table
+
+
+def colorize_ramp(values, ramp, nodata=NODATA_N):
+    """Rgba pixels of n values, values past the ends of the ramp take the end colours as in qgis"""
+    stops, colors = ramp
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(4):
+        rgba[..., channel] = np.rint(np.interp(values, stops, colors[:, channel]))
+    rgba[values == nodata] = 0
+    return rgba
+
+
+def native_zoom(pixel_size):
+    """Deepest zoom whose tile pixels are not finer than a source pixel of ``pixel_size`` degrees"""
+    return min(MAX_ZOOM, max(0, int(math.floor(math.log2(360.0 / (TILE_SIZE * pixel_size)) + 1e-6))))
+
+
+def _mercator_y(latitude):
+    latitude = min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE)
+    return EARTH_RADIUS * math.log(math.tan(math.pi / 4.0 + math.radians(latitude) / 2.0))
+
+
+def tile_range(bounds, zoom):
+    """Inclusive (xmin, ymin, xmax, ymax) xyz tile range covering lon/lat ``bounds``"""
+    count = 1 << zoom
+    size = 2.0 * ORIGIN_SHIFT / count
+    west, south, east, north = bounds
+    x0 = int((math.radians(west) * EARTH_RADIUS + ORIGIN_SHIFT) // size)
+    x1 = int((math.radians(east) * EARTH_RADIUS + ORIGIN_SHIFT) // size)
+    y0 = int((ORIGIN_SHIFT - _mercator_y(north)) // size)
+    y1 = int((ORIGIN_SHIFT - _mercator_y(south)) // size)
+    return tuple(min(max(value, 0), count - 1) for value in (x0, y0, x1, y1))
+
+
+def encode_png(rgba):
+    """Png bytes of a (rows, cols, 4) uint8 array"""
+    rows, cols = rgba.shape[:2]
+    mem = gdal.GetDriverByName("MEM").Create("", cols, rows, 4, gdal.GDT_Byte)
+    for channel in range(4):
+        mem.GetRasterBand(channel + 1).WriteArray(rgba[..., channel])
+    path = f"/vsimem/web_tile_{uuid.uuid4().hex}.png"
+    gdal.GetDriverByName("PNG").CreateCopy(path, mem)
+    mem = None
+    handle = gdal.VSIFOpenL(path, "rb")
+    try:
+        gdal.VSIFSeekL(handle, 0, 2)
+        size = gdal.VSIFTellL(handle)
+        gdal.VSIFSeekL(handle, 0, 0)
+        return gdal.VSIFReadL(1, size, handle)
+    finally:
+        gdal.VSIFCloseL(handle)
+        gdal.Unlink(path)
+
+
+class MBTilesWriter:
+    """Png tiles of one tileset in an mbtiles 1.3 file"""
+
+    def __init__(self, path, name, bounds, min_zoom, max_zoom, description=""):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        west, south, east, north = bounds
+        metadata = {
+            "name": name,
+            "description": description,
+            "format": "png",
+            "type": "overlay",
+            "version": "1.0",
+            "bounds": f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}",
+            "center": f"{(west + east) / 2:.6f},{(south + north) / 2:.6f},{max(min_zoom, max_zoom - 2)}",
+            "minzoom": str(min_zoom),
+            "maxzoom": str(max_zoom),
+        }
+        self.connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+        self._pending = 0
+
+    def write(self, zoom, x, y, data):
+        # mbtiles rows count from the south
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            (zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(data)),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class GeoPackageTileWriter(MBTilesWriter):
+    """Png tiles of one tile table in a geopackage, in the web mercator tile matrix set"""
+
+    def __init__(self, path, name, bounds, min_zoom, max_zoom, description=""):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+        self.connection.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+        self.connection.executescript(GPKG_CORE_TABLES)
+        srs_rows = [
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+        ]
+        for code, srs_name in ((4326, "WGS 84 geodetic"), (3857, "WGS 84 / Pseudo-Mercator")):
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(code)
+            srs_rows.append((srs_name, code, "EPSG", code, srs.ExportToWkt(), None))
+        self.connection.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", srs_rows)
+
+        self.table = name
+        west, south, east, north = bounds
+        self.connection.execute(f"""
+            CREATE TABLE "{name}" (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, zoom_level INTEGER NOT NULL,
+                tile_column INTEGER NOT NULL, tile_row INTEGER NOT NULL, tile_data BLOB NOT NULL,
+                UNIQUE (zoom_level, tile_column, tile_row))
+        """)
+        self.connection.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, description, min_x, min_y, max_x, max_y, srs_id) "
+            "VALUES (?, 'tiles', ?, ?, ?, ?, ?, ?, 3857)",
+            (name, name, description, math.radians(west) * EARTH_RADIUS, _mercator_y(south),
+             math.radians(east) * EARTH_RADIUS, _mercator_y(north)),
+        )
+        self.connection.execute(
+            "INSERT INTO gpkg_tile_matrix_set VALUES (?, 3857, ?, ?, ?, ?)",
+            (name, -ORIGIN_SHIFT, -ORIGIN_SHIFT, ORIGIN_SHIFT, ORIGIN_SHIFT),
+        )
+        self.connection.executemany(
+            "INSERT INTO gpkg_tile_matrix VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (name, zoom, 1 << zoom, 1 << zoom, TILE_SIZE, TILE_SIZE,
+                 2.0 * ORIGIN_SHIFT / (TILE_SIZE << zoom), 2.0 * ORIGIN_SHIFT / (TILE_SIZE << zoom))
+                for zoom in range(min_zoom, max_zoom + 1)
+            ],
+        )
+        self._pending = 0
+
+    def write(self, zoom, x, y, data):
+        # geopackage rows count from the north, like xyz
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO "{self.table}" (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+            (zoom, x, y, sqlite3.Binary(data)),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.connection.commit()
+            self._pending = 0
+
+
+class TilePyramid:
+    """One tileset whose parent tiles are reduced from their four children
+
+    Tiles are added row by row at the deepest zoom. Each tile is reduced
+    into its quadrant of the pending parent as soon as it is written, and
+    once both child rows of a parent row are complete the parents are
+    written and passed up, so only about two rows of 256 x 256 tiles per
+    zoom are held in memory and the source is read once for all zoom levels.
+    """
+
+    def __init__(self, writer, colorize, nodata, resampling, min_zoom, max_zoom, last_row):
+        self.writer = writer
+        self.colorize = colorize
+        self.nodata = nodata
+        self.resampling = resampling
+        self.min_zoom = min_zoom
+        # last tile row of each zoom, its parents are complete without an odd sibling
+        self.last_rows = {zoom: last_row >> (max_zoom - zoom) for zoom in range(min_zoom, max_zoom + 1)}
+        self.pending = {zoom: {} for zoom in range(min_zoom, max_zoom)}
+        self.written = 0
+
+    def add(self, zoom, x, y, data):
+        """Write a tile and reduce it into its parent, empty tiles are skipped"""
+        if data is None or not (data != self.nodata).any():
+            return
+        self.writer.write(zoom, x, y, encode_png(self.colorize(data)))
+        self.written += 1
+        if zoom > self.min_zoom:
+            parents = self.pending[zoom - 1]
+            key = (x // 2, y // 2)
+            if key not in parents:
+                parents[key] = np.full((TILE_SIZE, TILE_SIZE), self.nodata, dtype=data.dtype)
+            half = TILE_SIZE // 2
+            row, col = (y % 2) * half, (x % 2) * half
+            parents[key][row:row + half, col:col + half] = downsample(data, 2, self.nodata, self.resampling)
+
+    def end_row(self, zoom, y):
+        """Mark tile row ``y`` of ``zoom`` complete"""
+        if zoom == self.min_zoom or (y % 2 == 0 and y != self.last_rows[zoom]):
+            return
+        parents = self.pending[zoom - 1]
+        for key in sorted(key for key in parents if key[1] == y // 2):
+            self.add(zoom - 1, key[0], key[1], parents.pop(key))
+        self.end_row(zoom - 1, y // 2)
+
+
+def tile_paths(dst_path, names, landcover=False):
+    """Tileset names and the file holding each, one file per tileset for mbtiles"""
+    extension = os.path.splitext(dst_path)[1].lower()
+    if extension not in TILE_FORMATS:
+        raise ValueError(f"web tiles must be .mbtiles or .gpkg: {dst_path}")
+    tilesets = ["mannings_n"] if len(names) == 1 else [f"mannings_n_{name}" for name in names]
+    if landcover:
+        tilesets.append("esa_worldcover")
+    if extension == ".gpkg":
+        return [(tileset, dst_path) for tileset in tilesets]
+    base = os.path.splitext(dst_path)[0]
+    return [(tileset, dst_path if i == 0 else f"{base}_{tileset}{extension}") for i, tileset in enumerate(tilesets)]
+
+
+
+class WebTileBuilder:
+    """Styled web mercator png tile pyramid of Manning's n fed with land cover chunks
+
+    The builder samples the deepest zoom, nearest neighbour, from the class
+    chunks the reclassification already holds in memory, so the tiles cost
+    no second read of the land cover. ``start`` takes the grid of the
+    chunks, ``add`` takes each (xoff, yoff, xsize, ysize) chunk and its
+    classes, in any order, with None for chunks left out, e.g. outside the
+    mask, and ``finish`` closes the files. Tile rows are written and reduced
+    to the coarser zooms as soon as every chunk under them was added, so
+    only the tile rows under one row of chunks are held in memory.
+
+    ``dst_path`` ending in ``.mbtiles`` gets one file per tileset, the first
+    scenario at ``dst_path`` and the others and the land cover next to it;
+    ``.gpkg`` gets one tile table per tileset. n is coloured with the ramp
+    of ``mannings_n.qml`` and land cover with the palette of
+    ``esa_worldcover_2021.qml``; every zoom above the deepest is the average
+    (n) or nearest (classes) of the zoom below. ``bounds`` (lon/lat) and the
+    envelope of ``mask_wkb`` (epsg:4326 polygon) limit the tiles.
+    ``max_zoom`` defaults to the zoom matching the source resolution.
+    """
+
+    def __init__(self, dst_path, lut, names=None, landcover=False, bounds=None,
+                 min_zoom=None, max_zoom=None, mask_wkb=None, feedback=None):
+        self.dst_path = dst_path
+        self.lut = lut
+        self.names = names
+        self.landcover = landcover
+        self.bounds = bounds
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.mask_wkb = mask_wkb
+        self.feedback = feedback
+        self.mask = None
+        self.pyramids = []
+        self.paths = []
+        self.files = []
+
+    def start(self, geotransform, xsize, ysize, chunks, class_nodata=LC_NODATA):
+        """Open the tilesets for the chunks of a ``xsize`` x ``ysize`` raster on ``geotransform``"""
+        gt = geotransform
+        self.class_nodata = class_nodata
+        self.luts = np.atleast_2d(np.asarray(self.lut, dtype=np.float32)).copy()
+        self.luts[:, class_nodata] = NODATA_N
+        names = list(self.names or [f"scenario_{i + 1}" for i in range(len(self.luts))])
+
+        raster_bounds = (gt[0], gt[3] + ysize * gt[5], gt[0] + xsize * gt[1], gt[3])
+        bounds = self.bounds
+        if self.mask_wkb is not None:
+            self.mask = BlockMask(self.mask_wkb, gt)
+            xmin, xmax, ymin, ymax = self.mask.geometry.GetEnvelope()
+            bounds = (xmin, ymin, xmax, ymax) if bounds is None else (
+                max(bounds[0], xmin), max(bounds[1], ymin), min(bounds[2], xmax), min(bounds[3], ymax))
+        bounds = raster_bounds if bounds is None else (
+            max(bounds[0], raster_bounds[0]), max(bounds[1], raster_bounds[1]),
+            min(bounds[2], raster_bounds[2]), min(bounds[3], raster_bounds[3]))
+        if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+            raise ValueError("web tile bounds do not overlap the land cover raster")
+
+        max_zoom = native_zoom(abs(gt[1])) if self.max_zoom is None else int(self.max_zoom)
+        min_zoom = min(DEFAULT_MIN_ZOOM, max_zoom) if self.min_zoom is None else int(self.min_zoom)
+        if not 0 <= min_zoom <= max_zoom <= MAX_ZOOM:
+            raise ValueError(f"web tile zoom levels must satisfy 0 <= min <= max <= {MAX_ZOOM}")
+        self.zoom = max_zoom
+
+        x0, y0, x1, y1 = tile_range(bounds, max_zoom)
+        self.tile_columns = (x0, x1)
+        self.first_row, self.next_row, self.last_row = y0, y0, y1
+        resolution = 2.0 * ORIGIN_SHIFT / (TILE_SIZE << max_zoom)
+        if self.feedback is not None:
+            self.feedback.pushInfo(
+                f"web tiles: zoom {min_zoom} to {max_zoom}, {(x1 - x0 + 1) * (y1 - y0 + 1)} tile(s) at zoom {max_zoom}."
+            )
+
+        # source column of every pixel centre across the tile columns, shared by all tile rows
+        columns = np.arange(x0 * TILE_SIZE, (x1 + 1) * TILE_SIZE)
+        longitudes = np.degrees(((columns + 0.5) * resolution - ORIGIN_SHIFT) / EARTH_RADIUS)
+        self.cols = np.floor((longitudes - gt[0]) / gt[1]).astype(np.int64)
+        self.valid_cols = (self.cols >= 0) & (self.cols < xsize)
+
+        # source row of every pixel centre of every tile row
+        pixel_rows = np.arange(y0 * TILE_SIZE, (y1 + 1) * TILE_SIZE)
+        latitudes = np.degrees(2.0 * np.arctan(np.exp((ORIGIN_SHIFT - (pixel_rows + 0.5) * resolution) / EARTH_RADIUS)) - np.pi / 2.0)
+        self.rows = np.floor((latitudes - gt[3]) / gt[5]).astype(np.int64).reshape(-1, TILE_SIZE)
+        self.valid_rows = (self.rows >= 0) & (self.rows < ysize)
+        self.row_ends = np.where(self.valid_rows.any(axis=1), np.where(self.valid_rows, self.rows, -1).max(axis=1), -1)
+        self.row_starts = np.where(self.valid_rows, self.rows, ysize).min(axis=1)
+        self.strips = {}
+
+        # a row of chunks is complete once all its chunks were added
+        self.missing_chunks, self.chunk_ends = {}, {}
+        for _, yoff, _, block_ysize in chunks:
+            self.missing_chunks[yoff] = self.missing_chunks.get(yoff, 0) + 1
+            self.chunk_ends[yoff] = yoff + block_ysize
+        self.complete_rows = 0
+
+        self.paths = tile_paths(self.dst_path, names, self.landcover)
+        for path in {path for _, path in self.paths}:
+            if os.path.exists(path):
+                os.remove(path)
+        writer_class = GeoPackageTileWriter if self.dst_path.lower().endswith(".gpkg") else MBTilesWriter
+        ramp = read_color_ramp()
+        for i, (tileset, path) in enumerate(self.paths):
+            writer = writer_class(path, tileset, bounds, min_zoom, max_zoom,
+                                  "ESA WorldCover land cover" if i == len(self.luts) else f"Manning's n ({names[i]})")
+            if i < len(self.luts):
+                pyramid = TilePyramid(writer, lambda values: colorize_ramp(values, ramp), NODATA_N, "average", min_zoom, max_zoom, y1)
+            else:
+                palette = read_palette(class_nodata=class_nodata)
+                pyramid = TilePyramid(writer, palette.__getitem__, class_nodata, "nearest", min_zoom, max_zoom, y1)
+            self.pyramids.append(pyramid)
+
+    def add(self, chunk, classes):
+        """Sample the tile pixels falling in a chunk and write the tile rows it completes"""
+        xoff, yoff, block_xsize, block_ysize = chunk
+        if classes is not None:
+            in_cols = self.valid_cols & (self.cols >= xoff) & (self.cols < xoff + block_xsize)
+            first = self.next_row - self.first_row
+            for index in np.nonzero((self.row_ends[first:] >= yoff) & (self.row_starts[first:] < yoff + block_ysize))[0] + first:
+                rows = self.rows[index]
+                in_rows = self.valid_rows[index] & (rows >= yoff) & (rows < yoff + block_ysize)
+                if not in_rows.any() or not in_cols.any():
+                    continue
+                strip = self.strips.get(index)
+                if strip is None:
+                    strip = self.strips[index] = np.full((TILE_SIZE, self.cols.size), self.class_nodata, dtype=np.uint8)
+                strip[np.ix_(in_rows, in_cols)] = classes[np.ix_(rows[in_rows] - yoff, self.cols[in_cols] - xoff)]
+
+        self.missing_chunks[yoff] -= 1
+        while self.missing_chunks.get(self.complete_rows) == 0:
+            self.complete_rows = self.chunk_ends[self.complete_rows]
+        while self.next_row <= self.last_row and self.row_ends[self.next_row - self.first_row] < self.complete_rows:
+            self._write_row()
+
+    def _write_row(self):
+        y = self.next_row
+        strip = self.strips.pop(y - self.first_row, None)
+        if strip is not None:
+            x0, x1 = self.tile_columns
+            for x in range(x0, x1 + 1):
+                tile = strip[:, (x - x0) * TILE_SIZE:(x - x0 + 1) * TILE_SIZE]
+                for i, pyramid in enumerate(self.pyramids):
+                    pyramid.add(self.zoom, x, y, self.luts[i][tile] if i < len(self.luts) else tile)
+        for pyramid in self.pyramids:
+            pyramid.end_row(self.zoom, y)
+        self.next_row += 1
+
+    def finish(self, complete=True):
+        """Write the remaining tile rows unless canceled and close the files, returns the files written"""
+        try:
+            while complete and self.next_row <= self.last_row:
+                self._write_row()
+        finally:
+            for pyramid in self.pyramids:
+                pyramid.writer.close()
+        self.strips = {}
+        if self.feedback is not None and complete:
+            self.feedback.pushInfo(f"web tiles: {sum(pyramid.written for pyramid in self.pyramids)} tile(s) written.")
+        self.files = sorted({path for _, path in self.paths})
+        return self.files
+
+
+def export_web_tiles(src_path, dst_path, lut, names=None, landcover=False, bounds=None,
+                     min_zoom=None, max_zoom=None, mask_wkb=None, feedback=None):
+    """Write the web tiles of a land cover raster in a pass of its own
+
+    Runs that write n already feed a ``WebTileBuilder`` from their chunks;
+    this second read of the land cover is only for outputs that do not
+    stream the native classes, e.g. n aggregated to a target grid, and for
+    the chunks a resumed run completed earlier. The arguments are those of
+    ``WebTileBuilder``. Returns the files written.
+    """
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {src_path}")
+    band = src.GetRasterBand(1)
+    xsize, ysize = src.RasterXSize, src.RasterYSize
+    src_nodata = band.GetNoDataValue()
+    class_nodata = LC_NODATA if src_nodata is None else int(src_nodata)
+
+    # full width strips, every tile row is complete once the strip below it was read
+    chunks = list(iter_windows(xsize, ysize, xsize, TILE_SIZE))
+    builder = WebTileBuilder(dst_path, lut, names=names, landcover=landcover, bounds=bounds,
+                             min_zoom=min_zoom, max_zoom=max_zoom, mask_wkb=mask_wkb, feedback=feedback)
+    complete = False
+    try:
+        builder.start(src.GetGeoTransform(), xsize, ysize, chunks, class_nodata)
+        for current, chunk in enumerate(chunks):
+            if feedback is not None and feedback.isCanceled():
+                break
+            builder.add(chunk, read_classes(band, chunk, builder.mask, class_nodata))
+            if feedback is not None:
+                feedback.setProgress(100.0 * (current + 1) / len(chunks))
+        else:
+            complete = True
+    finally:
+        paths = builder.finish(complete)
+        band = None
+        src = None
+    return paths
+
+
+def read_classes(band, chunk, mask=None, class_nodata=LC_NODATA):
+    """Classes of a chunk with nodata outside the ``mask``, None when the chunk is outside it"""
+    xoff, yoff, block_xsize, block_ysize = chunk
+    inside = mask.block(xoff, yoff, block_xsize, block_ysize) if mask is not None else True
+    if inside is None:
+        return None
+    classes = band.ReadAsArray(xoff, yoff, block_xsize, block_ysize)
+    if inside is not True:
+        classes[~inside] = class_nodata
+    return classes
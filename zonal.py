@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manning's Roughness Generator - A QGIS Plugin
+Generates Manning's roughness coefficient layers for hydrological modeling.
+
+Created on: 2025-02-08
+Copyright: (C) 2025 by Abdullah Azzam
+Email: mabdazzam@outlook.com
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Abdullah Azzam"
+__date__ = "2025-02-08"
+__copyright__ = "(C) 2025 by Abdullah Azzam"
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from .raster_stats import row_areas
+from .reclassify import LC_NODATA, NODATA_N, DEFAULT_BLOCK_SIZE, iter_windows
+
+# zone id burnt where no zone covers a pixel
+ZONE_NODATA = -1
+
+
+def _pixel_bounds(geotransform, envelopes):
+    """(col0, col1, row0, row1) pixel ranges of (minx, maxx, miny, maxy) envelopes"""
+    gt = geotransform
+    col0 = np.floor((envelopes[:, 0] - gt[0]) / gt[1])
+    col1 = np.ceil((envelopes[:, 1] - gt[0]) / gt[1])
+    row0 = np.floor((envelopes[:, 3] - gt[3]) / gt[5])
+    row1 = np.ceil((envelopes[:, 2] - gt[3]) / gt[5])
+    return col0, col1, row0, row1
+
+
+def zonal_class_areas(src_path, geometries, lut, points=None, feedback=None):
+    """Area of every land cover class under every zone in one pass over the source
+
+    ``geometries`` are zone polygons as wkb in the source crs, the zone id is
+    the list position. Each block only rasterizes the zone ids of the zones
+    whose envelope touches it and accumulates class areas with a single
+    ``bincount``, blocks without zones are never read. Pixels are assigned by
+    their centre, so zones are expected not to overlap.
+
+    ``points``, one (x, y) per zone, are sampled in the same pass and give
+    the class of zones too small to contain a pixel centre.
+
+    Returns the (zones, classes) area array, the class values of its columns
+    and the column of the class under each point, -1 when unknown.
+    """
+    src = gdal.Open(src_path, gdal.GA_ReadOnly)
+    if src is None:
+        raise RuntimeError(f"unable to open land cover raster: {src_path}")
+    src_band = src.GetRasterBand(1)
+    if src_band.DataType != gdal.GDT_Byte:
+        raise RuntimeError(f"land cover raster must be uint8: {src_path}")
+    src_nodata = src_band.GetNoDataValue()
+    class_nodata = LC_NODATA if src_nodata is None else int(src_nodata)
+
+    # one column per class mapped by any lookup table, nodata and unmapped classes are dropped
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float32))
+    classes = np.flatnonzero((luts != NODATA_N).any(axis=0))
+    classes = classes[classes != class_nodata]
+    slots = np.full(256, -1, dtype=np.int64)
+    slots[classes] = np.arange(classes.size)
+    nslots = classes.size
+
+    gt = src.GetGeoTransform()
+    pixel_areas = row_areas(gt, src.GetProjection(), src.RasterYSize)
+    zones = [ogr.CreateGeometryFromWkb(bytes(wkb)) if wkb else None for wkb in geometries]
+    envelopes = np.array([zone.GetEnvelope() if zone is not None else (np.nan,) * 4 for zone in zones], dtype=np.float64).reshape(-1, 4)
+    col0, col1, row0, row1 = _pixel_bounds(gt, envelopes)
+    has_zone = ~np.isnan(col0)
+
+    areas = np.zeros((len(zones), nslots), dtype=np.float64)
+    point_slots = np.full(len(zones), -1, dtype=np.int64)
+    if points is not None and len(points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        point_cols = np.floor((points[:, 0] - gt[0]) / gt[1])
+        point_rows = np.floor((points[:, 1] - gt[3]) / gt[5])
+    else:
+        point_cols = point_rows = np.full(len(zones), np.nan)
+
+    driver = ogr.GetDriverByName("Memory") or ogr.GetDriverByName("MEM")
+    windows = list(iter_windows(src.RasterXSize, src.RasterYSize, DEFAULT_BLOCK_SIZE, DEFAULT_BLOCK_SIZE))
+    for current, (xoff, yoff, xsize, ysize) in enumerate(windows):
+        if feedback is not None and feedback.isCanceled():
+            break
+        selected = np.flatnonzero(has_zone & (col0 < xoff + xsize) & (col1 > xoff) & (row0 < yoff + ysize) & (row1 > yoff))
+        sampled = np.flatnonzero(
+            (point_cols >= xoff) & (point_cols < xoff + xsize) & (point_rows >= yoff) & (point_rows < yoff + ysize)
+        )
+        if selected.size or sampled.size:
+            data = src_band.ReadAsArray(xoff, yoff, xsize, ysize)
+            if sampled.size:
+                point_slots[sampled] = slots[data[point_rows[sampled].astype(np.int64) - yoff, point_cols[sampled].astype(np.int64) - xoff]]
+
+        if selected.size:
+            # burn the ids of the zones touching this block only
+            source = driver.CreateDataSource("zones")
+            layer = source.CreateLayer("zones", geom_type=ogr.wkbUnknown)
+            layer.CreateField(ogr.FieldDefn("zone", ogr.OFTInteger))
+            definition = layer.GetLayerDefn()
+            for zone in selected:
+                feature = ogr.Feature(definition)
+                feature.SetField(0, int(zone))
+                feature.SetGeometry(zones[zone])
+                layer.CreateFeature(feature)
+            target = gdal.GetDriverByName("MEM").Create("", xsize, ysize, 1, gdal.GDT_Int32)
+            target.SetGeoTransform((gt[0] + xoff * gt[1], gt[1], gt[2], gt[3] + yoff * gt[5], gt[4], gt[5]))
+            target.GetRasterBand(1).Fill(ZONE_NODATA)
+            gdal.RasterizeLayer(target, [1], layer, options=["ATTRIBUTE=zone"])
+            ids = target.GetRasterBand(1).ReadAsArray()
+            target = layer = source = None
+
+            slot = slots[data]
+            hit = (ids != ZONE_NODATA) & (slot >= 0)
+            if hit.any():
+                # accumulate over the id range of the block only
+                zone_ids = ids[hit].astype(np.int64)
+                first, last = zone_ids.min(), zone_ids.max()
+                weights = np.broadcast_to(pixel_areas[yoff:yoff + ysize, None], (ysize, xsize))[hit]
+                counts = np.bincount((zone_ids - first) * nslots + slot[hit], weights=weights, minlength=(last - first + 1) * nslots)
+                areas[first:last + 1] += counts.reshape(-1, nslots)
+        if feedback is not None:
+            feedback.setProgress(100.0 * (current + 1) / len(windows))
+
+    src = None
+    return areas, classes, point_slots
+
+
+def zonal_statistics(areas, classes, lut, point_slots=None):
+    """Area-weighted n per zone and scenario and class fractions per zone
+
+    Zones without a pixel centre fall back to the class under their point
+    when ``point_slots`` is given. n is NaN where no value can be derived.
+    Returns the (zones, scenarios) n array and the (zones, classes) fractions.
+    """
+    luts = np.atleast_2d(np.asarray(lut, dtype=np.float64))[:, classes]
+    mapped = luts != NODATA_N
+    weight = areas @ mapped.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_values = (areas @ np.where(mapped, luts, 0.0).T) / weight
+        total = areas.sum(axis=1)
+        fractions = areas / total[:, None]
+
+    if point_slots is not None:
+        fallback = (total == 0) & (point_slots >= 0)
+        slot = point_slots[fallback]
+        n_values[fallback] = np.where(mapped[:, slot], luts[:, slot], np.nan).T
+        fractions[fallback] = 0.0
+        fractions[fallback, slot] = 1.0
+    return n_values, fractions